@@ -0,0 +1,76 @@
+"""
+流水线启动基准：端到端挂载延迟
+
+用法（需 root；非 RAW 镜像另需 qemu-nbd 与 nbd 内核模块）:
+    sudo python benchmarks/bench_startup.py disk.qcow2 [--rounds 5] [--nbd-backend auto]
+
+每轮先清空主机页缓存，然后从构造 NBDMountTool 开始计时，到所有分区挂载完成为止:
+  1. sequential - 构造时同步验证格式，启动步骤逐个执行（原有流程）
+  2. pipelined  - 验证、backing 链检查、设备预选与分区表解析并行，验证通过后立即连接
+  3. partition  - 指定 --partition 时：流水线启动，只导出并挂载该分区（无分区扫描）
+最后输出各模式的中位数，以及最后一轮流水线启动的各步骤时间线
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from nbdmount.core.device import DEVICE_BACKENDS  # noqa: E402
+from nbdmount.core.manager import NBDMountTool  # noqa: E402
+
+
+def drop_caches() -> None:
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def run_session(image: str, backend: str, pipelined: bool, mount_dir: Path, partition=None):
+    drop_caches()
+    start = time.perf_counter()
+    tool = NBDMountTool(image, backend=backend, pipelined=pipelined, shared=False, partition=partition)
+    with tool.session(str(mount_dir)) as mounts:
+        elapsed = time.perf_counter() - start
+        mounted = len(mounts)
+    return elapsed, mounted, tool.startup
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--nbd-backend", default="auto", choices=DEVICE_BACKENDS)
+    parser.add_argument("--partition", metavar="SPEC", help="同时测量单分区模式（分区号、名称、卷标或类型 GUID）")
+    args = parser.parse_args()
+
+    sequential, pipelined, single = [], [], []
+    startup = None
+    with tempfile.TemporaryDirectory() as mnt:
+        mount_dir = Path(mnt)
+        for i in range(args.rounds):
+            s, n, _ = run_session(args.image, args.nbd_backend, False, mount_dir)
+            p, _, startup = run_session(args.image, args.nbd_backend, True, mount_dir)
+            sequential.append(s)
+            pipelined.append(p)
+            line = f"第 {i + 1} 轮 ({n} 个挂载点): sequential {s:.3f}s  pipelined {p:.3f}s"
+            if args.partition:
+                single.append(run_session(args.image, args.nbd_backend, True, mount_dir, args.partition)[0])
+                line += f"  partition {single[-1]:.3f}s"
+            print(line)
+
+    s, p = statistics.median(sequential), statistics.median(pipelined)
+    print(f"\n中位数: sequential {s:.3f}s, pipelined {p:.3f}s, 加速 {s / p:.2f}x")
+    if single:
+        print(f"单分区 ({args.partition}): {statistics.median(single):.3f}s")
+    if startup:
+        print(startup.format_report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
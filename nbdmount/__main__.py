@@ -1,129 +1,444 @@
-"""
-命令行主入口 - 体现专业工具设计
-"""
-import sys
-import logging
-import shutil
-from pathlib import Path
-from .cli.parser import parse_arguments, setup_logging
-from .core.manager import NBDMountTool
-from .exceptions.errors import (
-    NBDException, PermissionError, ImageFormatError, 
-    DeviceNotFoundError, MountError
-)
-
-
-logger = logging.getLogger(__name__)
-
-
-def action_mount(tool: NBDMountTool, args) -> int:
-    """挂载动作"""
-    logger.info("开始挂载镜像分区...")
-    try:
-        mounts = tool.mount_image(
-            mount_dir=args.mount_dir,
-            mount_options=None if args.rw else ["ro", "noload"]
-        )
-        
-        if mounts:
-            logger.info("\n✓ 挂载成功:")
-            for part, mp in mounts.items():
-                logger.info(f"  {part:20s} -> {mp}")
-            logger.info("\n💡 提示: 使用 'nbdmount <image> umount' 或重启系统来清理挂载")
-            return 0
-        else:
-            logger.error("✗ 未挂载任何分区")
-            return 1
-    except MountError as e:
-        logger.error(f"挂载失败: {e}")
-        return 2
-
-
-def action_list(tool: NBDMountTool, args) -> int:
-    """列出分区动作"""
-    logger.info("检测镜像分区...")
-    partitions = tool.list_partitions()
-    
-    if partitions:
-        logger.info(f"\n✓ 在镜像中找到 {len(partitions)} 个分区:")
-        for i, part in enumerate(partitions, 1):
-            logger.info(f"  {i}. {part}")
-        return 0
-    else:
-        logger.warning("⚠ 未检测到分区（可能是无分区表的裸文件系统）")
-        return 0
-
-
-def action_info(tool: NBDMountTool, args) -> int:
-    """镜像信息动作"""
-    info = tool.get_image_info()
-    logger.info("\n镜像信息:")
-    logger.info(f"  路径:     {info['path']}")
-    logger.info(f"  格式:     {info['format']}")
-    logger.info(f"  大小:     {info['size_gb']:.2f} GB ({info['size_bytes']} bytes)")
-    logger.info(f"  挂载模式: {'读写' if not info['read_only'] else '只读'}")
-    return 0
-
-
-def action_check(tool: NBDMountTool, args) -> int:
-    """环境检查动作"""
-    logger.info("检查运行环境...")
-    try:
-        NBDMountTool.check_prerequisites()
-        logger.info("✓ 所有前提条件满足")
-        return 0
-    except Exception as e:
-        logger.error(f"✗ 环境检查失败: {e}")
-        return 1
-
-
-def main(argv: list = None) -> int:
-    """主函数"""
-    args = parse_arguments(argv)
-    setup_logging(args.debug)
-    
-    # 环境检查
-    try:
-        NBDMountTool.check_prerequisites()
-    except Exception as e:
-        logger.error(f"环境检查失败: {e}")
-        return 1
-    
-    # 创建工具实例
-    try:
-        tool = NBDMountTool(
-            image_path=args.image,
-            image_format=args.format,
-            read_only=not args.rw
-        )
-    except ImageFormatError as e:
-        logger.error(f"镜像格式错误: {e}")
-        logger.info("提示: 使用 --format 参数指定格式，如 --format qcow2")
-        return 1
-    except Exception as e:
-        logger.exception(f"初始化失败: {e}")
-        return 1
-    
-    # 执行动作
-    action_map = {
-        "mount": action_mount,
-        "list": action_list,
-        "info": action_info,
-        "check": action_check,
-    }
-    
-    try:
-        return action_map[args.action](tool, args)
-    except KeyboardInterrupt:
-        logger.warning("\n操作被用户中断")
-        return 130
-    except NBDException as e:
-        logger.error(f"操作失败: {e}")
-        return 2
-    except Exception as e:
-        logger.exception(f"未预期错误: {e}")
-        return 3
-
-
-if __name__ == "__main__":
+"""
+命令行主入口 - 体现专业工具设计
+"""
+import sys
+import json
+import logging
+import shutil
+import stat
+import time
+from pathlib import Path
+from typing import Optional
+from .cli.parser import parse_arguments, setup_logging, IMAGELESS_ACTIONS, FILESYSTEM_ACTIONS
+from .core.manager import NBDMountTool
+from .core.cgroup import CgroupManager, SessionBudget
+from .core.journal import DEFAULT_RUN_DIR, cleanup_stale_sessions, is_owner_alive
+from .core.partition import open_filesystem
+from .core.shared import SharedRegistry
+from .core.export import ExportServer
+from .analysis.indexer import ManifestIndexer
+from .analysis.diff import ImageDiff, resolve_ext_files
+from .analysis.scanner import ContentScanner, FilenameScanner, HashSetScanner, SignatureScanner
+from .exceptions.errors import (
+    NBDException, PermissionError, ImageError, ImageFormatError, 
+    DeviceNotFoundError, MountError
+)
+
+
+logger = logging.getLogger(__name__)
+
+# 未指定 --priority 时按批量任务处理的动作
+BULK_ACTIONS = {"serve", "scan", "index", "diff"}
+
+
+def action_mount(tool: NBDMountTool, args) -> int:
+    """挂载动作"""
+    logger.info("开始挂载镜像分区...")
+    if args.watchdog:
+        return _mount_watched(tool, args)
+    try:
+        # 挂载选项按各分区的文件系统类型选择（只读时 ext3/4 加 noload，xfs 加 norecovery）
+        mounts = tool.mount_image(mount_dir=args.mount_dir)
+        
+        if mounts:
+            logger.info("\n✓ 挂载成功:")
+            for part, mp in mounts.items():
+                logger.info(f"  {part:20s} -> {mp}")
+            logger.info("\n💡 提示: 使用 'nbdmount <image> umount' 或重启系统来清理挂载")
+            return 0
+        else:
+            logger.error("✗ 未挂载任何分区")
+            return 1
+    except MountError as e:
+        logger.error(f"挂载失败: {e}")
+        return 2
+
+
+def _mount_watched(tool: NBDMountTool, args) -> int:
+    """挂载后保持前台运行并监视连接，Ctrl+C 时卸载退出"""
+    try:
+        with tool.session(args.mount_dir) as mounts:
+            if not mounts:
+                logger.error("✗ 未挂载任何分区")
+                return 1
+            logger.info("\n✓ 挂载成功:")
+            for part, mp in mounts.items():
+                logger.info(f"  {part:20s} -> {mp.mount_path}")
+            health = tool.device.health
+            if health is None:
+                logger.warning(f"⚠ {tool.device.BACKEND} 后端没有可监视的服务进程")
+            logger.info("\n💡 提示: 正在监视连接，Ctrl+C 卸载并退出")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                logger.info("\n收到中断，卸载...")
+                if health is not None:
+                    logger.info(f"  重连 {health.reconnects} 次，I/O 停滞 {health.stalls} 次")
+        return 0
+    except MountError as e:
+        logger.error(f"挂载失败: {e}")
+        return 2
+
+
+def action_list(tool: NBDMountTool, args) -> int:
+    """列出分区动作"""
+    logger.info("检测镜像分区...")
+    partitions = tool.list_partitions()
+    
+    if partitions:
+        logger.info(f"\n✓ 在镜像中找到 {len(partitions)} 个分区:")
+        for i, part in enumerate(partitions, 1):
+            logger.info(f"  {i}. {part}")
+        return 0
+    else:
+        logger.warning("⚠ 未检测到分区（可能是无分区表的裸文件系统）")
+        return 0
+
+
+def action_info(tool: NBDMountTool, args) -> int:
+    """镜像信息动作"""
+    info = tool.get_image_info()
+    logger.info("\n镜像信息:")
+    logger.info(f"  路径:     {info['path']}")
+    logger.info(f"  格式:     {info['format']}")
+    logger.info(f"  大小:     {info['size_gb']:.2f} GB ({info['size_bytes']} bytes)")
+    logger.info(f"  挂载模式: {'读写' if not info['read_only'] else '只读'}")
+    return 0
+
+
+def action_check(tool: NBDMountTool, args) -> int:
+    """环境检查动作"""
+    logger.info("检查运行环境...")
+    try:
+        NBDMountTool.check_prerequisites()
+        logger.info("✓ 所有前提条件满足")
+        return 0
+    except Exception as e:
+        logger.error(f"✗ 环境检查失败: {e}")
+        return 1
+
+
+def action_cleanup(tool: NBDMountTool, args) -> int:
+    """清理残留会话动作"""
+    logger.info("重放会话日志，查找残留会话...")
+    orphans = cleanup_stale_sessions(max_workers=args.workers, dry_run=args.dry_run)
+    for record in orphans:
+        logger.info(f"  {record.device:12s} {record.image} (owner={record.owner}, mounts={len(record.mounts)})")
+    if orphans and not args.dry_run:
+        logger.info(f"\n✓ 已处理 {len(orphans)} 个残留会话")
+    return 0
+
+
+def _log_budgets() -> None:
+    """列出会话 cgroup 节点及其 io.stat 统计"""
+    groups = [g for g in CgroupManager().sessions() if g.pids()]
+    if not groups:
+        return
+    logger.info(f"\n资源预算 ({len(groups)}):")
+    for group in groups:
+        io = group.io_totals()
+        logger.info(f"  {group.name:24s} {group.priority:12s} PID {','.join(map(str, group.pids()))}  "
+                    f"读 {io['rbytes'] / (1 << 20):.1f} MB / {io['rios']} 次  "
+                    f"写 {io['wbytes'] / (1 << 20):.1f} MB / {io['wios']} 次")
+
+
+def action_sessions(tool: NBDMountTool, args) -> int:
+    """列出共享会话动作"""
+    _log_health()
+    _log_budgets()
+    sessions = SharedRegistry().list_sessions()
+    if not sessions:
+        logger.info("没有共享会话")
+        return 0
+    logger.info(f"\n共享会话 ({len(sessions)}):")
+    for state in sessions:
+        holders = state.get("holders", [])
+        budget = state.get("budget")
+        note = f" 预算 {budget['priority']}{'' if budget['applied'] else '（未生效）'}" if budget else ""
+        logger.info(f"  {state.get('device', '?'):12s} {state.get('image')} "
+                    f"[{state.get('format')}, {state.get('backend')}] 引用 {len(holders)}{note}")
+        for source, path in state.get("mounts", {}).items():
+            logger.info(f"      {source:20s} -> {path}")
+        for holder in holders:
+            binds = f"，绑定挂载到 {holder['mount_dir']}" if holder.get("binds") else ""
+            logger.info(f"      持有者 PID {holder['pid']}{binds}")
+    return 0
+
+
+def _log_health() -> None:
+    """列出仍在监视中的设备健康状态（<运行目录>/health）"""
+    states = []
+    for path in sorted((Path(DEFAULT_RUN_DIR) / "health").glob("*.json")):
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if is_owner_alive(state.get("monitor", 0)):
+            states.append(state)
+    if not states:
+        return
+    logger.info(f"\n连接健康 ({len(states)}):")
+    for state in states:
+        error = f"，最近错误: {state['last_error']}" if state.get("last_error") else ""
+        logger.info(f"  {state['device']:12s} {state['state']:12s} [{state.get('backend')}] "
+                    f"重连 {state.get('reconnects', 0)} 次，停滞 {state.get('stalls', 0)} 次{error}")
+
+
+def action_serve(tool: NBDMountTool, args) -> int:
+    """共享导出动作"""
+    name = args.export_name or tool.image_path.stem.replace(" ", "_")
+    server = ExportServer(
+        tool.image,
+        name,
+        socket_path=args.socket,
+        bind=args.bind,
+        port=args.port,
+        shared=args.shared,
+        idle_timeout=args.idle_timeout or None,
+        budget=tool.budget
+    )
+    with server:
+        logger.info(f"\n✓ 导出已就绪: {server.uri}")
+        logger.info(f"💡 提示: 使用 'nbdmount --export {name} mount' 连接该导出，Ctrl+C 停止")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("\n收到中断，关停导出...")
+    return 0
+
+
+def action_index(tool: NBDMountTool, args) -> int:
+    """文件清单索引动作"""
+    output = args.output or f"{tool.image_path.stem}.manifest.db"
+    indexer = ManifestIndexer(
+        output,
+        previous=args.previous,
+        hash_algo=args.hash,
+        workers=args.workers
+    )
+    with tool.session(mount_dir=args.mount_dir) as mounts:
+        if not mounts:
+            logger.error("✗ 未挂载任何分区")
+            return 1
+        stats = indexer.index(mounts)
+    logger.info(f"\n✓ 索引完成: {stats.entries} 个条目，重新哈希 {stats.hashed}，复用 {stats.reused}，"
+                f"耗时 {stats.elapsed:.1f}s")
+    return 0
+
+
+def action_scan(tool: NBDMountTool, args) -> int:
+    """并行内容扫描动作"""
+    scanners = []
+    if args.hash_list:
+        scanners.append(HashSetScanner.from_file(args.hash_list))
+    if args.signatures:
+        scanners.append(SignatureScanner.from_file(args.signatures))
+    if args.name_pattern:
+        scanners.append(FilenameScanner(args.name_pattern))
+    scanner = ContentScanner(
+        scanners,
+        workers=args.workers,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        exclude=args.exclude
+    )
+    logger.info(f"扫描器: {scanners}")
+    
+    out = sys.stdout if args.output in (None, "-") else open(args.output, "w", encoding="utf-8")
+    try:
+        with tool.session(mount_dir=args.mount_dir) as mounts:
+            if not mounts:
+                logger.error("✗ 未挂载任何分区")
+                return 1
+            stats = scanner.scan(mounts, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"\n✓ 扫描 {stats.files} 个文件（跳过 {stats.skipped}），命中 {stats.findings}，"
+                f"{stats.throughput:.1f} MB/s，耗时 {stats.elapsed:.1f}s")
+    return 0
+
+
+def action_diff(tool: NBDMountTool, args) -> int:
+    """块级差异动作"""
+    logger.info(f"比较 {tool.image_path.name} -> {Path(args.against).name} ...")
+    report = ImageDiff(str(tool.image_path), args.against, workers=args.workers).run()
+    
+    if args.resolve and report.by_partition:
+        # 连接新镜像，把分区内的变化区段解析为文件
+        other = NBDMountTool(args.against, read_only=True, journal=tool.journal, backend=args.nbd_backend)
+        with other.device.connect(read_only=True) as dev:
+            for label, extents in report.by_partition.items():
+                if label == "unpartitioned":
+                    continue
+                target = dev.device_path if label == "whole_disk" else f"{dev.device_path}{label}"
+                if target != dev.device_path and target not in dev.partitions:
+                    logger.warning(f"未找到分区设备 {target}，跳过文件解析")
+                    continue
+                report.files[label] = resolve_ext_files(target, extents)
+    
+    logger.info(f"\n✓ 变化 {report.changed_bytes / (1 << 20):.1f} MB，"
+                f"共享簇 {report.units_shared}/{report.units_total}，耗时 {report.elapsed:.1f}s")
+    for label, extents in report.by_partition.items():
+        changed = sum(n for _, n in extents)
+        logger.info(f"  {label:14s} {len(extents):6d} 个区段  {changed / (1 << 20):10.1f} MB")
+        for path in report.files.get(label, [])[:50]:
+            logger.info(f"      {path}")
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report.to_dict(), f, indent=2, ensure_ascii=False)
+        logger.info(f"报告已写入 {args.output}")
+    return 0
+
+
+def _format_entry(st, name: str, target: str = "") -> str:
+    mtime = time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_mtime))
+    link = f" -> {target}" if target else ""
+    return f"{stat.filemode(st.st_mode)} {st.st_nlink:>3} {st.st_uid:>5} {st.st_gid:>5} {st.st_size:>12} {mtime} {name}{link}"
+
+
+def action_ls(tool, args) -> int:
+    """列出镜像内目录动作（用户态读取，无需挂载）"""
+    paths = args.paths or ["/"]
+    status = 0
+    with open_filesystem(args.image, args.partition) as fs:
+        for path in paths:
+            try:
+                st = fs.stat(path)
+                if not stat.S_ISDIR(st.st_mode):
+                    print(_format_entry(st, path))
+                    continue
+                if len(paths) > 1:
+                    print(f"{path}:")
+                base = path.rstrip("/")
+                for entry in sorted(fs.scandir(path), key=lambda e: e.name):
+                    child = f"{base}/{entry.name}"
+                    st = fs.lstat(child)
+                    target = fs.readlink(child) if stat.S_ISLNK(st.st_mode) else ""
+                    print(_format_entry(st, entry.name, target))
+            except OSError as e:
+                logger.error(f"✗ {path}: {e.strerror or e}")
+                status = 1
+    return status
+
+
+def action_cat(tool, args) -> int:
+    """输出镜像内文件动作（用户态读取，无需挂载）"""
+    out = sys.stdout.buffer
+    status = 0
+    with open_filesystem(args.image, args.partition) as fs:
+        for path in args.paths:
+            try:
+                with fs.open(path) as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+            except OSError as e:
+                logger.error(f"✗ {path}: {e.strerror or e}")
+                status = 1
+    out.flush()
+    return status
+
+
+def _budget_from_args(args) -> Optional[SessionBudget]:
+    """按命令行参数构造资源预算，未指定任何预算参数时为 None"""
+    limits = (args.io_rbps, args.io_wbps, args.io_riops, args.io_wiops,
+              args.io_weight, args.cpu_weight, args.memory_high)
+    if args.priority is None and all(v is None for v in limits):
+        return None
+    priority = args.priority or ("bulk" if args.action in BULK_ACTIONS else "interactive")
+    return SessionBudget(
+        priority,
+        read_bps=args.io_rbps,
+        write_bps=args.io_wbps,
+        read_iops=args.io_riops,
+        write_iops=args.io_wiops,
+        io_weight=args.io_weight,
+        cpu_weight=args.cpu_weight,
+        memory_high=args.memory_high
+    )
+
+
+def main(argv: list = None) -> int:
+    """主函数"""
+    args = parse_arguments(argv)
+    setup_logging(args.debug)
+    
+    # 用户态读取文件系统：不需要 root 与 NBD 设备
+    if args.action in FILESYSTEM_ACTIONS:
+        return _run_action(args, None)
+    
+    # 环境检查
+    try:
+        NBDMountTool.check_prerequisites()
+    except Exception as e:
+        logger.error(f"环境检查失败: {e}")
+        return 1
+    
+    # 无需镜像的动作
+    if args.action in IMAGELESS_ACTIONS:
+        return _run_action(args, None)
+    
+    # 创建工具实例
+    try:
+        tool = NBDMountTool(
+            image_path=args.image,
+            image_format=args.format,
+            read_only=not args.rw,
+            export=args.export,
+            prefetch=args.prefetch,
+            backend=args.nbd_backend,
+            luks_key_file=args.luks_key_file,
+            pipelined=args.action in ("mount", "index", "scan"),
+            shared=not args.exclusive,
+            partition=args.partition,
+            watchdog=args.watchdog,
+            io_timeout=args.io_timeout,
+            budget=_budget_from_args(args)
+        )
+    except ImageFormatError as e:
+        logger.error(f"镜像格式错误: {e}")
+        logger.info("提示: 使用 --format 参数指定格式，如 --format qcow2")
+        return 1
+    except ImageError as e:
+        logger.error(f"镜像错误: {e}")
+        return 1
+    except Exception as e:
+        logger.exception(f"初始化失败: {e}")
+        return 1
+    
+    return _run_action(args, tool)
+
+
+def _run_action(args, tool) -> int:
+    """执行动作"""
+    action_map = {
+        "mount": action_mount,
+        "list": action_list,
+        "info": action_info,
+        "check": action_check,
+        "cleanup": action_cleanup,
+        "sessions": action_sessions,
+        "serve": action_serve,
+        "index": action_index,
+        "diff": action_diff,
+        "scan": action_scan,
+        "ls": action_ls,
+        "cat": action_cat,
+    }
+    
+    try:
+        return action_map[args.action](tool, args)
+    except KeyboardInterrupt:
+        logger.warning("\n操作被用户中断")
+        return 130
+    except NBDException as e:
+        logger.error(f"操作失败: {e}")
+        return 2
+    except Exception as e:
+        logger.exception(f"未预期错误: {e}")
+        return 3
+
+
+if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+增量文件清单索引 - 并行遍历已挂载分区，复用上一快照的哈希
+
+清单是一个 SQLite 文件（files 表按 (partition, path) 聚簇），记录路径、大小、权限、
+修改时间、inode 与可选的内容哈希。路径以原始字节（os.fsencode）存为 BLOB，
+非 UTF-8 文件名原样保留。指定上一快照的清单后，(size, mtime, inode)
+均未变化的文件直接沿用旧哈希，只对变化的文件重新计算
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import stat
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from ..core.mounter import MountPoint
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = "2"
+_HASH_CHUNK = 1 << 20
+
+# (partition, path, size, mode, mtime_ns, ino, hash)
+Row = Tuple[str, bytes, int, int, int, int, Optional[bytes]]
+
+
+class IndexStats:
+    """索引统计"""
+
+    def __init__(self):
+        self.entries = 0
+        self.dirs = 0
+        self.hashed = 0
+        self.reused = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    def __repr__(self) -> str:
+        return (f"IndexStats(entries={self.entries}, dirs={self.dirs}, hashed={self.hashed}, "
+                f"reused={self.reused}, errors={self.errors}, elapsed={self.elapsed:.2f}s)")
+
+
+def _hash_file(path: str, algo: str) -> Optional[bytes]:
+    """计算文件内容哈希（hashlib 在大块更新时释放 GIL，可在线程池中并行）"""
+    h = hashlib.new(algo)
+    try:
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                chunk = f.read(_HASH_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+    except OSError as e:
+        logger.debug(f"哈希 {path} 失败: {e}")
+        return None
+    return h.digest()
+
+
+def scan_dir(path: str, root_dev: int) -> Tuple[List[Tuple[str, os.stat_result]], List[str], int]:
+    """
+    扫描单个目录
+
+    :return: (条目列表, 需继续遍历的子目录, 错误数)
+    """
+    entries, subdirs, errors = [], [], 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    errors += 1
+                    continue
+                entries.append((entry.path, st))
+                # 不跨越文件系统边界
+                if stat.S_ISDIR(st.st_mode) and st.st_dev == root_dev:
+                    subdirs.append(entry.path)
+    except OSError as e:
+        logger.debug(f"无法读取目录 {path}: {e}")
+        errors += 1
+    return entries, subdirs, errors
+
+
+class ManifestIndexer:
+    """
+    文件清单索引器
+
+    设计亮点:
+    - 目录级任务并行 scandir，主线程单写 SQLite
+    - 哈希与遍历流水线并行
+    - 以 (size, mtime_ns, ino) 判断变化，未变化文件零读取
+    """
+
+    def __init__(
+        self,
+        output: str,
+        previous: Optional[str] = None,
+        hash_algo: Optional[str] = None,
+        workers: int = 8
+    ):
+        """
+        :param output: 输出清单路径（已存在时覆盖）
+        :param previous: 上一快照的清单，用于复用哈希
+        :param hash_algo: hashlib 算法名，为空时不计算哈希
+        :param workers: 并行线程数
+        """
+        if hash_algo and hash_algo not in hashlib.algorithms_available:
+            raise ValueError(f"不支持的哈希算法: {hash_algo}")
+        self.output = Path(output)
+        self.previous = Path(previous) if previous else None
+        self.hash_algo = hash_algo
+        self.workers = max(1, workers)
+
+    def _load_previous(self) -> Dict[Tuple[str, bytes], Tuple[int, int, int, Optional[bytes]]]:
+        """读取上一快照：{(partition, 路径字节): (size, mtime_ns, ino, hash)}"""
+        if not self.previous:
+            return {}
+        conn = None
+        try:
+            conn = sqlite3.connect(f"file:{self.previous}?mode=ro", uri=True)
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("hash_algo") != self.hash_algo:
+                logger.warning(f"上一清单哈希算法为 {meta.get('hash_algo')}，无法复用哈希")
+                return {}
+            # schema 1 的清单以 TEXT 存路径，统一换成字节
+            return {
+                (part, path if isinstance(path, bytes) else os.fsencode(path)): (size, mtime, ino, digest)
+                for part, path, size, mtime, ino, digest in conn.execute(
+                    "SELECT partition, path, size, mtime_ns, ino, hash FROM files WHERE hash IS NOT NULL"
+                )
+            }
+        except sqlite3.Error as e:
+            # 文件不存在、已损坏或不是本工具生成的清单：全部重新计算
+            logger.warning(f"无法读取上一清单 {self.previous}，将完整计算哈希: {e}")
+            return {}
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @property
+    def _tmp_path(self) -> Path:
+        return self.output.with_name(self.output.name + ".tmp")
+
+    def _create_db(self) -> sqlite3.Connection:
+        tmp = self._tmp_path
+        tmp.unlink(missing_ok=True)
+        conn = sqlite3.connect(str(tmp))
+        conn.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE files (
+                partition TEXT NOT NULL,
+                path      BLOB NOT NULL,
+                size      INTEGER NOT NULL,
+                mode      INTEGER NOT NULL,
+                mtime_ns  INTEGER NOT NULL,
+                ino       INTEGER NOT NULL,
+                hash      BLOB,
+                PRIMARY KEY (partition, path)
+            ) WITHOUT ROWID;
+        """)
+        return conn
+
+    def index(self, mounts: Dict[str, MountPoint]) -> IndexStats:
+        """
+        索引所有已挂载分区
+
+        :param mounts: {分区: MountPoint}，通常来自 NBDMountTool.session()
+        :return: IndexStats
+        """
+        stats = IndexStats()
+        start = time.perf_counter()
+        previous = self._load_previous()
+        conn = self._create_db()
+        try:
+            self._build(conn, mounts, previous, stats)
+        except BaseException:
+            # 遍历或写入失败：不留半成品
+            conn.close()
+            self._tmp_path.unlink(missing_ok=True)
+            raise
+        conn.close()
+        os.replace(self._tmp_path, self.output)
+
+        stats.elapsed = time.perf_counter() - start
+        logger.info(f"✓ 清单已写入 {self.output}: {stats}")
+        return stats
+
+    def _build(self, conn: sqlite3.Connection, mounts: Dict[str, MountPoint],
+               previous: Dict[Tuple[str, bytes], Tuple[int, int, int, Optional[bytes]]], stats: IndexStats) -> None:
+        """遍历各分区并写入清单（未提交前调用方负责清理）"""
+        rows: List[Row] = []
+        hash_jobs: Dict[Future, Row] = {}
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="index-walk") as walkers, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix="index-hash") as hashers:
+            pending: Set[Future] = set()
+            roots: Dict[Future, Tuple[str, str, int]] = {}  # future -> (分区名, 根目录, 根设备号)
+
+            for mp in mounts.values():
+                if not mp.is_mounted:
+                    continue
+                root = str(mp.mount_path)
+                part = mp.mount_path.name  # part1 / whole_disk，跨快照稳定
+                root_dev = os.lstat(root).st_dev
+                fut = walkers.submit(scan_dir, root, root_dev)
+                pending.add(fut)
+                roots[fut] = (part, root, root_dev)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    part, root, root_dev = roots.pop(fut)
+                    entries, subdirs, errors = fut.result()
+                    stats.errors += errors
+                    stats.dirs += 1
+                    for sub in subdirs:
+                        nfut = walkers.submit(scan_dir, sub, root_dev)
+                        pending.add(nfut)
+                        roots[nfut] = (part, root, root_dev)
+                    for path, st in entries:
+                        # 文件名可能不是合法 UTF-8（surrogateescape 解码），按原始字节入库
+                        rel = os.fsencode(os.path.relpath(path, root))
+                        row: Row = (part, rel, st.st_size, st.st_mode, st.st_mtime_ns, st.st_ino, None)
+                        stats.entries += 1
+                        if self.hash_algo and stat.S_ISREG(st.st_mode):
+                            prev = previous.get((part, rel))
+                            if prev and prev[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                                row = row[:6] + (prev[3],)
+                                stats.reused += 1
+                            else:
+                                hash_jobs[hashers.submit(_hash_file, path, self.hash_algo)] = row
+                                continue
+                        rows.append(row)
+                if len(rows) >= 10000:
+                    conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                    rows.clear()
+
+            for fut, row in hash_jobs.items():
+                digest = fut.result()
+                if digest is None:
+                    stats.errors += 1
+                else:
+                    stats.hashed += 1
+                rows.append(row[:6] + (digest,))
+
+        conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("schema", SCHEMA_VERSION),
+            ("hash_algo", self.hash_algo),
+            ("created", str(time.time())),
+            ("previous", str(self.previous) if self.previous else None),
+        ])
+        conn.commit()
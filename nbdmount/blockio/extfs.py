@@ -0,0 +1,718 @@
+"""
+ext2/3/4 只读解析 - 不连接设备、不挂载，直接在用户态读取镜像中的目录与文件
+
+在 BlockReader（RAW/QCOW2）与分区偏移之上解析超级块、块组描述符、inode、
+extent 树与间接块、线性与 htree 目录以及内联数据。只读取查找路径上用到的元数据块，
+读取 /etc/os-release 这类小文件通常只需十几次 pread，不需要 root 权限与内核设备
+"""
+import errno
+import io
+import logging
+import os
+import stat
+import struct
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+from ..exceptions.errors import ImageFormatError
+from .reader import BlockReader
+
+
+logger = logging.getLogger(__name__)
+
+_SUPERBLOCK_OFFSET = 1024
+_EXT_MAGIC = 0xEF53
+ROOT_INODE = 2
+
+# 超级块特性位
+_COMPAT_HAS_JOURNAL = 0x4
+_INCOMPAT_COMPRESSION = 0x1
+_INCOMPAT_FILETYPE = 0x2
+_INCOMPAT_RECOVER = 0x4
+_INCOMPAT_JOURNAL_DEV = 0x8
+_INCOMPAT_META_BG = 0x10
+_INCOMPAT_EXTENTS = 0x40
+_INCOMPAT_64BIT = 0x80
+_INCOMPAT_FLEX_BG = 0x200
+_INCOMPAT_DIRDATA = 0x1000
+_INCOMPAT_UNSUPPORTED = _INCOMPAT_COMPRESSION | _INCOMPAT_JOURNAL_DEV | _INCOMPAT_DIRDATA
+_RO_COMPAT_SPARSE_SUPER = 0x1
+_FLAGS_UNSIGNED_HASH = 0x2
+
+# inode 标志
+_ENCRYPT_FL = 0x800
+_INDEX_FL = 0x1000
+_EXTENTS_FL = 0x80000
+_INLINE_DATA_FL = 0x10000000
+_CASEFOLD_FL = 0x40000000
+
+_EXTENT_MAGIC = 0xF30A
+_EXTENT_INIT_MAX = 32768
+_XATTR_MAGIC = 0xEA020000
+_XATTR_INDEX_SYSTEM = 7
+_I_BLOCK_SIZE = 60
+_MAX_SYMLINKS = 40
+_MAX_TREE_DEPTH = 5
+
+# 目录项文件类型 -> stat 类型位
+_DIRENT_TYPES = {
+    1: stat.S_IFREG, 2: stat.S_IFDIR, 3: stat.S_IFCHR, 4: stat.S_IFBLK,
+    5: stat.S_IFIFO, 6: stat.S_IFSOCK, 7: stat.S_IFLNK,
+}
+
+# htree 哈希
+_DX_HASH_LEGACY, _DX_HASH_HALF_MD4, _DX_HASH_TEA = 0, 1, 2
+_DX_HASH_UNSIGNED_OFFSET = 3
+_DX_DEFAULT_SEED = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476)
+_MASK32 = 0xFFFFFFFF
+
+
+# ---------- htree 目录哈希（fs/ext4/hash.c） ----------
+
+def _rol32(value: int, shift: int) -> int:
+    return ((value << shift) | (value >> (32 - shift))) & _MASK32
+
+
+def _str2hashbuf(msg: bytes, num: int, signed: bool) -> List[int]:
+    """把名字剩余部分的前 num*4 字节打包为 num 个 32 位字，填充值取自剩余长度"""
+    length = len(msg)
+    pad = (length | (length << 8)) & _MASK32
+    pad = (pad | (pad << 16)) & _MASK32
+    out = []
+    val = pad
+    for i, ch in enumerate(msg[:num * 4]):
+        if signed and ch >= 0x80:
+            ch -= 0x100
+        val = (ch + (val << 8)) & _MASK32
+        if i % 4 == 3:
+            out.append(val)
+            val = pad
+    if len(out) < num:
+        out.append(val)
+    out.extend([pad] * (num - len(out)))
+    return out
+
+
+def _half_md4(buf: List[int], data: List[int]) -> None:
+    a, b, c, d = buf
+
+    def f(x, y, z):
+        return z ^ (x & (y ^ z))
+
+    def g(x, y, z):
+        return ((x & y) + ((x ^ y) & z)) & _MASK32
+
+    def h(x, y, z):
+        return x ^ y ^ z
+
+    rounds = (
+        (f, 0, ((0, 3), (1, 7), (2, 11), (3, 19), (4, 3), (5, 7), (6, 11), (7, 19))),
+        (g, 0o13240474631, ((1, 3), (3, 5), (5, 9), (7, 13), (0, 3), (2, 5), (4, 9), (6, 13))),
+        (h, 0o15666365641, ((3, 3), (7, 9), (2, 11), (6, 15), (1, 3), (5, 9), (0, 11), (4, 15))),
+    )
+    for func, k, steps in rounds:
+        for i, (index, shift) in enumerate(steps):
+            x = data[index] + k
+            # 每步轮换 (a, b, c, d) -> (d, a, b, c)
+            if i % 4 == 0:
+                a = _rol32((a + func(b, c, d) + x) & _MASK32, shift)
+            elif i % 4 == 1:
+                d = _rol32((d + func(a, b, c) + x) & _MASK32, shift)
+            elif i % 4 == 2:
+                c = _rol32((c + func(d, a, b) + x) & _MASK32, shift)
+            else:
+                b = _rol32((b + func(c, d, a) + x) & _MASK32, shift)
+    for i, v in enumerate((a, b, c, d)):
+        buf[i] = (buf[i] + v) & _MASK32
+
+
+def _tea(buf: List[int], data: List[int]) -> None:
+    b0, b1 = buf[0], buf[1]
+    a, b, c, d = data
+    total = 0
+    for _ in range(16):
+        total = (total + 0x9E3779B9) & _MASK32
+        b0 = (b0 + ((((b1 << 4) + a) & _MASK32) ^ ((b1 + total) & _MASK32) ^ (((b1 >> 5) + b) & _MASK32))) & _MASK32
+        b1 = (b1 + ((((b0 << 4) + c) & _MASK32) ^ ((b0 + total) & _MASK32) ^ (((b0 >> 5) + d) & _MASK32))) & _MASK32
+    buf[0] = (buf[0] + b0) & _MASK32
+    buf[1] = (buf[1] + b1) & _MASK32
+
+
+def _legacy_hash(name: bytes, signed: bool) -> int:
+    hash0, hash1 = 0x12A3FE2D, 0x37ABE8F9
+    for ch in name:
+        if signed and ch >= 0x80:
+            ch -= 0x100
+        value = (hash1 + (hash0 ^ ((ch * 7152373) & _MASK32))) & _MASK32
+        if value & 0x80000000:
+            value = (value - 0x7FFFFFFF) & _MASK32
+        hash1, hash0 = hash0, value
+    return (hash0 << 1) & _MASK32
+
+
+def dx_hash(name: bytes, version: int, seed: Tuple[int, ...] = ()) -> Optional[int]:
+    """
+    计算目录项名字的 htree 主哈希
+
+    :param version: 哈希版本（已按超级块标志换算为有/无符号变体）
+    :param seed: 超级块 s_hash_seed，全零时使用默认种子
+    :return: 哈希值（最低位清零），不支持的版本（如 siphash）返回 None
+    """
+    signed = version < _DX_HASH_UNSIGNED_OFFSET
+    base = version % _DX_HASH_UNSIGNED_OFFSET if version < 6 else version
+    if base == _DX_HASH_LEGACY:
+        value = _legacy_hash(name, signed)
+    elif base in (_DX_HASH_HALF_MD4, _DX_HASH_TEA):
+        buf = list(seed) if any(seed) else list(_DX_DEFAULT_SEED)
+        step, words, transform = (32, 8, _half_md4) if base == _DX_HASH_HALF_MD4 else (16, 4, _tea)
+        for pos in range(0, len(name), step):
+            transform(buf, _str2hashbuf(name[pos:], words, signed))
+        value = buf[1] if base == _DX_HASH_HALF_MD4 else buf[0]
+    else:
+        return None
+    value &= ~1 & _MASK32
+    if value == 0x7FFFFFFF << 1:
+        value = (0x7FFFFFFF - 1) << 1
+    return value
+
+
+# ---------- 数据结构 ----------
+
+class _LRUCache:
+    """线程安全的小型 LRU 缓存"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: "OrderedDict" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+
+class ExtInode:
+    """解析后的 inode（只保留读取所需字段）"""
+
+    def __init__(self, number: int, raw: bytes):
+        self.number = number
+        (self.mode, uid_lo, size_lo, atime, ctime, mtime, _dtime, gid_lo,
+         self.links, _blocks, self.flags) = struct.unpack_from("<HHIiiiiHHII", raw, 0)
+        self.i_block = raw[40:40 + _I_BLOCK_SIZE]
+        self.file_acl, size_hi = struct.unpack_from("<II", raw, 104)
+        self.size = size_lo | (size_hi << 32)
+        uid_hi, gid_hi = struct.unpack_from("<HH", raw, 120)
+        self.uid = uid_lo | (uid_hi << 16)
+        self.gid = gid_lo | (gid_hi << 16)
+        self.extra = raw[128:128 + struct.unpack_from("<H", raw, 128)[0]] if len(raw) > 130 else b""
+        self.raw = raw
+        self.times = tuple(
+            self._time(seconds, offset)
+            for seconds, offset in ((atime, 0x8C), (mtime, 0x88), (ctime, 0x84))
+        )
+        # extent 树展开后的 [(逻辑块, 物理块, 长度, 已初始化)]，按需生成
+        self.extents: Optional[List[Tuple[int, int, int, bool]]] = None
+        self.extent_starts: List[int] = []
+
+    def _time(self, seconds: int, offset: int) -> float:
+        # i_*_extra: 低 2 位为纪元扩展，高 30 位为纳秒
+        if 128 + len(self.extra) < offset + 4:
+            return float(seconds)
+        extra, = struct.unpack_from("<I", self.raw, offset)
+        return seconds + ((extra & 3) << 32) + (extra >> 2) / 1e9
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    def ibody_xattr(self, index: int, name: bytes) -> Optional[bytes]:
+        """读取 inode 内扩展属性（内联数据存放在 system.data 中）"""
+        start = 128 + len(self.extra)
+        if len(self.raw) < start + 4 or struct.unpack_from("<I", self.raw, start)[0] != _XATTR_MAGIC:
+            return None
+        base = start + 4
+        pos = base
+        while pos + 16 <= len(self.raw):
+            name_len, name_index, value_offs, _inum, value_size = struct.unpack_from("<BBHII", self.raw, pos)
+            if name_len == 0 and name_index == 0 and value_offs == 0:
+                break
+            if name_index == index and self.raw[pos + 16:pos + 16 + name_len] == name:
+                return self.raw[base + value_offs:base + value_offs + value_size]
+            pos += (16 + name_len + 3) & ~3
+        return None
+
+    def to_stat(self) -> os.stat_result:
+        atime, mtime, ctime = self.times
+        return os.stat_result((self.mode, self.number, 0, self.links, self.uid, self.gid,
+                               self.size, atime, mtime, ctime))
+
+    def __repr__(self) -> str:
+        return f"ExtInode(number={self.number}, mode={stat.filemode(self.mode)}, size={self.size})"
+
+
+class DirEntry:
+    """目录项"""
+
+    def __init__(self, name: str, inode: int, file_type: int):
+        self.name = name
+        self.inode = inode
+        self.file_type = file_type  # stat 类型位，目录项未记录类型时为 0
+
+    def is_dir(self) -> bool:
+        return self.file_type == stat.S_IFDIR
+
+    def __repr__(self) -> str:
+        return f"DirEntry(name='{self.name}', inode={self.inode})"
+
+
+class _NoHtree(Exception):
+    """htree 索引无法使用（未知哈希等），回落到线性扫描"""
+
+
+# ---------- 文件系统 ----------
+
+class ExtFilesystem:
+    """
+    ext2/3/4 只读文件系统
+
+    设计亮点:
+    - 只按需读取路径上的元数据：超级块、一个块组描述符块、若干 inode 与目录块
+    - htree 目录按名字哈希直达叶块，大目录中的单次查找只读 2-4 个块
+    - 元数据块与 inode 各有 LRU 缓存，同一镜像上的多次查询共用
+    - 基于 pread，多线程并发读取无需加锁
+    """
+
+    def __init__(self, reader: BlockReader, offset: int = 0, block_cache: int = 4096, inode_cache: int = 8192):
+        """
+        :param reader: 镜像块读取器
+        :param offset: 文件系统在镜像中的字节偏移（分区起始）
+        :param block_cache: 缓存的元数据块数量
+        :param inode_cache: 缓存的 inode 数量
+        :raises ImageFormatError: 不是 ext 文件系统或使用了不支持的特性
+        """
+        self.reader = reader
+        self.offset = offset
+        sb = reader.read(offset + _SUPERBLOCK_OFFSET, 1024)
+        if len(sb) < 1024 or struct.unpack_from("<H", sb, 0x38)[0] != _EXT_MAGIC:
+            raise ImageFormatError(f"偏移 {offset} 处不是 ext 文件系统")
+        (self.inodes_count, blocks_lo, _r, _free_b, _free_i, self.first_data_block, log_block_size,
+         _log_cluster, self.blocks_per_group, _cpg, self.inodes_per_group) = struct.unpack_from("<11I", sb, 0)
+        self.block_size = 1024 << log_block_size
+        rev_level, = struct.unpack_from("<I", sb, 0x4C)
+        self.inode_size = struct.unpack_from("<H", sb, 0x58)[0] if rev_level >= 1 else 128
+        self.compat, self.incompat, self.ro_compat = struct.unpack_from("<III", sb, 0x5C)
+        if self.incompat & _INCOMPAT_UNSUPPORTED:
+            raise ImageFormatError(f"ext 文件系统使用了不支持的特性 (0x{self.incompat & _INCOMPAT_UNSUPPORTED:x})")
+        if self.incompat & _INCOMPAT_RECOVER:
+            logger.warning("⚠ 文件系统日志未回放，读到的是最后一次提交前的元数据")
+        self.desc_size = 32
+        if self.incompat & _INCOMPAT_64BIT:
+            self.desc_size = max(32, struct.unpack_from("<H", sb, 0xFE)[0])
+        blocks_hi = struct.unpack_from("<I", sb, 0x150)[0] if self.incompat & _INCOMPAT_64BIT else 0
+        self.blocks_count = blocks_lo | (blocks_hi << 32)
+        self.first_meta_bg, = struct.unpack_from("<I", sb, 0x104)
+        self.hash_seed = struct.unpack_from("<4I", sb, 0xEC)
+        self.unsigned_hash = bool(struct.unpack_from("<I", sb, 0x160)[0] & _FLAGS_UNSIGNED_HASH)
+        self.volume_name = sb[0x78:0x88].split(b"\x00", 1)[0].decode("utf-8", "replace")
+        if not self.block_size or not self.inodes_per_group or self.inode_size < 128:
+            raise ImageFormatError("ext 超级块参数无效")
+        self._blocks = _LRUCache(block_cache)
+        self._inodes = _LRUCache(inode_cache)
+
+    @property
+    def fstype(self) -> str:
+        if self.incompat & (_INCOMPAT_EXTENTS | _INCOMPAT_64BIT | _INCOMPAT_FLEX_BG):
+            return "ext4"
+        return "ext3" if self.compat & _COMPAT_HAS_JOURNAL else "ext2"
+
+    # ---------- 块与 inode ----------
+
+    def _read(self, pos: int, length: int) -> bytes:
+        data = self.reader.read(self.offset + pos, length)
+        return data + bytes(length - len(data)) if len(data) < length else data
+
+    def _block(self, number: int) -> bytes:
+        """读取（并缓存）一个元数据块"""
+        data = self._blocks.get(number)
+        if data is None:
+            if number >= self.blocks_count:
+                raise ImageFormatError(f"块号越界: {number}")
+            data = self._read(number * self.block_size, self.block_size)
+            self._blocks.put(number, data)
+        return data
+
+    def _has_super(self, group: int) -> bool:
+        if group <= 1 or not self.ro_compat & _RO_COMPAT_SPARSE_SUPER:
+            return True
+        for base in (3, 5, 7):
+            n = base
+            while n < group:
+                n *= base
+            if n == group:
+                return True
+        return False
+
+    def _group_desc(self, group: int) -> bytes:
+        per_block = self.block_size // self.desc_size
+        index, slot = divmod(group, per_block)
+        if self.incompat & _INCOMPAT_META_BG and index >= self.first_meta_bg:
+            # meta_bg: 每个元块组的描述符位于该组首个块组（及备份）中
+            first = index * per_block
+            block = self.first_data_block + first * self.blocks_per_group + (1 if self._has_super(first) else 0)
+        else:
+            block = self.first_data_block + 1 + index
+        start = slot * self.desc_size
+        return self._block(block)[start:start + self.desc_size]
+
+    def inode(self, number: int) -> ExtInode:
+        """
+        读取 inode
+
+        :raises ImageFormatError: inode 号无效
+        """
+        cached = self._inodes.get(number)
+        if cached is not None:
+            return cached
+        if not 1 <= number <= self.inodes_count:
+            raise ImageFormatError(f"无效的 inode 号: {number}")
+        group, index = divmod(number - 1, self.inodes_per_group)
+        desc = self._group_desc(group)
+        table = struct.unpack_from("<I", desc, 0x8)[0]
+        if self.desc_size >= 64:
+            table |= struct.unpack_from("<I", desc, 0x28)[0] << 32
+        pos = index * self.inode_size
+        block, within = divmod(pos, self.block_size)
+        raw = self._block(table + block)[within:within + self.inode_size]
+        inode = ExtInode(number, raw)
+        self._inodes.put(number, inode)
+        return inode
+
+    # ---------- 数据块映射 ----------
+
+    def _load_extents(self, inode: ExtInode) -> None:
+        extents: List[Tuple[int, int, int, bool]] = []
+
+        def walk(node: bytes, level: int) -> None:
+            magic, entries, _max, depth = struct.unpack_from("<HHHH", node, 0)
+            if magic != _EXTENT_MAGIC or level > _MAX_TREE_DEPTH:
+                raise ImageFormatError(f"inode {inode.number} 的 extent 树损坏")
+            for i in range(entries):
+                pos = 12 + 12 * i
+                if depth == 0:
+                    logical, length, start_hi, start_lo = struct.unpack_from("<IHHI", node, pos)
+                    initialized = length <= _EXTENT_INIT_MAX
+                    if not initialized:
+                        length -= _EXTENT_INIT_MAX
+                    extents.append((logical, (start_hi << 32) | start_lo, length, initialized))
+                else:
+                    _logical, leaf_lo, leaf_hi = struct.unpack_from("<IIH", node, pos)
+                    walk(self._block((leaf_hi << 32) | leaf_lo), level + 1)
+
+        walk(inode.i_block, 0)
+        extents.sort()
+        inode.extent_starts = [e[0] for e in extents]
+        inode.extents = extents
+
+    def _indirect(self, block: int, index: int) -> int:
+        return struct.unpack_from("<I", self._block(block), index * 4)[0] if block else 0
+
+    def _indirect_map(self, inode: ExtInode, logical: int) -> int:
+        per = self.block_size // 4
+        direct = struct.unpack_from("<15I", inode.i_block)
+        if logical < 12:
+            return direct[logical]
+        logical -= 12
+        if logical < per:
+            return self._indirect(direct[12], logical)
+        logical -= per
+        if logical < per * per:
+            return self._indirect(self._indirect(direct[13], logical // per), logical % per)
+        logical -= per * per
+        outer = self._indirect(direct[14], logical // (per * per))
+        return self._indirect(self._indirect(outer, (logical // per) % per), logical % per)
+
+    def _map(self, inode: ExtInode, logical: int, limit: int) -> Tuple[int, int]:
+        """
+        逻辑块 -> 物理块
+
+        :param limit: 最多需要的连续块数
+        :return: (物理块号，空洞或未初始化时为 0, 连续块数)
+        """
+        if inode.flags & _EXTENTS_FL:
+            if inode.extents is None:
+                self._load_extents(inode)
+            i = bisect_right(inode.extent_starts, logical) - 1
+            if i >= 0:
+                start, physical, length, initialized = inode.extents[i]
+                if logical < start + length:
+                    run = min(limit, start + length - logical)
+                    return (physical + logical - start if initialized else 0), run
+            following = inode.extent_starts[i + 1] if i + 1 < len(inode.extents) else logical + limit
+            return 0, min(limit, following - logical)
+        physical = self._indirect_map(inode, logical)
+        run = 1
+        while run < limit and self._indirect_map(inode, logical + run) == (physical + run if physical else 0):
+            run += 1
+        return physical, run
+
+    def _inline_data(self, inode: ExtInode) -> bytes:
+        extra = inode.ibody_xattr(_XATTR_INDEX_SYSTEM, b"data") or b""
+        return (inode.i_block + extra)[:inode.size]
+
+    def read_inode(self, inode: ExtInode, offset: int, length: int) -> bytes:
+        """按 inode 读取文件内容，越过末尾的部分被截断"""
+        if inode.flags & _ENCRYPT_FL:
+            raise OSError(errno.EOPNOTSUPP, "加密文件不支持用户态读取")
+        end = min(inode.size, offset + length)
+        if offset >= end:
+            return b""
+        if inode.flags & _INLINE_DATA_FL:
+            return self._inline_data(inode)[offset:end]
+        bs = self.block_size
+        out = []
+        pos = offset
+        while pos < end:
+            logical, within = divmod(pos, bs)
+            needed = (end - logical * bs + bs - 1) // bs
+            physical, run = self._map(inode, logical, needed)
+            chunk = min(end - pos, run * bs - within)
+            out.append(self._read(physical * bs + within, chunk) if physical else bytes(chunk))
+            pos += chunk
+        return b"".join(out)
+
+    def _file_block(self, inode: ExtInode, logical: int) -> bytes:
+        """读取目录等小文件的一个逻辑块（经元数据缓存）"""
+        physical, _ = self._map(inode, logical, 1)
+        return self._block(physical) if physical else bytes(self.block_size)
+
+    # ---------- 目录 ----------
+
+    def _parse_dirents(self, data: bytes, start: int = 0) -> Iterator[DirEntry]:
+        has_type = self.incompat & _INCOMPAT_FILETYPE
+        pos = start
+        while pos + 8 <= len(data):
+            ino, rec_len, name_len, file_type = struct.unpack_from("<IHBB", data, pos)
+            if rec_len in (0, 65535) and self.block_size >= 65536:
+                rec_len = self.block_size
+            else:
+                rec_len = (rec_len & 65532) | ((rec_len & 3) << 16)
+            if not has_type:
+                name_len |= file_type << 8
+                file_type = 0
+            if rec_len < 8 or pos + rec_len > len(data) or name_len > rec_len - 8:
+                break
+            if ino and name_len:
+                name = data[pos + 8:pos + 8 + name_len].decode("utf-8", "surrogateescape")
+                yield DirEntry(name, ino, _DIRENT_TYPES.get(file_type, 0))
+            pos += rec_len
+
+    def _iter_dir(self, inode: ExtInode) -> Iterator[DirEntry]:
+        if inode.flags & _INLINE_DATA_FL:
+            # 前 4 字节为父目录 inode，其后（及 system.data 中）为目录项
+            yield from self._parse_dirents(inode.i_block, 4)
+            extra = inode.ibody_xattr(_XATTR_INDEX_SYSTEM, b"data")
+            if extra:
+                yield from self._parse_dirents(extra)
+            return
+        for logical in range((inode.size + self.block_size - 1) // self.block_size):
+            yield from self._parse_dirents(self._file_block(inode, logical))
+
+    def _htree_lookup(self, inode: ExtInode, name: bytes) -> Optional[int]:
+        root = self._file_block(inode, 0)
+        hash_version, info_len, levels = root[0x1C], root[0x1D], root[0x1E]
+        if levels > 3:
+            raise _NoHtree()
+        if hash_version <= _DX_HASH_TEA and self.unsigned_hash:
+            hash_version += _DX_HASH_UNSIGNED_OFFSET
+        target = dx_hash(name, hash_version, self.hash_seed)
+        if target is None:
+            raise _NoHtree()
+
+        node, pos = root, 0x18 + info_len
+        for level in range(levels + 1):
+            _limit, count = struct.unpack_from("<HH", node, pos)
+            if not 1 <= count <= (len(node) - pos) // 8:
+                raise _NoHtree()
+            # 第 0 项没有哈希（位置被 limit/count 占用），覆盖最小的哈希区间
+            hashes = [0] + [struct.unpack_from("<I", node, pos + 8 * i)[0] for i in range(1, count)]
+            blocks = [struct.unpack_from("<I", node, pos + 8 * i + 4)[0] for i in range(count)]
+            i = max(0, bisect_right(hashes, target) - 1)
+            if level < levels:
+                node, pos = self._file_block(inode, blocks[i]), 8
+                continue
+            # 叶子层：哈希冲突的名字可能延续到后续块（后续项哈希最低位置 1）
+            while True:
+                for entry in self._parse_dirents(self._file_block(inode, blocks[i])):
+                    if entry.name.encode("utf-8", "surrogateescape") == name:
+                        return entry.inode
+                i += 1
+                if i >= count or hashes[i] & ~1 != target:
+                    return None
+        return None
+
+    def _lookup(self, inode: ExtInode, name: str) -> Optional[int]:
+        raw = name.encode("utf-8", "surrogateescape")
+        if inode.flags & _INDEX_FL and not inode.flags & (_INLINE_DATA_FL | _CASEFOLD_FL):
+            try:
+                return self._htree_lookup(inode, raw)
+            except _NoHtree:
+                pass
+        if inode.flags & _CASEFOLD_FL:
+            folded = name.casefold()
+            return next((e.inode for e in self._iter_dir(inode) if e.name.casefold() == folded), None)
+        return next((e.inode for e in self._iter_dir(inode) if e.name == name), None)
+
+    # ---------- 路径 ----------
+
+    def _readlink(self, inode: ExtInode) -> str:
+        if inode.flags & _INLINE_DATA_FL:
+            target = self._inline_data(inode)
+        elif inode.size < _I_BLOCK_SIZE and not inode.flags & _EXTENTS_FL:
+            # 快速符号链接：目标直接存放在 i_block 中
+            target = inode.i_block[:inode.size]
+        else:
+            target = self.read_inode(inode, 0, inode.size)
+        return target.decode("utf-8", "surrogateescape")
+
+    def _resolve(self, path: str, follow: bool = True) -> ExtInode:
+        """
+        解析路径（以镜像根目录为根，绝对符号链接同样相对镜像根解析）
+
+        :raises FileNotFoundError / NotADirectoryError / OSError(ELOOP)
+        """
+        pending = [p for p in reversed(path.split("/")) if p and p != "."]
+        stack = [ROOT_INODE]
+        links = 0
+        while pending:
+            name = pending.pop()
+            if name == "..":
+                if len(stack) > 1:
+                    stack.pop()
+                continue
+            parent = self.inode(stack[-1])
+            if not parent.is_dir:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            number = self._lookup(parent, name)
+            if not number:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            inode = self.inode(number)
+            if stat.S_ISLNK(inode.mode) and (pending or follow):
+                links += 1
+                if links > _MAX_SYMLINKS:
+                    raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+                target = self._readlink(inode)
+                if target.startswith("/"):
+                    stack = [ROOT_INODE]
+                pending.extend(p for p in reversed(target.split("/")) if p and p != ".")
+                continue
+            stack.append(number)
+        return self.inode(stack[-1])
+
+    def _dir(self, path: str) -> ExtInode:
+        inode = self._resolve(path)
+        if not inode.is_dir:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        return inode
+
+    # ---------- 公共接口 ----------
+
+    def scandir(self, path: str = "/") -> List[DirEntry]:
+        """列出目录项（不含 . 与 ..）"""
+        return [e for e in self._iter_dir(self._dir(path)) if e.name not in (".", "..")]
+
+    def listdir(self, path: str = "/") -> List[str]:
+        """列出目录中的名字（不含 . 与 ..）"""
+        return [e.name for e in self.scandir(path)]
+
+    def stat(self, path: str, follow_symlinks: bool = True) -> os.stat_result:
+        """与 os.stat 相同字段的状态（st_dev 为 0）"""
+        return self._resolve(path, follow_symlinks).to_stat()
+
+    def lstat(self, path: str) -> os.stat_result:
+        return self.stat(path, follow_symlinks=False)
+
+    def readlink(self, path: str) -> str:
+        inode = self._resolve(path, follow=False)
+        if not stat.S_ISLNK(inode.mode):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+        return self._readlink(inode)
+
+    def open(self, path: str, buffer_size: int = 1 << 16) -> io.BufferedReader:
+        """
+        以只读二进制方式打开文件
+
+        :raises IsADirectoryError: 路径是目录
+        """
+        inode = self._resolve(path)
+        if inode.is_dir:
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        return io.BufferedReader(ExtFile(self, inode, path), buffer_size)
+
+    def read_bytes(self, path: str) -> bytes:
+        """读取整个文件"""
+        with self.open(path) as f:
+            return f.read()
+
+    def close(self) -> None:
+        """关闭底层读取器"""
+        self.reader.close()
+
+    def __enter__(self) -> "ExtFilesystem":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __repr__(self) -> str:
+        return (f"ExtFilesystem(type={self.fstype}, offset={self.offset}, block_size={self.block_size}, "
+                f"label='{self.volume_name}')")
+
+
+class ExtFile(io.RawIOBase):
+    """ext 文件的只读原始流"""
+
+    def __init__(self, fs: ExtFilesystem, inode: ExtInode, name: str = ""):
+        super().__init__()
+        self.fs = fs
+        self.inode = inode
+        self.name = name
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.fs.read_inode(self.inode, self._pos, len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.inode.size
+        if offset < 0:
+            raise OSError(errno.EINVAL, "负的文件偏移")
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def __repr__(self) -> str:
+        return f"ExtFile(name='{self.name}', size={self.inode.size})"
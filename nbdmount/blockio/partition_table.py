@@ -0,0 +1,148 @@
+"""
+分区表解析 - 直接从镜像读取 MBR（含扩展分区）与 GPT
+"""
+import struct
+import uuid
+from typing import List, Optional
+from .reader import BlockReader
+
+
+SECTOR_SIZE = 512
+
+_MBR_EXTENDED_TYPES = {0x05, 0x0F, 0x85}
+_MBR_PROTECTIVE = 0xEE
+_GPT_SIGNATURE = b"EFI PART"
+
+
+class PartitionEntry:
+    """分区表项（字节为单位）"""
+
+    def __init__(
+        self,
+        number: int,
+        start: int,
+        size: int,
+        type_id: str,
+        name: str = "",
+        uuid_: str = "",
+        scheme: str = "mbr"
+    ):
+        self.number = number
+        self.start = start
+        self.size = size
+        self.type_id = type_id  # MBR 为 "0x83" 形式，GPT 为类型 GUID
+        self.name = name        # GPT 分区名
+        self.uuid = uuid_       # GPT 唯一 GUID
+        self.scheme = scheme
+
+    @property
+    def end(self) -> int:
+        return self.start + self.size
+
+    def contains(self, offset: int) -> bool:
+        return self.start <= offset < self.end
+
+    def __repr__(self) -> str:
+        label = f", name='{self.name}'" if self.name else ""
+        return (f"PartitionEntry(number={self.number}, start={self.start}, size={self.size}, "
+                f"type={self.type_id}{label})")
+
+
+def _read_mbr_entries(sector: bytes) -> List[tuple]:
+    """解析扇区中的 4 个 MBR 分区项: [(类型, 起始 LBA, 扇区数), ...]"""
+    entries = []
+    for i in range(4):
+        off = 446 + i * 16
+        ptype = sector[off + 4]
+        lba, count = struct.unpack_from("<II", sector, off + 8)
+        entries.append((ptype, lba, count))
+    return entries
+
+
+def _parse_gpt(reader: BlockReader) -> List[PartitionEntry]:
+    header = reader.read(SECTOR_SIZE, SECTOR_SIZE)
+    if header[:8] != _GPT_SIGNATURE:
+        return []
+    entries_lba, = struct.unpack_from("<Q", header, 72)
+    count, entry_size = struct.unpack_from("<II", header, 80)
+    table = reader.read(entries_lba * SECTOR_SIZE, count * entry_size)
+    parts = []
+    for i in range(count):
+        raw = table[i * entry_size:(i + 1) * entry_size]
+        if len(raw) < 128 or raw[:16] == bytes(16):
+            continue
+        first, last = struct.unpack_from("<QQ", raw, 32)
+        name = raw[56:128].decode("utf-16-le", "replace").rstrip("\x00")
+        parts.append(PartitionEntry(
+            number=i + 1,
+            start=first * SECTOR_SIZE,
+            size=(last - first + 1) * SECTOR_SIZE,
+            type_id=str(uuid.UUID(bytes_le=raw[:16])),
+            name=name,
+            uuid_=str(uuid.UUID(bytes_le=raw[16:32])),
+            scheme="gpt",
+        ))
+    return parts
+
+
+def _parse_logical(reader: BlockReader, ext_start: int) -> List[PartitionEntry]:
+    """沿 EBR 链解析逻辑分区（编号从 5 开始）"""
+    parts = []
+    ebr_lba = ext_start
+    seen = set()
+    while ebr_lba not in seen and len(parts) < 128:
+        seen.add(ebr_lba)
+        sector = reader.read(ebr_lba * SECTOR_SIZE, SECTOR_SIZE)
+        if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xaa":
+            break
+        (ptype, lba, count), (next_type, next_lba, _) = _read_mbr_entries(sector)[:2]
+        if ptype and count:
+            parts.append(PartitionEntry(
+                number=5 + len(parts),
+                start=(ebr_lba + lba) * SECTOR_SIZE,
+                size=count * SECTOR_SIZE,
+                type_id=f"0x{ptype:02x}",
+            ))
+        if next_type not in _MBR_EXTENDED_TYPES or not next_lba:
+            break
+        ebr_lba = ext_start + next_lba
+    return parts
+
+
+def read_partition_table(reader: BlockReader) -> List[PartitionEntry]:
+    """
+    读取镜像的分区表
+
+    :param reader: 块读取器
+    :return: 分区列表（按编号排序），无分区表时返回空列表
+    """
+    mbr = reader.read(0, SECTOR_SIZE)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != b"\x55\xaa":
+        return []
+
+    # 引导标志只能是 0x00/0x80，否则多半是带 0x55AA 签名的文件系统引导扇区（如 FAT）
+    if any(mbr[446 + i * 16] not in (0x00, 0x80) for i in range(4)):
+        return []
+    primary = _read_mbr_entries(mbr)
+    if any(ptype == _MBR_PROTECTIVE for ptype, _, _ in primary):
+        gpt = _parse_gpt(reader)
+        if gpt:
+            return gpt
+
+    parts = []
+    for i, (ptype, lba, count) in enumerate(primary, 1):
+        if not ptype or not count:
+            continue
+        if ptype in _MBR_EXTENDED_TYPES:
+            parts.extend(_parse_logical(reader, lba))
+            continue
+        parts.append(PartitionEntry(i, lba * SECTOR_SIZE, count * SECTOR_SIZE, f"0x{ptype:02x}"))
+    return sorted(parts, key=lambda p: p.number)
+
+
+def partition_at(table: List[PartitionEntry], offset: int) -> Optional[PartitionEntry]:
+    """返回包含给定偏移的分区"""
+    for part in table:
+        if part.contains(offset):
+            return part
+    return None
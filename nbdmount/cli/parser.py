@@ -1,78 +1,370 @@
-"""
-命令行接口 - 专业级参数处理
-"""
-import argparse
-import logging
-import sys
-from pathlib import Path
-from typing import Optional
-
-
-def setup_logging(debug: bool = False) -> None:
-    """配置日志系统"""
-    level = logging.DEBUG if debug else logging.INFO
-    logging.basicConfig(
-        level=level,
-        format="%(asctime)s %(levelname)-8s %(message)s",
-        datefmt="%H:%M:%S"
-    )
-    # 第三方库日志降级
-    logging.getLogger("urllib3").setLevel(logging.WARNING)
-
-
-def parse_arguments(argv: Optional[list] = None) -> argparse.Namespace:
-    """解析命令行参数"""
-    parser = argparse.ArgumentParser(
-        description="NBD 磁盘镜像挂载管理工具",
-        epilog="示例:\n"
-               "  nbdmount disk.qcow2 mount\n"
-               "  nbdmount disk.raw list --format raw\n"
-               "  nbdmount disk.qcow2 mount --mount-dir /mnt/forensics",
-        formatter_class=argparse.RawDescriptionHelpFormatter
-    )
-    
-    # 位置参数
-    parser.add_argument("image", help="虚拟机镜像文件路径 (qcow2/raw/vmdk 等)")
-    parser.add_argument(
-        "action", 
-        choices=["mount", "list", "info", "check"],
-        help="操作类型: mount=挂载分区, list=列出分区, info=镜像信息, check=环境检查"
-    )
-    
-    # 可选参数
-    parser.add_argument(
-        "--mount-dir", 
-        metavar="DIR",
-        help="挂载基目录 (默认: /mnt/nbd-<镜像名>)"
-    )
-    parser.add_argument(
-        "--format", 
-        choices=["qcow2", "raw"],
-        help="指定镜像格式（自动检测失败时使用）"
-    )
-    parser.add_argument(
-        "--rw", 
-        action="store_true",
-        help="以读写模式挂载（⚠️ 谨慎使用，可能损坏镜像）"
-    )
-    parser.add_argument(
-        "--debug", 
-        action="store_true",
-        help="启用调试日志"
-    )
-    parser.add_argument(
-        "--version", 
-        action="version",
-        version="nbdmount 1.0.0"
-    )
-    
-    args = parser.parse_args(argv)
-    
-    # 验证镜像路径
-    image_path = Path(args.image)
-    if not image_path.exists():
-        parser.error(f"镜像文件不存在: {args.image}")
-    if not image_path.is_file():
-        parser.error(f"路径不是常规文件: {args.image}")
-    
+"""
+命令行接口 - 专业级参数处理
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+from typing import Optional
+from ..formats import FORMAT_ALIASES
+from ..core.cgroup import PRIORITY_CLASSES
+from ..core.device import DEVICE_BACKENDS
+
+
+# 不需要镜像参数的动作
+IMAGELESS_ACTIONS = {"cleanup", "sessions"}
+# 在用户态读取镜像中文件系统的动作（不需要 root 与 NBD 设备）
+FILESYSTEM_ACTIONS = {"ls", "cat"}
+
+
+def setup_logging(debug: bool = False) -> None:
+    """配置日志系统"""
+    level = logging.DEBUG if debug else logging.INFO
+    logging.basicConfig(
+        level=level,
+        format="%(asctime)s %(levelname)-8s %(message)s",
+        datefmt="%H:%M:%S"
+    )
+    # 第三方库日志降级
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+def _size(value: str) -> int:
+    """解析带 K/M/G 后缀的字节数"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper().rstrip("B")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的大小: {value}")
+
+
+def parse_arguments(argv: Optional[list] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="NBD 磁盘镜像挂载管理工具",
+        epilog="示例:\n"
+               "  nbdmount disk.qcow2 mount\n"
+               "  nbdmount disk.raw list --format raw\n"
+               "  nbdmount disk.qcow2 mount --mount-dir /mnt/forensics\n"
+               "  nbdmount disk.qcow2 mount --partition root\n"
+               "  nbdmount cleanup\n"
+               "  nbdmount sessions\n"
+               "  nbdmount disk.qcow2 scan --priority bulk --io-rbps 100M --signatures sigs.txt\n"
+               "  nbdmount disk.qcow2 cat /etc/os-release --partition root\n"
+               "  nbdmount disk.qcow2 mount --watchdog --nbd-backend netlink\n"
+               "  nbdmount disk.qcow2 serve --export-name vm1\n"
+               "  nbdmount --export vm1 mount\n"
+               "  nbdmount base.qcow2 diff --against snap.qcow2\n"
+               "  nbdmount disk.qcow2 scan --signatures sigs.txt -o hits.ndjson",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    
+    # 位置参数
+    parser.add_argument("image", nargs="?", help="虚拟机镜像文件路径 (qcow2/raw/vmdk 等)")
+    parser.add_argument(
+        "action", 
+        choices=["mount", "list", "info", "check", "cleanup", "serve", "index", "diff", "scan", "sessions",
+                 "ls", "cat"],
+        help="操作类型: mount=挂载分区, list=列出分区, info=镜像信息, check=环境检查, "
+             "cleanup=清理异常退出遗留的会话（无需镜像参数）, serve=共享只读导出镜像, "
+             "index=生成文件清单, diff=与 --against 镜像做块级比较, scan=并行内容扫描, "
+             "sessions=列出共享只读会话及其持有者（无需镜像参数）, "
+             "ls=列出镜像内目录, cat=输出镜像内文件（ls/cat 在用户态读取 ext2/3/4，无需 root）"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="PATH",
+        help="ls/cat 的镜像内路径（ls 默认为 /）"
+    )
+    
+    # 可选参数
+    parser.add_argument(
+        "--mount-dir", 
+        metavar="DIR",
+        help="挂载基目录 (默认: /mnt/nbd-<镜像名>)"
+    )
+    parser.add_argument(
+        "--format", 
+        choices=sorted(FORMAT_ALIASES),
+        help="指定镜像格式（自动检测失败时使用）"
+    )
+    parser.add_argument(
+        "--rw", 
+        action="store_true",
+        help="以读写模式挂载（⚠️ 谨慎使用，可能损坏镜像）"
+    )
+    parser.add_argument(
+        "--partition",
+        metavar="N|NAME|GUID",
+        help="只连接并挂载一个分区：分区号、GPT 分区名、文件系统卷标、分区类型 GUID 或 MBR 类型 (如 0x83)；"
+             "只导出该分区的字节区间，跳过分区扫描"
+    )
+    parser.add_argument(
+        "--exclusive",
+        action="store_true",
+        help="独占设备：不复用、也不共享其他进程对同一镜像的只读挂载"
+    )
+    parser.add_argument(
+        "--watchdog",
+        action="store_true",
+        help="监视 NBD 连接健康：缩短内核请求超时，服务进程失效或 I/O 停滞时尽快发现，"
+             "netlink 后端自动重启服务并重连；mount 动作保持前台运行直到 Ctrl+C"
+    )
+    parser.add_argument(
+        "--io-timeout",
+        type=int,
+        default=5,
+        metavar="SEC",
+        help="启用 --watchdog 时的内核请求超时秒数（默认: 5）"
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="记录块访问轮廓，下次连接同一镜像（或同一 backing 镜像）时后台预读"
+    )
+    parser.add_argument(
+        "--luks-key-file",
+        metavar="FILE",
+        help="打开镜像内 LUKS 容器的密钥文件（未指定时跳过 LUKS 容器）"
+    )
+    parser.add_argument(
+        "--nbd-backend",
+        choices=DEVICE_BACKENDS,
+        default="auto",
+        help="设备后端: ioctl=静态 /dev/nbdN, netlink=内核按需创建设备, "
+             "loop=RAW/ISO 镜像直接使用 loop 设备, "
+             "auto=RAW 布局用 loop（指定资源预算时不用），其余内核支持时用 netlink (默认: auto)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        metavar="N",
+        help="cleanup/index/diff 等动作的并行线程数，scan 的工作进程数 (默认: 8)"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="cleanup 只列出残留会话，不做拆除"
+    )
+    
+    # 共享导出
+    serve_group = parser.add_argument_group("共享导出")
+    serve_group.add_argument(
+        "--export",
+        metavar="NAME|URI",
+        help="连接已有的共享导出（登记名称或 nbd:// URI）而不是镜像文件"
+    )
+    serve_group.add_argument(
+        "--export-name",
+        metavar="NAME",
+        help="serve 登记的导出名称 (默认: 镜像文件名)"
+    )
+    serve_group.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="serve 监听的 Unix 套接字 (默认: /run/nbdmount/exports/<名称>.sock)"
+    )
+    serve_group.add_argument(
+        "--bind",
+        metavar="ADDR",
+        help="serve 改为监听 TCP 地址，供远程使用者连接"
+    )
+    serve_group.add_argument(
+        "--port",
+        type=int,
+        default=10809,
+        help="serve 监听的 TCP 端口 (默认: 10809)"
+    )
+    serve_group.add_argument(
+        "--shared",
+        type=int,
+        default=16,
+        metavar="N",
+        help="serve 允许的最大并发连接数 (默认: 16)"
+    )
+    serve_group.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=300,
+        metavar="SEC",
+        help="serve 无使用者时自动关停的等待秒数，0 表示不自动关停 (默认: 300)"
+    )
+    
+    # 分析
+    analysis_group = parser.add_argument_group("分析")
+    analysis_group.add_argument(
+        "-o", "--output",
+        metavar="FILE",
+        help="index 输出的清单文件 (默认: <镜像名>.manifest.db)；diff 输出 JSON 报告；"
+             "scan 输出 NDJSON (默认: 标准输出)"
+    )
+    analysis_group.add_argument(
+        "--previous",
+        metavar="FILE",
+        help="index 复用上一快照清单中未变化文件的哈希"
+    )
+    analysis_group.add_argument(
+        "--hash",
+        metavar="ALGO",
+        help="index 计算文件内容哈希 (如 sha256)"
+    )
+    analysis_group.add_argument(
+        "--against",
+        metavar="IMAGE",
+        help="diff 比较的新镜像（或快照），位置参数中的镜像作为旧镜像"
+    )
+    analysis_group.add_argument(
+        "--resolve",
+        action="store_true",
+        help="diff 连接新镜像，把 ext 分区中的变化块解析为文件路径"
+    )
+    
+    # 内容扫描
+    scan_group = parser.add_argument_group("内容扫描")
+    scan_group.add_argument(
+        "--hash-list",
+        metavar="FILE",
+        help="scan 已知哈希清单（每行 \"<摘要> [标签]\"，按长度识别 md5/sha1/sha256/sha512）"
+    )
+    scan_group.add_argument(
+        "--signatures",
+        metavar="FILE",
+        help="scan 字节特征码（每行 \"<规则名> <十六进制字节>\"，Aho-Corasick 多模式匹配）"
+    )
+    scan_group.add_argument(
+        "--name-pattern",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="scan 文件名规则，可重复指定"
+    )
+    scan_group.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="scan 跳过匹配的相对路径，可重复指定"
+    )
+    scan_group.add_argument(
+        "--min-size",
+        type=_size,
+        default=0,
+        metavar="SIZE",
+        help="scan 跳过小于此大小的文件 (如 1K)"
+    )
+    scan_group.add_argument(
+        "--max-size",
+        type=_size,
+        default=0,
+        metavar="SIZE",
+        help="scan 跳过大于此大小的文件，0 表示不限 (如 512M)"
+    )
+    # 资源预算
+    budget_group = parser.add_argument_group("资源预算 (cgroup v2，作用于会话的 qemu-nbd 服务进程)")
+    budget_group.add_argument(
+        "--priority",
+        choices=sorted(PRIORITY_CLASSES),
+        help="优先级：interactive 与 bulk 两类之间按权重分配 I/O 与 CPU；"
+             "指定任一预算参数时默认 serve/scan/index/diff 为 bulk，其余为 interactive"
+    )
+    budget_group.add_argument(
+        "--io-rbps",
+        type=_size,
+        metavar="SIZE",
+        help="对镜像所在设备的读带宽上限，每秒 (如 200M)"
+    )
+    budget_group.add_argument(
+        "--io-wbps",
+        type=_size,
+        metavar="SIZE",
+        help="写带宽上限，每秒"
+    )
+    budget_group.add_argument(
+        "--io-riops",
+        type=int,
+        metavar="N",
+        help="读 IOPS 上限"
+    )
+    budget_group.add_argument(
+        "--io-wiops",
+        type=int,
+        metavar="N",
+        help="写 IOPS 上限"
+    )
+    budget_group.add_argument(
+        "--io-weight",
+        type=int,
+        metavar="N",
+        help="同优先级会话之间的 I/O 权重 (1-10000)"
+    )
+    budget_group.add_argument(
+        "--cpu-weight",
+        type=int,
+        metavar="N",
+        help="同优先级会话之间的 CPU 权重 (1-10000)"
+    )
+    budget_group.add_argument(
+        "--memory-high",
+        type=_size,
+        metavar="SIZE",
+        help="服务进程内存软上限 (如 512M)"
+    )
+    parser.add_argument(
+        "--debug", 
+        action="store_true",
+        help="启用调试日志"
+    )
+    parser.add_argument(
+        "--version", 
+        action="version",
+        version="nbdmount 1.0.0"
+    )
+    
+    args = parser.parse_args(argv)
+    
+    if args.action in IMAGELESS_ACTIONS:
+        return args
+    
+    if args.action == "scan" and not (args.hash_list or args.signatures or args.name_pattern):
+        parser.error("scan 需要 --hash-list、--signatures 或 --name-pattern 中的至少一项")
+    
+    if args.action == "cat" and not args.paths:
+        parser.error("cat 需要至少一个镜像内路径")
+    if args.paths and args.action not in FILESYSTEM_ACTIONS:
+        parser.error(f"动作 '{args.action}' 不接受路径参数")
+    
+    if args.io_timeout < 1:
+        parser.error("--io-timeout 至少为 1 秒")
+    for name in ("io_weight", "cpu_weight"):
+        weight = getattr(args, name)
+        if weight is not None and not 1 <= weight <= 10000:
+            parser.error(f"--{name.replace('_', '-')} 取值范围为 1-10000")
+    
+    if args.export:
+        if args.action in ("serve", "diff") or args.action in FILESYSTEM_ACTIONS:
+            parser.error(f"{args.action} 需要镜像文件，不能与 --export 同时使用")
+        if args.partition:
+            parser.error("--partition 需要在用户态读取分区表，不能与 --export 同时使用")
+        return args
+    
+    # 验证镜像路径
+    if not args.image:
+        parser.error(f"动作 '{args.action}' 需要镜像文件参数")
+    image_path = Path(args.image)
+    if not image_path.exists():
+        parser.error(f"镜像文件不存在: {args.image}")
+    if not image_path.is_file():
+        parser.error(f"路径不是常规文件: {args.image}")
+    
+    if args.action == "diff":
+        if not args.against:
+            parser.error("diff 需要 --against 指定比较的镜像")
+        if not Path(args.against).is_file():
+            parser.error(f"镜像文件不存在: {args.against}")
+    
     return args
\ No newline at end of file
@@ -0,0 +1,396 @@
+"""
+会话资源预算 - 以 cgroup v2 限制每个会话服务进程（qemu-nbd）的 I/O、CPU 与内存
+
+层级: <cgroup2 根>/nbdmount/<优先级>/<会话>
+  - 优先级节点（interactive / bulk）之间按 io.weight、cpu.weight 分配争用时的份额；
+    io.weight 只在设备使用 BFQ 调度器或启用 io.cost 时生效，默认的 mq-deadline/none 下无效
+  - interactive 节点对镜像所在设备设置 io.latency 目标：交互式 I/O 延迟超过目标时内核限制
+    同级的 bulk 节点，与调度器无关，这是交互式会话延迟的主要保障
+  - 会话叶节点上对镜像所在块设备设置 io.max，并设置 memory.high，I/O 统计从 io.stat 读回
+qemu-nbd 启动后把其进程写入叶节点的 cgroup.procs；loop 后端的 I/O 由读取者发起，没有服务进程。
+所有操作都是对 cgroupfs 的普通文件读写，root 参数可以指向伪造的目录进行测试
+"""
+import errno
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+CGROUP_PARENT = "nbdmount"
+CONTROLLERS = ("io", "cpu", "memory")
+
+# 优先级 -> 节点在同级间的权重（io.weight / cpu.weight 取值 1-10000，默认 100）
+PRIORITY_CLASSES: Dict[str, Dict[str, int]] = {
+    "interactive": {"io": 500, "cpu": 500},
+    "bulk": {"io": 50, "cpu": 50},
+}
+# interactive 节点的 io.latency 目标（微秒），按设备是否为机械盘区分
+LATENCY_TARGET_US = {False: 5000, True: 50000}
+
+_IO_STAT_KEYS = ("rbytes", "wbytes", "rios", "wios", "dbytes", "dios")
+
+
+def find_cgroup2_root(mounts_file: str = "/proc/mounts") -> Optional[Path]:
+    """cgroup2 挂载点（优先 /sys/fs/cgroup，混合层级下通常为 /sys/fs/cgroup/unified）"""
+    found = []
+    try:
+        with open(mounts_file) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "cgroup2":
+                    found.append(parts[1])
+    except OSError:
+        return None
+    if not found:
+        return None
+    return Path("/sys/fs/cgroup" if "/sys/fs/cgroup" in found else found[0])
+
+
+def backing_device(path: Union[str, Path]) -> Optional[str]:
+    """
+    文件所在的块设备（整盘）"MAJ:MIN"，io.max 只接受整盘设备
+
+    :return: 设备号，文件位于 tmpfs/overlay 等没有块设备的文件系统时为 None
+    """
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    major, minor = os.major(dev), os.minor(dev)
+    if major == 0:
+        return None
+    sys_dev = Path(f"/sys/dev/block/{major}:{minor}")
+    if (sys_dev / "partition").exists():
+        try:
+            return (sys_dev.resolve().parent / "dev").read_text().strip()
+        except OSError:
+            return None
+    return f"{major}:{minor}"
+
+
+def _queue_attr(device: str, name: str) -> Optional[str]:
+    """/sys/dev/block/<MAJ:MIN>/queue/<name>，读取失败时为 None"""
+    try:
+        return Path(f"/sys/dev/block/{device}/queue/{name}").read_text().strip()
+    except OSError:
+        return None
+
+
+def latency_target(device: str) -> int:
+    """设备的 io.latency 目标（微秒）"""
+    return LATENCY_TARGET_US[_queue_attr(device, "rotational") == "1"]
+
+
+class SessionBudget:
+    """
+    单个会话的资源预算
+
+    未设置的上限为 max（不限制），未设置的权重沿用优先级节点之下的默认值
+    """
+
+    def __init__(
+        self,
+        priority: str = "interactive",
+        read_bps: Optional[int] = None,
+        write_bps: Optional[int] = None,
+        read_iops: Optional[int] = None,
+        write_iops: Optional[int] = None,
+        io_weight: Optional[int] = None,
+        cpu_weight: Optional[int] = None,
+        memory_high: Optional[int] = None
+    ):
+        """
+        :param priority: 优先级（interactive / bulk）
+        :param read_bps: 对镜像所在设备的读带宽上限（字节/秒）
+        :param write_bps: 写带宽上限（字节/秒）
+        :param read_iops: 读 IOPS 上限
+        :param write_iops: 写 IOPS 上限
+        :param io_weight: 同优先级会话之间的 I/O 权重（1-10000）
+        :param cpu_weight: 同优先级会话之间的 CPU 权重（1-10000）
+        :param memory_high: 内存软上限（字节），超出后服务进程被回收与限速而不是被杀
+        :raises ValueError: 未知优先级或权重越界
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"未知的优先级: {priority}（可选 {', '.join(PRIORITY_CLASSES)}）")
+        for name, weight in (("io_weight", io_weight), ("cpu_weight", cpu_weight)):
+            if weight is not None and not 1 <= weight <= 10000:
+                raise ValueError(f"{name} 取值范围为 1-10000: {weight}")
+        self.priority = priority
+        self.read_bps = read_bps
+        self.write_bps = write_bps
+        self.read_iops = read_iops
+        self.write_iops = write_iops
+        self.io_weight = io_weight
+        self.cpu_weight = cpu_weight
+        self.memory_high = memory_high
+
+    def io_max(self, device: str) -> Optional[str]:
+        """io.max 的一行设置，没有任何上限时为 None"""
+        limits = (("rbps", self.read_bps), ("wbps", self.write_bps),
+                  ("riops", self.read_iops), ("wiops", self.write_iops))
+        if not any(value for _, value in limits):
+            return None
+        return device + "".join(f" {key}={value or 'max'}" for key, value in limits)
+
+    def __repr__(self) -> str:
+        return (f"SessionBudget(priority={self.priority}, rbps={self.read_bps}, wbps={self.write_bps}, "
+                f"memory_high={self.memory_high})")
+
+
+class SessionCgroup:
+    """会话叶节点"""
+
+    def __init__(self, path: Path, priority: str):
+        self.path = path
+        self.priority = priority
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    def _write(self, name: str, value: str) -> bool:
+        try:
+            with open(self.path / name, "w") as f:
+                f.write(value)
+            return True
+        except OSError as e:
+            # 控制器未启用或内核不支持该接口：预算尽力而为，不影响会话本身
+            logger.warning(f"设置 {self.path / name} 失败: {e}")
+            return False
+
+    def apply(self, budget: SessionBudget, device: Optional[str] = None) -> None:
+        """
+        写入预算
+
+        :param device: 镜像所在块设备 "MAJ:MIN"，为空时跳过 io.max
+        """
+        if device:
+            io_max = budget.io_max(device)
+            if io_max:
+                self._write("io.max", io_max)
+        elif budget.io_max("-"):
+            logger.warning("⚠ 镜像不在块设备上，无法设置 I/O 上限")
+        if budget.io_weight:
+            self._write("io.weight", f"default {budget.io_weight}")
+        if budget.cpu_weight:
+            self._write("cpu.weight", str(budget.cpu_weight))
+        if budget.memory_high:
+            self._write("memory.high", str(budget.memory_high))
+
+    def attach(self, pid: int) -> bool:
+        """把进程（及其全部线程）移入本节点"""
+        try:
+            with open(self.path / "cgroup.procs", "a") as f:
+                f.write(f"{pid}\n")
+        except OSError as e:
+            logger.warning(f"把进程 {pid} 移入 {self.path} 失败: {e}")
+            return False
+        logger.debug(f"进程 {pid} 已移入 {self.path}")
+        return True
+
+    def pids(self) -> List[int]:
+        try:
+            return [int(line) for line in (self.path / "cgroup.procs").read_text().split()]
+        except (OSError, ValueError):
+            return []
+
+    def io_stat(self) -> Dict[str, Dict[str, int]]:
+        """读取 io.stat: {"MAJ:MIN": {"rbytes": ..., "wbytes": ..., ...}}"""
+        stats: Dict[str, Dict[str, int]] = {}
+        try:
+            text = (self.path / "io.stat").read_text()
+        except OSError:
+            return stats
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            device, *fields = line.split()
+            values = {}
+            for field in fields:
+                key, _, value = field.partition("=")
+                if key in _IO_STAT_KEYS and value.isdigit():
+                    values[key] = int(value)
+            stats[device] = values
+        return stats
+
+    def io_totals(self) -> Dict[str, int]:
+        """所有设备的 io.stat 合计"""
+        totals = dict.fromkeys(_IO_STAT_KEYS, 0)
+        for values in self.io_stat().values():
+            for key, value in values.items():
+                totals[key] += value
+        return totals
+
+    def remove(self) -> bool:
+        """删除节点（仍有进程时保留，由 prune 稍后清理）"""
+        try:
+            os.rmdir(self.path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            if e.errno != errno.ENOTEMPTY or self.pids():
+                logger.debug(f"暂不删除 {self.path}: {e}")
+                return False
+            # 普通目录（测试用的伪 cgroupfs）中接口文件是真实文件
+            shutil.rmtree(self.path, ignore_errors=True)
+        return True
+
+    def __repr__(self) -> str:
+        return f"SessionCgroup(path='{self.path}', priority={self.priority}, pids={self.pids()})"
+
+
+class CgroupManager:
+    """
+    cgroup v2 会话节点管理
+
+    设计亮点:
+    - 优先级节点承载权重，会话叶节点承载上限，争用时先按优先级分配再在同级会话间分配
+    - io.weight 依赖调度器，interactive 节点另设 io.latency 目标，在任何调度器下都能压制 bulk
+    - 控制器逐个启用，某个控制器不可用时其余预算仍然生效
+    - 创建新节点前顺带清理没有进程的旧叶节点，异常退出遗留的节点不会累积
+    """
+
+    def __init__(self, root: Optional[Union[str, Path]] = None, parent: str = CGROUP_PARENT):
+        """
+        :param root: cgroup2 根目录，默认从 /proc/mounts 查找
+        :param parent: 本工具使用的子树名
+        """
+        self.root = Path(root) if root else find_cgroup2_root()
+        self.base = self.root / parent if self.root else None
+        self._protected: set = set()
+
+    def available(self) -> bool:
+        """cgroup v2 可用且有权限创建子节点"""
+        return bool(self.root and (self.root / "cgroup.controllers").exists() and os.access(self.root, os.W_OK))
+
+    @staticmethod
+    def _enable_controllers(node: Path) -> None:
+        try:
+            offered = (node / "cgroup.controllers").read_text().split()
+        except OSError:
+            offered = []
+        for controller in CONTROLLERS:
+            if controller not in offered:
+                continue
+            try:
+                with open(node / "cgroup.subtree_control", "a") as f:
+                    f.write(f"+{controller}\n")
+            except OSError as e:
+                logger.debug(f"在 {node} 启用 {controller} 控制器失败: {e}")
+
+    def _class_node(self, priority: str) -> Path:
+        node = self.base / priority
+        if not node.is_dir():
+            if not self.base.is_dir():
+                self._enable_controllers(self.root)
+                self.base.mkdir(exist_ok=True)
+                self._enable_controllers(self.base)
+            node.mkdir(exist_ok=True)
+            weights = PRIORITY_CLASSES[priority]
+            leaf = SessionCgroup(node, priority)
+            leaf._write("io.weight", f"default {weights['io']}")
+            leaf._write("cpu.weight", str(weights["cpu"]))
+            self._enable_controllers(node)
+        return node
+
+    def io_weight_effective(self, device: str) -> Optional[bool]:
+        """
+        io.weight 在设备上是否生效（BFQ 调度器或根节点 io.cost.qos 已启用）
+
+        :return: 无法读取调度器时为 None
+        """
+        try:
+            for line in (self.root / "io.cost.qos").read_text().splitlines():
+                fields = line.split()
+                if fields and fields[0] == device and "enable=1" in fields:
+                    return True
+        except OSError:
+            pass
+        scheduler = _queue_attr(device, "scheduler")
+        if scheduler is None:
+            return None
+        return "[bfq]" in scheduler
+
+    def _protect_interactive(self, device: str) -> None:
+        """在 interactive 节点上为设备设置 io.latency 目标（每个设备一次）"""
+        if device in self._protected:
+            return
+        self._protected.add(device)
+        node = SessionCgroup(self._class_node("interactive"), "interactive")
+        node._write("io.latency", f"{device} target={latency_target(device)}")
+        if self.io_weight_effective(device) is False:
+            logger.warning(f"⚠ 设备 {device} 未使用 BFQ 调度器且未启用 io.cost，优先级间的 io.weight 不生效；"
+                           f"交互式会话只由 io.latency 目标保护")
+
+    def create(self, name: str, budget: SessionBudget, device: Optional[str] = None) -> SessionCgroup:
+        """
+        创建会话叶节点并写入预算
+
+        :param name: 节点名（同名节点已存在时复用）
+        :param device: 镜像所在块设备 "MAJ:MIN"
+        :raises OSError: 无法创建节点
+        """
+        self.prune()
+        path = self._class_node(budget.priority) / name
+        if device:
+            self._protect_interactive(device)
+        path.mkdir(exist_ok=True)
+        group = SessionCgroup(path, budget.priority)
+        group.apply(budget, device)
+        logger.info(f"✓ 会话资源预算: {path.relative_to(self.root)} ({budget.priority})")
+        return group
+
+    def place(self, name: str, pid: int, budget: SessionBudget,
+              image_path: Union[str, Path]) -> Optional[SessionCgroup]:
+        """
+        为服务进程创建会话节点并移入（预算尽力而为，失败只告警）
+
+        :param image_path: 镜像文件，按其所在块设备设置 io.max
+        :return: 会话节点，cgroup 不可用时为 None
+        """
+        if not self.available():
+            logger.warning("⚠ cgroup v2 不可用或无写权限，忽略资源预算")
+            return None
+        try:
+            group = self.create(name, budget, backing_device(image_path))
+        except OSError as e:
+            logger.warning(f"创建会话 cgroup 失败，忽略资源预算: {e}")
+            return None
+        group.attach(pid)
+        return group
+
+    def sessions(self) -> List[SessionCgroup]:
+        """列出所有会话叶节点"""
+        groups = []
+        if not self.base or not self.base.is_dir():
+            return groups
+        for priority in PRIORITY_CLASSES:
+            node = self.base / priority
+            if node.is_dir():
+                groups.extend(SessionCgroup(p, priority) for p in sorted(node.iterdir()) if p.is_dir())
+        return groups
+
+    def prune(self, min_age: float = 60.0) -> int:
+        """
+        删除没有进程的会话叶节点，返回删除数量
+
+        :param min_age: 只删除创建超过此秒数的节点（其他进程刚创建、尚未移入进程的节点不受影响）
+        """
+        removed = 0
+        now = time.time()
+        for group in self.sessions():
+            try:
+                age = now - group.path.stat().st_mtime
+            except OSError:
+                continue
+            if age >= min_age and not group.pids() and group.remove():
+                removed += 1
+        return removed
+
+    def __repr__(self) -> str:
+        return f"CgroupManager(base='{self.base}')"
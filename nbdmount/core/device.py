@@ -1,98 +1,356 @@
-"""
-NBD 设备抽象层 - 体现资源封装
-"""
-import logging
-from contextlib import contextmanager
-from typing import Generator, Optional, List
-from ..formats import ImageFormat
-from ..utils.command import run_command
-from ..utils.devices import find_unused_nbd_device, get_partitions
-from ..exceptions.errors import DeviceError
-
-
-logger = logging.getLogger(__name__)
-
-
-class NBDDevice:
-    """
-    NBD 设备资源封装
-    
-    设计亮点:
-    - 资源生命周期管理
-    - 上下文管理器自动清理
-    - 状态跟踪
-    """
-    
-    def __init__(self, image: ImageFormat):
-        self.image = image
-        self.device_path: Optional[str] = None
-        self.is_connected = False
-        self.partitions: List[str] = []
-    
-    @contextmanager
-    def connect(self, read_only: bool = True) -> Generator['NBDDevice', None, None]:
-        """
-        连接 NBD 设备的上下文管理器
-        
-        :param read_only: 是否以只读模式连接
-        :yield: 已连接的 NBDDevice 实例
-        """
-        if self.is_connected:
-            raise DeviceError("设备已连接", device=self.device_path)
-        
-        try:
-            self._connect(read_only)
-            yield self
-        finally:
-            self.disconnect()
-    
-    def _connect(self, read_only: bool) -> None:
-        """实际连接逻辑"""
-        self.device_path = find_unused_nbd_device()
-        logger.info(f"将镜像 '{self.image.image_path.name}' 连接到 {self.device_path}")
-        
-        cmd = [
-            "qemu-nbd",
-            "--connect", self.device_path,
-            "--format", self.image.get_qemu_format_flag(),
-        ]
-        if read_only:
-            cmd.append("--read-only")
-        cmd.append(str(self.image.image_path))
-        
-        run_command(cmd, timeout=30)
-        self.is_connected = True
-        
-        # 通知内核重读分区表
-        try:
-            run_command(["partprobe", self.device_path], timeout=10)
-            # 等待分区设备出现（最多2秒）
-            import time
-            for _ in range(4):
-                self.partitions = get_partitions(self.device_path)
-                if self.partitions:
-                    break
-                time.sleep(0.5)
-        except Exception as e:
-            logger.warning(f"分区表重读失败（可能无分区表）: {e}")
-            self.partitions = []
-    
-    def disconnect(self) -> None:
-        """安全断开 NBD 连接"""
-        if not self.is_connected or not self.device_path:
-            return
-        
-        try:
-            logger.info(f"断开 NBD 设备: {self.device_path}")
-            run_command(["qemu-nbd", "--disconnect", self.device_path], timeout=10)
-        except Exception as e:
-            # 断开失败可能因为设备已自动断开，仅记录警告
-            logger.warning(f"断开 {self.device_path} 时出错（可能已断开）: {e}")
-        finally:
-            self.is_connected = False
-            self.device_path = None
-            self.partitions = []
-    
-    def __repr__(self) -> str:
-        status = "connected" if self.is_connected else "disconnected"
-        return f"NBDDevice(path={self.device_path}, status={status}, image={self.image.image_path.name})"
\ No newline at end of file
+"""
+NBD 设备抽象层 - 体现资源封装
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Generator, Optional, List
+from ..formats import ImageFormat
+from ..utils.command import run_command
+from ..utils.devices import find_unused_nbd_device, get_partitions, get_nbd_pid
+from ..exceptions.errors import DeviceError
+from .cgroup import CgroupManager, SessionBudget, SessionCgroup
+from .journal import SessionJournal
+from .prefetch import AccessRecorder, Prefetcher, PrefetchStore
+from .watchdog import DeviceHealth, Watchdog, set_ioctl_timeout
+
+
+logger = logging.getLogger(__name__)
+
+
+class NBDDevice:
+    """
+    NBD 设备资源封装
+    
+    设计亮点:
+    - 资源生命周期管理
+    - 上下文管理器自动清理
+    - 状态跟踪
+    - 连接/断开写入会话日志，便于异常退出后清理
+    - _attach/_detach 为后端扩展点，本类为 qemu-nbd --connect（ioctl）后端
+    - 可选的健康监视线程，服务进程失效或 I/O 停滞时尽快发现
+    - 可选的资源预算：服务进程放入 cgroup v2 会话节点
+    """
+    BACKEND = "ioctl"
+    # 有服务进程可供监视（loop 后端没有）
+    WATCHDOG = True
+    # 服务进程失效后能否替换连接而不断开设备
+    CAN_RECONNECT = False
+    
+    def __init__(
+        self,
+        image: ImageFormat,
+        journal: Optional[SessionJournal] = None,
+        prefetch: Optional[PrefetchStore] = None
+    ):
+        self.image = image
+        self.journal = journal
+        self.prefetch = prefetch
+        self._recorder: Optional[AccessRecorder] = None
+        self._prefetcher: Optional[Prefetcher] = None
+        self.device_path: Optional[str] = None
+        self.server_pid: Optional[int] = None
+        self.is_connected = False
+        self.partitions: List[str] = []
+        # 用户态解析出的分区数（None 表示未知），用于缩短等待分区节点的时间
+        self.expected_partitions: Optional[int] = None
+        self._reserved: Optional[str] = None
+        self.watchdog: Optional[Watchdog] = None
+        self._watchdog_options: Optional[dict] = None
+        self.budget: Optional[SessionBudget] = None
+        self.cgroup: Optional[SessionCgroup] = None
+        self._cgroups: Optional[CgroupManager] = None
+    
+    @contextmanager
+    def connect(self, read_only: bool = True) -> Generator['NBDDevice', None, None]:
+        """
+        连接 NBD 设备的上下文管理器
+        
+        :param read_only: 是否以只读模式连接
+        :yield: 已连接的 NBDDevice 实例
+        """
+        self.open(read_only)
+        try:
+            yield self
+        finally:
+            self.close()
+    
+    def open(self, read_only: bool = True) -> None:
+        """
+        连接设备并开始预读（需配合 close 断开）
+        
+        :param read_only: 是否以只读模式连接
+        """
+        if self.is_connected:
+            raise DeviceError("设备已连接", device=self.device_path)
+        try:
+            self._connect(read_only)
+            self._start_prefetch()
+            self._start_watchdog()
+        except BaseException:
+            self.close()
+            raise
+    
+    def close(self) -> None:
+        """停止监视与预读并断开设备"""
+        self._stop_watchdog()
+        self._stop_prefetch()
+        self.disconnect()
+    
+    def abandon(self) -> None:
+        """
+        交出设备：停止监视与预读但不断开，会话日志中的连接记录保持不变
+        
+        之后由共享会话的最后一个持有者按会话日志断开
+        """
+        self._stop_watchdog()
+        self._stop_prefetch()
+        # 服务进程连同其 cgroup 节点一并交出
+        self.cgroup = None
+        self.is_connected = False
+        self.device_path = None
+        self.server_pid = None
+        self.partitions = []
+    
+    def enable_watchdog(self, **options) -> None:
+        """
+        连接后启动健康监视（在 open 之前调用）
+        
+        :param options: 传给 Watchdog 的参数（interval、io_timeout、dead_conn_timeout 等）
+        """
+        self._watchdog_options = options
+    
+    @property
+    def health(self) -> Optional[DeviceHealth]:
+        """健康状态（未启用监视时为 None）"""
+        return self.watchdog.health if self.watchdog else None
+    
+    def sys_pid(self) -> Optional[int]:
+        """/sys/block/nbdN/pid 的当前值，设备已断开时为 None"""
+        return get_nbd_pid(self.device_path) if self.device_path else None
+    
+    def set_timeouts(self, io_timeout: int, dead_conn_timeout: int) -> None:
+        """
+        调整内核请求超时；ioctl 后端的连接由 qemu-nbd 持有，没有死连接等待
+        
+        :param io_timeout: 请求超时（秒）
+        :param dead_conn_timeout: 死连接等待时间（秒，本后端忽略）
+        """
+        set_ioctl_timeout(self.device_path, io_timeout)
+    
+    def reconnect(self) -> None:
+        """服务进程失效后替换连接（本后端不支持）"""
+        raise DeviceError(f"{self.BACKEND} 后端不支持重连", device=self.device_path)
+    
+    def set_budget(self, budget: SessionBudget, cgroups: Optional[CgroupManager] = None) -> None:
+        """
+        连接后把服务进程放入 cgroup v2 会话节点（在 open 之前调用）
+
+        :param cgroups: cgroup 管理器，默认使用系统的 cgroup2 挂载点
+        """
+        self.budget = budget
+        self._cgroups = cgroups
+    
+    def _place_server(self) -> None:
+        """把服务进程移入会话节点（netlink 后端重启服务后再次调用）"""
+        if not self.budget:
+            return
+        if not self.server_pid or self.server_pid == os.getpid():
+            # loop 等后端的 I/O 由内核线程与各读取进程发出，没有可放入 cgroup 的服务进程
+            logger.warning(f"⚠ {self.BACKEND} 后端没有服务进程，资源预算未生效"
+                           f"（需要预算时使用 --nbd-backend netlink 或 ioctl）")
+            return
+        if self.cgroup:
+            self.cgroup.attach(self.server_pid)
+            return
+        self.cgroup = (self._cgroups or CgroupManager()).place(
+            f"{os.path.basename(self.device_path)}-{self.server_pid}",
+            self.server_pid, self.budget, self.image.image_path
+        )
+    
+    def _release_cgroup(self) -> None:
+        if self.cgroup:
+            # 服务进程可能仍在退出，删除失败的节点由下次创建时清理
+            self.cgroup.remove()
+            self.cgroup = None
+    
+    def _start_watchdog(self) -> None:
+        if self._watchdog_options is None:
+            return
+        if not self.WATCHDOG:
+            logger.debug(f"{self.BACKEND} 后端没有服务进程，跳过健康监视")
+            return
+        state_dir = self.journal.run_dir / "health" if self.journal else None
+        self.watchdog = Watchdog(self, state_dir=state_dir, **self._watchdog_options)
+        self.watchdog.start()
+    
+    def _stop_watchdog(self) -> None:
+        if self.watchdog:
+            self.watchdog.stop()
+            self.watchdog = None
+    
+    def reserve(self) -> None:
+        """预先选定空闲设备节点（可与镜像验证并行），连接时优先使用"""
+        self._reserved = find_unused_nbd_device()
+    
+    def release(self) -> None:
+        """放弃预选的设备节点"""
+        self._reserved = None
+    
+    def _connect(self, read_only: bool) -> None:
+        """实际连接逻辑：后端连接 -> 登记会话 -> 识别分区"""
+        self.image.on_attach()
+        try:
+            self._attach(read_only)
+        except Exception:
+            self.image.on_detach()
+            raise
+        self.is_connected = True
+        sys_pid = get_nbd_pid(self.device_path)
+        if self.server_pid is None:
+            self.server_pid = sys_pid
+        self._place_server()
+        if self.journal:
+            self.journal.record_attach(
+                self.device_path, str(self.image.image_path), sys_pid,
+                backend=self.BACKEND, server=self.server_pid
+            )
+        self._scan_partitions()
+    
+    def _attach(self, read_only: bool) -> None:
+        """后端连接：选择设备并把镜像挂到设备上，设置 device_path"""
+        reserved, self._reserved = self._reserved, None
+        if reserved and get_nbd_pid(reserved) is None:
+            self.device_path = reserved
+        else:
+            self.device_path = find_unused_nbd_device()
+        logger.info(f"将镜像 '{self.image.image_path.name}' 连接到 {self.device_path}")
+        
+        cmd = ["qemu-nbd", "--connect", self.device_path]
+        if read_only:
+            cmd.append("--read-only")
+        cmd.extend(self.image.qemu_source_args())
+        run_command(cmd, timeout=30)
+    
+    def _detach(self) -> None:
+        """后端断开"""
+        run_command(["qemu-nbd", "--disconnect", self.device_path], timeout=10)
+    
+    def _scan_partitions(self) -> None:
+        """通知内核重读分区表并等待分区设备出现"""
+        if self.expected_partitions == 0:
+            # 用户态解析已确认没有分区表
+            self.partitions = []
+            return
+        try:
+            run_command(["partprobe", self.device_path], timeout=10)
+            self._wait_partitions()
+        except Exception as e:
+            logger.warning(f"分区表重读失败（可能无分区表）: {e}")
+            self.partitions = []
+    
+    def _wait_partitions(self, timeout: float = 2.0) -> None:
+        """
+        等待分区设备节点出现
+        
+        已知分区数时以短间隔轮询到节点齐全为止，否则出现任意分区即返回
+        """
+        expected = self.expected_partitions
+        interval = 0.5 if expected is None else 0.05
+        deadline = time.monotonic() + timeout
+        while True:
+            self.partitions = get_partitions(self.device_path)
+            found = len(self.partitions) >= expected if expected is not None else bool(self.partitions)
+            if found or time.monotonic() >= deadline:
+                break
+            time.sleep(interval)
+        logger.info(f"在 {self.device_path} 上检测到 {len(self.partitions)} 个分区: {self.partitions}")
+    
+    def _start_prefetch(self) -> None:
+        """回放上次记录的访问轮廓，并开始记录本次会话"""
+        if not self.prefetch:
+            return
+        profile = self.prefetch.load(self.image)
+        if profile and profile.targets:
+            logger.info(f"按历史轮廓预读 {profile.total_bytes / (1 << 20):.1f} MB")
+            self._prefetcher = Prefetcher(self.device_path, self.partitions, profile)
+            self._prefetcher.start()
+        self._recorder = AccessRecorder(self.device_path, self.partitions, replayed=profile)
+        self._recorder.start()
+    
+    def _stop_prefetch(self) -> None:
+        """停止预读，保存本次会话的访问轮廓"""
+        if self._prefetcher:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        if self._recorder:
+            try:
+                self.prefetch.save(self.image, self._recorder.stop())
+            except Exception as e:
+                logger.warning(f"记录访问轮廓失败: {e}")
+            self._recorder = None
+    
+    def disconnect(self) -> None:
+        """安全断开 NBD 连接"""
+        if not self.is_connected or not self.device_path:
+            return
+        
+        try:
+            logger.info(f"断开 NBD 设备: {self.device_path}")
+            self._detach()
+        except Exception as e:
+            # 断开失败可能因为设备已自动断开，仅记录警告
+            logger.warning(f"断开 {self.device_path} 时出错（可能已断开）: {e}")
+        else:
+            if self.journal:
+                self.journal.record_detach(self.device_path)
+        finally:
+            self._release_cgroup()
+            self.image.on_detach()
+            self.is_connected = False
+            self.device_path = None
+            self.server_pid = None
+            self.partitions = []
+    
+    def __repr__(self) -> str:
+        status = "connected" if self.is_connected else "disconnected"
+        return f"NBDDevice(path={self.device_path}, status={status}, image={self.image.image_path.name})"
+
+
+DEVICE_BACKENDS = ("auto", "ioctl", "netlink", "loop")
+
+
+def create_device(
+    image: ImageFormat,
+    backend: str = "auto",
+    journal: Optional[SessionJournal] = None,
+    prefetch: Optional[PrefetchStore] = None,
+    budget: Optional[SessionBudget] = None
+) -> NBDDevice:
+    """
+    按后端创建设备
+
+    :param backend: ioctl=qemu-nbd --connect 使用静态设备节点, netlink=内核按需分配设备,
+                    loop=RAW 布局镜像直接用 loop 设备（不经过 qemu-nbd）,
+                    auto=RAW 布局镜像优先 loop（有资源预算时除外），其余格式在内核支持
+                    nbd netlink 接口时使用 netlink
+    :param budget: 会话资源预算；只作用于服务进程，auto 时据此避开没有服务进程的 loop 后端
+    """
+    from .loop_device import LOOP_CONTROL, LoopDevice
+    from .netlink_device import NetlinkNBDDevice, netlink_available
+
+    if backend not in DEVICE_BACKENDS:
+        raise ValueError(f"未知的设备后端: {backend}")
+    if backend == "auto":
+        if image.RAW_LAYOUT and os.path.exists(LOOP_CONTROL) and not budget:
+            backend = "loop"
+        else:
+            backend = "netlink" if netlink_available() else "ioctl"
+    if backend == "loop":
+        # 单分区视图：loop 设备按偏移只映射该分区
+        offset, size = getattr(image, "extent", (0, 0))
+        return LoopDevice(image, journal=journal, prefetch=prefetch, offset=offset, size_limit=size)
+    if backend == "netlink":
+        return NetlinkNBDDevice(image, journal=journal, prefetch=prefetch)
+    return NBDDevice(image, journal=journal, prefetch=prefetch)
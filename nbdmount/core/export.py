@@ -0,0 +1,359 @@
+"""
+共享只读导出 - 一个 qemu-nbd 服务多个本地/远程使用者
+
+serve 动作为镜像启动单个 qemu-nbd 导出（--shared/--persistent），以名称登记到
+/run/nbdmount/exports；其他 NBDMountTool 通过 --export 连接该导出而不是直接打开镜像，
+镜像只被读取、缓存一次。登记表记录使用者引用计数，空闲超时后自动关停导出
+"""
+import logging
+import os
+import re
+import signal
+import socket
+import time
+from pathlib import Path
+from typing import ClassVar, List, Optional
+from urllib.parse import urlparse
+from ..formats import ImageFormat
+from ..utils.command import run_command
+from ..utils.statefile import locked_state, read_state
+from ..exceptions.errors import DeviceBusyError, DeviceNotFoundError, ImageError
+from .cgroup import CgroupManager, SessionBudget, SessionCgroup
+from .journal import DEFAULT_RUN_DIR, is_owner_alive
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NBD_PORT = 10809
+_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def count_tcp_connections(port: int) -> int:
+    """统计本机指定端口上已建立的 TCP 连接数（读取 /proc/net/tcp{,6}）"""
+    count = 0
+    port_hex = f":{port:04X}"
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f, None)  # 表头
+                for line in f:
+                    fields = line.split()
+                    # local_address 以 :PORT 结尾，状态 01 = ESTABLISHED
+                    if len(fields) > 3 and fields[1].endswith(port_hex) and fields[3] == "01":
+                        count += 1
+        except OSError:
+            continue
+    return count
+
+
+class ExportRegistry:
+    """
+    导出登记表
+
+    每个导出一个 JSON 文件，记录服务进程、连接地址与使用者 PID 列表；
+    所有修改都在文件锁内完成，已退出的使用者在读取时剔除
+    """
+
+    def __init__(self, run_dir: Optional[str] = None):
+        self.root = Path(run_dir or DEFAULT_RUN_DIR) / "exports"
+
+    def _path(self, name: str) -> Path:
+        if not _NAME_RE.match(name):
+            raise ImageError(f"非法的导出名称: {name!r}")
+        return self.root / f"{name}.json"
+
+    @staticmethod
+    def _prune(state: dict) -> None:
+        state["consumers"] = [pid for pid in state.get("consumers", []) if is_owner_alive(pid)]
+
+    def register(self, name: str, entry: dict) -> None:
+        """登记新导出，同名导出仍存活时报错"""
+        with locked_state(self._path(name)) as state:
+            if state and is_owner_alive(state.get("pid", 0)):
+                raise DeviceBusyError(f"导出 '{name}' 已由 PID {state['pid']} 提供")
+            state.clear()
+            state.update(entry, name=name, consumers=[], last_active=time.time())
+
+    def unregister(self, name: str) -> None:
+        """注销导出"""
+        with locked_state(self._path(name)) as state:
+            state.clear()
+
+    def lookup(self, name: str) -> Optional[dict]:
+        """查找存活的导出"""
+        state = read_state(self._path(name))
+        if not state or not is_owner_alive(state.get("pid", 0)):
+            return None
+        return state
+
+    def acquire(self, name: str, pid: Optional[int] = None) -> dict:
+        """登记一个使用者，返回导出信息"""
+        with locked_state(self._path(name)) as state:
+            alive = bool(state) and is_owner_alive(state.get("pid", 0))
+            if alive:
+                self._prune(state)
+                state["consumers"].append(pid or os.getpid())
+                state["last_active"] = time.time()
+                entry = dict(state)
+            else:
+                # 清空的状态只在正常退出 with 时才删除登记文件，因此在块外抛出
+                state.clear()
+        if not alive:
+            raise DeviceNotFoundError(f"导出 '{name}' 不存在或服务进程已退出")
+        return entry
+
+    def release(self, name: str, pid: Optional[int] = None) -> None:
+        """注销一个使用者"""
+        with locked_state(self._path(name)) as state:
+            if not state:
+                return
+            consumers = state.get("consumers", [])
+            if (pid or os.getpid()) in consumers:
+                consumers.remove(pid or os.getpid())
+            self._prune(state)
+            state["last_active"] = time.time()
+
+    def refcount(self, name: str) -> int:
+        """当前存活使用者数量"""
+        with locked_state(self._path(name)) as state:
+            if not state:
+                return 0
+            self._prune(state)
+            if state["consumers"]:
+                state["last_active"] = time.time()
+            return len(state["consumers"])
+
+    def list_exports(self) -> List[dict]:
+        """列出所有存活的导出"""
+        if not self.root.is_dir():
+            return []
+        exports = []
+        for path in sorted(self.root.glob("*.json")):
+            state = self.lookup(path.stem)
+            if state:
+                exports.append(state)
+        return exports
+
+
+class ExportServer:
+    """
+    单镜像共享导出服务
+
+    设计亮点:
+    - qemu-nbd --fork 在套接字就绪后才返回，避免使用者抢跑
+    - 始终只读导出，--shared 允许多个并发连接，--persistent 使最后一个连接断开后仍保持服务
+    - 引用计数 + TCP 连接数判断空闲，超时自动关停
+    """
+
+    def __init__(
+        self,
+        image: ImageFormat,
+        name: str,
+        socket_path: Optional[str] = None,
+        bind: Optional[str] = None,
+        port: int = DEFAULT_NBD_PORT,
+        shared: int = 16,
+        idle_timeout: Optional[float] = 300,
+        registry: Optional[ExportRegistry] = None,
+        budget: Optional[SessionBudget] = None,
+        cgroups: Optional[CgroupManager] = None
+    ):
+        """
+        :param budget: 服务进程的资源预算（cgroup v2），为空时不限制
+        :param cgroups: cgroup 管理器，默认使用系统的 cgroup2 挂载点
+        """
+        self.image = image
+        self.name = name
+        self.registry = registry or ExportRegistry()
+        self.bind = bind
+        self.port = port
+        self.socket_path = None if bind else Path(socket_path or self.registry.root / f"{name}.sock")
+        self.shared = shared
+        self.idle_timeout = idle_timeout
+        self.pid: Optional[int] = None
+        self.budget = budget
+        self.cgroups = cgroups
+        self.cgroup: Optional[SessionCgroup] = None
+
+    @property
+    def uri(self) -> str:
+        """使用者连接地址（qemu 块设备 URI 语法）"""
+        if self.socket_path:
+            return f"nbd+unix:///{self.name}?socket={self.socket_path}"
+        host = self.bind if self.bind not in ("0.0.0.0", "::") else socket.gethostname()
+        if ":" in host:
+            host = f"[{host}]"
+        return f"nbd://{host}:{self.port}/{self.name}"
+
+    @property
+    def is_alive(self) -> bool:
+        return self.pid is not None and is_owner_alive(self.pid)
+
+    def start(self) -> None:
+        """启动 qemu-nbd 并登记导出"""
+        # 先于清理套接字/PID 文件检查：同名导出仍存活时不能动它的文件
+        existing = self.registry.lookup(self.name)
+        if existing:
+            raise DeviceBusyError(f"导出 '{self.name}' 已由 PID {existing['pid']} 提供")
+        self.registry.root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        pid_file = self.registry.root / f"{self.name}.pid"
+        pid_file.unlink(missing_ok=True)
+
+        cmd = [
+            "qemu-nbd",
+            "--read-only",
+            "--persistent",
+            f"--shared={self.shared}",
+            "--export-name", self.name,
+            "--fork",
+            "--pid-file", str(pid_file),
+        ]
+        if self.socket_path:
+            self.socket_path.unlink(missing_ok=True)
+            cmd += ["--socket", str(self.socket_path)]
+        else:
+            cmd += ["--bind", self.bind, "--port", str(self.port)]
+        cmd.extend(self.image.qemu_source_args())
+
+        logger.info(f"启动共享导出 '{self.name}': {self.image.image_path.name} -> {self.uri}")
+        run_command(cmd, timeout=30)
+        self.pid = int(pid_file.read_text().strip())
+        self._place_server()
+
+        try:
+            self.registry.register(self.name, {
+                "pid": self.pid,
+                "uri": self.uri,
+                "image": str(self.image.image_path),
+                "format": self.image.FORMAT_NAME,
+                "size": self.image.image_path.stat().st_size,
+                "socket": str(self.socket_path) if self.socket_path else None,
+                "bind": self.bind,
+                "port": None if self.socket_path else self.port,
+                "shared": self.shared,
+                "started": time.time(),
+            })
+        except Exception:
+            self._kill()
+            raise
+
+    def _place_server(self) -> None:
+        if self.budget:
+            self.cgroup = (self.cgroups or CgroupManager()).place(
+                f"export-{self.name}-{self.pid}", self.pid, self.budget, self.image.image_path
+            )
+
+    def _connections(self) -> int:
+        """活跃连接数：登记的使用者 + TCP 直连的远程使用者"""
+        refs = self.registry.refcount(self.name)
+        if not self.socket_path:
+            refs += count_tcp_connections(self.port)
+        return refs
+
+    def serve_forever(self, poll_interval: float = 1.0) -> None:
+        """阻塞直到服务进程退出或空闲超时"""
+        idle_since: Optional[float] = None
+        while self.is_alive:
+            if self._connections():
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif self.idle_timeout is not None and time.monotonic() - idle_since >= self.idle_timeout:
+                logger.info(f"导出 '{self.name}' 空闲 {self.idle_timeout:.0f}s，自动关停")
+                return
+            time.sleep(poll_interval)
+        logger.warning(f"导出 '{self.name}' 的服务进程已退出")
+
+    def _kill(self) -> None:
+        if not self.is_alive:
+            return
+        os.kill(self.pid, signal.SIGTERM)
+        for _ in range(50):
+            if not is_owner_alive(self.pid):
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(self.pid, signal.SIGKILL)
+
+    def stop(self) -> None:
+        """关停导出并注销"""
+        try:
+            self._kill()
+        finally:
+            self.registry.unregister(self.name)
+            if self.socket_path:
+                self.socket_path.unlink(missing_ok=True)
+            (self.registry.root / f"{self.name}.pid").unlink(missing_ok=True)
+            if self.cgroup:
+                self.cgroup.remove()
+                self.cgroup = None
+            self.pid = None
+            logger.info(f"✓ 导出 '{self.name}' 已关停")
+
+    def __enter__(self) -> "ExportServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    def __repr__(self) -> str:
+        return f"ExportServer(name='{self.name}', uri='{self.uri}', pid={self.pid})"
+
+
+class NBDExportImage(ImageFormat):
+    """
+    以共享导出为数据源的"镜像"
+
+    导出内容已由服务端解码为裸块数据，因此总是以 raw 格式连接；
+    通过登记表名称连接时会在连接/断开时增减引用计数
+    """
+    FORMAT_NAME: ClassVar[str] = "nbd"
+    PRIORITY: ClassVar[int] = 1000  # 不参与自动检测
+
+    def __init__(self, export: str, registry: Optional[ExportRegistry] = None):
+        self.registry = registry or ExportRegistry()
+        if "://" in export:
+            # 直接给出 URI（远程导出），不登记引用
+            parsed = urlparse(export)
+            self.export_name: Optional[str] = None
+            self.uri = export
+            self.entry: dict = {}
+            self.image_path = Path(parsed.path.strip("/") or parsed.hostname or "nbd")
+        else:
+            entry = self.registry.lookup(export)
+            if not entry:
+                raise DeviceNotFoundError(f"导出 '{export}' 不存在或服务进程已退出")
+            self.export_name = export
+            self.uri = entry["uri"]
+            self.entry = entry
+            self.image_path = Path(entry["image"])
+
+    def _validate_path(self) -> None:
+        # 数据源是网络导出，本地镜像文件可能不存在
+        pass
+
+    def get_qemu_format_flag(self) -> str:
+        return "raw"
+
+    def qemu_source_args(self) -> List[str]:
+        return ["--format", "raw", self.uri]
+
+    def validate(self) -> bool:
+        return self.export_name is None or self.registry.lookup(self.export_name) is not None
+
+    @classmethod
+    def detect(cls, image_path: str) -> bool:
+        return False
+
+    def on_attach(self) -> None:
+        if self.export_name:
+            self.registry.acquire(self.export_name)
+
+    def on_detach(self) -> None:
+        if self.export_name:
+            self.registry.release(self.export_name)
+
+    def __repr__(self) -> str:
+        return f"NBDExportImage(uri='{self.uri}')"
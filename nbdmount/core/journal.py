@@ -0,0 +1,422 @@
+"""
+会话归属日志 - 进程异常退出后的批量清理
+
+每次连接设备、挂载分区都会向 /run/nbdmount 下的追加式日志写入一行 JSON，
+cleanup 动作重放日志，与 /proc/self/mountinfo 和 /sys/block/nbd*/pid 交叉核对后，
+并行拆除属主进程已不存在的会话
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from ..utils.command import run_command
+from ..utils.devices import get_nbd_pid
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RUN_DIR = "/run/nbdmount"
+JOURNAL_NAME = "sessions.journal"
+
+# /dev/nbd0p1 -> /dev/nbd0
+_PARTITION_RE = re.compile(r"^(/dev/[a-z]+\d+)p\d+$")
+
+
+def process_start_time(pid: int) -> Optional[int]:
+    """读取进程启动时间（/proc/<pid>/stat 第 22 列），用于识别 PID 复用"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+        # comm 字段可能包含空格，从最后一个 ')' 之后开始切分
+        return int(stat[stat.rindex(")") + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def is_owner_alive(pid: int, start_time: Optional[int] = None) -> bool:
+    """属主进程是否仍然存活（且不是复用了同一 PID 的其他进程）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # EPERM: 进程存在但属于其他用户
+    if start_time is None:
+        return True
+    return process_start_time(pid) == start_time
+
+
+def read_mounted_targets(targets: Iterable[str]) -> Set[str]:
+    """
+    返回给定挂载点中当前仍处于挂载状态的部分
+
+    只解析 mountinfo 的挂载点字段，不为无关挂载条目做任何额外工作
+    """
+    wanted = set(targets)
+    if not wanted:
+        return set()
+    mounted = set()
+    with open("/proc/self/mountinfo") as f:
+        for line in f:
+            # 第 5 列为挂载点，空格等字符以八进制转义
+            target = line.split(" ", 5)[4]
+            if "\\" in target:
+                target = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), target)
+            if target in wanted:
+                mounted.add(target)
+    return mounted
+
+
+class SessionRecord:
+    """日志重放得到的单个会话"""
+
+    def __init__(self, device: str, image: str, pid: Optional[int], owner: int,
+                 owner_start: Optional[int] = None, started: float = 0.0,
+                 backend: str = "ioctl", server: Optional[int] = None):
+        self.device = device
+        self.image = image
+        self.pid = pid                  # 连接时 /sys/block/nbdN/pid 的值
+        self.owner = owner
+        self.owner_start = owner_start
+        self.started = started
+        self.backend = backend          # ioctl / netlink
+        self.server = server            # 提供数据的服务进程（netlink 后端为私有 qemu-nbd）
+        self.mounts: List[str] = []  # 按挂载顺序
+        self.volumes: List[Tuple[str, str]] = []  # (类型, 名称)，按激活顺序
+
+    @property
+    def is_orphaned(self) -> bool:
+        return not is_owner_alive(self.owner, self.owner_start)
+
+    def to_events(self) -> List[dict]:
+        """压缩日志时还原为事件序列"""
+        events = [{
+            "op": "attach", "device": self.device, "image": self.image, "pid": self.pid,
+            "owner": self.owner, "owner_start": self.owner_start, "ts": self.started,
+            "backend": self.backend, "server": self.server,
+        }]
+        events.extend(
+            {"op": "volume", "device": self.device, "kind": kind, "name": name,
+             "owner": self.owner, "ts": self.started}
+            for kind, name in self.volumes
+        )
+        events.extend(
+            {"op": "mount", "device": self.device, "path": path,
+             "owner": self.owner, "ts": self.started}
+            for path in self.mounts
+        )
+        return events
+
+    def __repr__(self) -> str:
+        return (f"SessionRecord(device='{self.device}', image='{self.image}', pid={self.pid}, "
+                f"owner={self.owner}, mounts={len(self.mounts)})")
+
+
+class SessionJournal:
+    """
+    追加式会话归属日志
+
+    设计亮点:
+    - 每条记录一次 O_APPEND 写入，多进程并发追加无需协调
+    - 记录失败只告警，不影响挂载主流程
+    - 重放后压缩，日志长度只与存活会话数量相关
+    """
+
+    def __init__(self, run_dir: Optional[str] = None):
+        self.run_dir = Path(run_dir or DEFAULT_RUN_DIR)
+        self.path = self.run_dir / JOURNAL_NAME
+        self._owner = os.getpid()
+        self._owner_start = process_start_time(self._owner)
+        self._disabled = False
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[int]:
+        """打开日志并加锁：追加用共享锁，压缩用排它锁"""
+        self.run_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                # 等锁期间日志可能已被压缩替换，旧 inode 上的写入无人重放
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        try:
+            yield fd
+        finally:
+            os.close(fd)
+
+    def _append(self, event: dict) -> None:
+        if self._disabled:
+            return
+        event.setdefault("owner", self._owner)
+        event.setdefault("ts", time.time())
+        line = (json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+        try:
+            with self._locked(exclusive=False) as fd:
+                os.write(fd, line)
+        except OSError as e:
+            # 非 root 或 /run 不可写时仅告警一次，后续不再尝试
+            logger.warning(f"写入会话日志 {self.path} 失败，已停用日志: {e}")
+            self._disabled = True
+
+    def record_attach(
+        self,
+        device: str,
+        image: str,
+        pid: Optional[int] = None,
+        backend: str = "ioctl",
+        server: Optional[int] = None
+    ) -> None:
+        """
+        记录设备连接
+
+        :param pid: /sys/block/nbdN/pid 的值，清理时用于判断设备是否已被他人接管
+        :param backend: 设备后端（ioctl / netlink），决定清理时的断开方式
+        :param server: 服务进程 PID（与 pid 不同时才有意义）
+        """
+        self._append({"op": "attach", "device": device, "image": image, "pid": pid,
+                      "owner_start": self._owner_start, "backend": backend, "server": server})
+
+    def record_detach(self, device: str) -> None:
+        """记录设备断开"""
+        self._append({"op": "detach", "device": device})
+
+    def record_server(self, device: str, server: Optional[int]) -> None:
+        """记录服务进程更换（重连时重启了私有 qemu-nbd）"""
+        self._append({"op": "server", "device": device, "server": server})
+
+    def record_mount(self, source: str, mount_path: str, device: Optional[str] = None) -> None:
+        """
+        记录挂载
+
+        :param source: 被挂载的块设备
+        :param mount_path: 挂载点
+        :param device: 所属会话设备，默认由分区名推导（/dev/nbd0p1 -> /dev/nbd0）
+        """
+        if device is None:
+            match = _PARTITION_RE.match(source)
+            device = match.group(1) if match else source
+        self._append({"op": "mount", "device": device, "source": source, "path": mount_path})
+
+    def record_umount(self, mount_path: str) -> None:
+        """记录卸载"""
+        self._append({"op": "umount", "path": mount_path})
+
+    def record_volume(self, device: str, kind: str, name: str) -> None:
+        """记录会话设备上激活的堆叠卷（dm / luks / md）"""
+        self._append({"op": "volume", "device": device, "kind": kind, "name": name})
+
+    def record_volume_removed(self, device: str, name: str) -> None:
+        """记录堆叠卷已拆除"""
+        self._append({"op": "volume_removed", "device": device, "name": name})
+
+    def _read_events(self, fd: int) -> Iterator[dict]:
+        with os.fdopen(os.dup(fd), "r", encoding="utf-8") as f:
+            f.seek(0)
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 进程在写入中途被杀会留下半行，忽略即可
+                    continue
+
+    @staticmethod
+    def _fold(events: Iterable[dict]) -> Dict[str, SessionRecord]:
+        """把事件序列折叠为 {设备: 会话}"""
+        sessions: Dict[str, SessionRecord] = {}
+        mount_owner: Dict[str, str] = {}  # 挂载点 -> 设备
+        for ev in events:
+            op = ev.get("op")
+            device = ev.get("device")
+            if op == "attach":
+                sessions[device] = SessionRecord(
+                    device, ev.get("image", ""), ev.get("pid"), ev.get("owner", 0),
+                    ev.get("owner_start"), ev.get("ts", 0.0),
+                    ev.get("backend", "ioctl"), ev.get("server")
+                )
+            elif op == "detach":
+                sessions.pop(device, None)
+            elif op == "server" and device in sessions:
+                sessions[device].server = ev.get("server")
+            elif op == "mount" and device in sessions:
+                sessions[device].mounts.append(ev["path"])
+                mount_owner[ev["path"]] = device
+            elif op == "volume" and device in sessions:
+                sessions[device].volumes.append((ev["kind"], ev["name"]))
+            elif op == "volume_removed" and device in sessions:
+                sessions[device].volumes = [v for v in sessions[device].volumes if v[1] != ev.get("name")]
+            elif op == "umount":
+                owner = mount_owner.pop(ev.get("path"), None)
+                if owner in sessions and ev["path"] in sessions[owner].mounts:
+                    sessions[owner].mounts.remove(ev["path"])
+        return sessions
+
+    def replay(self) -> Dict[str, SessionRecord]:
+        """重放日志，返回仍登记在案的会话"""
+        if not self.path.exists():
+            return {}
+        with self._locked(exclusive=False) as fd:
+            return self._fold(self._read_events(fd))
+
+    def compact(self) -> Dict[str, SessionRecord]:
+        """重写日志，只保留仍登记在案的会话"""
+        with self._locked(exclusive=True) as fd:
+            sessions = self._fold(self._read_events(fd))
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for record in sessions.values():
+                    for ev in record.to_events():
+                        f.write(json.dumps(ev, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.path)
+        return sessions
+
+
+def _teardown_nbd(record: SessionRecord) -> bool:
+    """断开残留的 NBD 设备（确认仍由原 qemu-nbd 持有），并停止私有 qemu-nbd"""
+    ok = True
+    current_pid = get_nbd_pid(record.device)
+    if current_pid is None:
+        logger.debug(f"{record.device} 已断开")
+    elif record.pid is not None and current_pid != record.pid:
+        # 设备已被其他会话重新占用，不能断开
+        logger.warning(f"{record.device} 已由 PID {current_pid} 接管，跳过断开")
+    else:
+        try:
+            if record.backend == "netlink":
+                from .netlink_device import netlink_disconnect
+                netlink_disconnect(record.device)
+            else:
+                run_command(["qemu-nbd", "--disconnect", record.device], timeout=10)
+            logger.info(f"✓ 已断开残留设备: {record.device}")
+        except Exception as e:
+            logger.error(f"✗ 断开 {record.device} 失败: {e}")
+            ok = False
+
+    if ok and record.backend == "netlink" and record.server:
+        # 私有 qemu-nbd 不随设备断开退出
+        from .netlink_device import stop_server
+        stop_server(record.server)
+    return ok
+
+
+def _teardown_loop(record: SessionRecord) -> bool:
+    """解除残留的 loop 设备（AUTOCLEAR 通常已在卸载后自动释放）"""
+    from .loop_device import loop_backing_file, loop_detach
+
+    backing = loop_backing_file(record.device)
+    if backing is None:
+        logger.debug(f"{record.device} 已释放")
+        return True
+    if record.image and os.path.realpath(backing) != os.path.realpath(record.image):
+        logger.warning(f"{record.device} 已绑定到 {backing}，跳过解除")
+        return True
+    try:
+        loop_detach(record.device)
+        logger.info(f"✓ 已解除残留 loop 设备: {record.device}")
+    except Exception as e:
+        logger.error(f"✗ 解除 {record.device} 失败: {e}")
+        return False
+    return True
+
+
+def teardown_session(record: SessionRecord, journal: Optional[SessionJournal] = None,
+                     mounted: Optional[Set[str]] = None) -> bool:
+    """
+    拆除单个孤儿会话：惰性卸载残留挂载点，拆除堆叠卷，再断开设备
+
+    :param mounted: 调用方预先读取的仍处于挂载状态的挂载点（批量拆除时只读一次 mountinfo），
+                    为空时按本会话的挂载点读取
+    :return: 是否完全拆除
+    """
+    ok = True
+    if mounted is None:
+        mounted = read_mounted_targets(record.mounts)
+    # 反向卸载（后挂载的先卸载）；-l 使其立即从命名空间摘除，不等待忙碌的引用
+    for path in reversed(record.mounts):
+        if path not in mounted:
+            continue
+        try:
+            run_command(["umount", "-l", path], timeout=10)
+            logger.info(f"✓ 已卸载残留挂载点: {path}")
+        except Exception as e:
+            logger.error(f"✗ 卸载 {path} 失败: {e}")
+            ok = False
+        else:
+            if journal:
+                journal.record_umount(path)
+
+    # 逆序拆除堆叠卷（LV 映射 -> RAID -> LUKS），必须在断开设备之前
+    if ok:
+        from .volumes import VolumeStack
+        for kind, name in reversed(record.volumes):
+            try:
+                VolumeStack.deactivate(kind, name)
+                logger.info(f"✓ 已拆除残留卷: {name}")
+            except Exception as e:
+                logger.error(f"✗ 拆除 {name} 失败: {e}")
+                ok = False
+            else:
+                if journal:
+                    journal.record_volume_removed(record.device, name)
+
+    if record.backend == "loop":
+        ok = _teardown_loop(record) and ok
+    else:
+        ok = _teardown_nbd(record) and ok
+
+    if ok and journal:
+        journal.record_detach(record.device)
+    return ok
+
+
+def cleanup_stale_sessions(
+    journal: Optional[SessionJournal] = None,
+    max_workers: int = 8,
+    dry_run: bool = False
+) -> List[SessionRecord]:
+    """
+    并行清理属主进程已退出的会话
+
+    :param journal: 会话日志（默认 /run/nbdmount）
+    :param max_workers: 并行拆除的线程数
+    :param dry_run: 只列出孤儿会话，不做拆除
+    :return: 孤儿会话列表
+    """
+    from .cgroup import CgroupManager
+    from .shared import SharedRegistry
+
+    journal = journal or SessionJournal()
+    shared = SharedRegistry(str(journal.run_dir))
+    # 共享会话的创建者可能已退出，但其他持有者仍在使用设备
+    held = shared.held_devices()
+    orphans = [r for r in journal.replay().values() if r.is_orphaned and r.device not in held]
+    if not orphans:
+        logger.info("没有需要清理的残留会话")
+        return []
+
+    logger.info(f"发现 {len(orphans)} 个残留会话")
+    if dry_run:
+        return orphans
+
+    mounted = read_mounted_targets(path for r in orphans for path in r.mounts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(orphans)))) as pool:
+        results = list(pool.map(lambda r: teardown_session(r, journal, mounted), orphans))
+
+    failed = results.count(False)
+    if failed:
+        logger.warning(f"{failed} 个会话未能完全清理，保留在日志中以便重试")
+    journal.compact()
+    shared.purge()
+    # 服务进程已停止，空的会话 cgroup 节点一并删除
+    CgroupManager().prune()
+    return orphans
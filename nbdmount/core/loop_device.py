@@ -0,0 +1,213 @@
+"""
+Loop 设备后端 - RAW 布局镜像由内核直接提供，绕过 qemu-nbd 与 NBD 套接字协议
+
+全部通过 ioctl 完成，不 fork losetup:
+- /dev/loop-control 上 LOOP_CTL_GET_FREE 分配空闲设备（不存在时内核新建）
+- LOOP_CONFIGURE 一次设置后备文件、块大小与标志（PARTSCAN | READ_ONLY | AUTOCLEAR，
+  对齐时加 DIRECT_IO）；旧内核（< 5.8）回退到 LOOP_SET_FD + LOOP_SET_STATUS64
+- 会话期间持有 loop 设备描述符；AUTOCLEAR 使进程异常退出、挂载卸载后设备自动释放
+"""
+import errno
+import fcntl
+import logging
+import os
+import struct
+from typing import Optional
+from ..formats import ImageFormat
+from ..exceptions.errors import DeviceError, DeviceNotFoundError, ImageFormatError
+from .device import NBDDevice
+from .journal import SessionJournal
+from .prefetch import PrefetchStore
+
+
+logger = logging.getLogger(__name__)
+
+LOOP_CONTROL = "/dev/loop-control"
+
+# include/uapi/linux/loop.h
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_SET_DIRECT_IO = 0x4C08
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+
+LO_FLAGS_READ_ONLY = 1
+LO_FLAGS_AUTOCLEAR = 4
+LO_FLAGS_PARTSCAN = 8
+LO_FLAGS_DIRECT_IO = 16
+
+LO_NAME_SIZE = 64
+_DIO_ALIGN = 512
+
+# struct loop_info64
+_LOOP_INFO64 = struct.Struct("=QQQQQIIII64s64s32sQQ")
+# struct loop_config: fd, block_size, loop_info64, __reserved[8]
+_LOOP_CONFIG = struct.Struct(f"=II{_LOOP_INFO64.size}s64x")
+
+# 分配到的设备被并发占用时的重试次数
+_ALLOC_RETRIES = 8
+
+
+def _loop_info(path: str, flags: int, offset: int = 0, size_limit: int = 0) -> bytes:
+    name = os.fsencode(path)[:LO_NAME_SIZE - 1]
+    return _LOOP_INFO64.pack(0, 0, 0, offset, size_limit, 0, 0, 0, flags, name, b"", b"", 0, 0)
+
+
+def loop_backing_file(device: str) -> Optional[str]:
+    """loop 设备当前的后备文件，未绑定时返回 None"""
+    try:
+        with open(f"/sys/block/{os.path.basename(device)}/loop/backing_file") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def loop_detach(device: str) -> None:
+    """LOOP_CLR_FD 解除绑定（设备仍被挂载时内核延迟到最后一次关闭）"""
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, LOOP_CLR_FD)
+    except OSError as e:
+        if e.errno != errno.ENXIO:  # 已解除
+            raise
+    finally:
+        os.close(fd)
+
+
+class LoopDevice(NBDDevice):
+    """
+    Loop 块设备
+
+    设计亮点:
+    - 与 NBDDevice 相同的连接/分区/预读/会话日志流程，只替换后端
+    - 内核直接读后备文件，没有用户态进程与每请求的上下文切换和拷贝
+    - 镜像大小按 512 字节对齐时启用 direct I/O，避免主机页缓存中存两份数据
+    """
+    BACKEND = "loop"
+    WATCHDOG = False
+
+    def __init__(
+        self,
+        image: ImageFormat,
+        journal: Optional[SessionJournal] = None,
+        prefetch: Optional[PrefetchStore] = None,
+        direct_io: bool = True,
+        offset: int = 0,
+        size_limit: int = 0
+    ):
+        """
+        :param direct_io: 对齐时启用 direct I/O
+        :param offset: 后备文件中的起始偏移（字节）
+        :param size_limit: 映射长度（字节），0 表示到文件末尾
+        """
+        if not image.RAW_LAYOUT:
+            raise ImageFormatError(f"{image.FORMAT_NAME} 格式需要 qemu-nbd 解码，不能使用 loop 设备")
+        super().__init__(image, journal=journal, prefetch=prefetch)
+        self.direct_io = direct_io
+        self.offset = offset
+        self.size_limit = size_limit
+        self._loop_fd: Optional[int] = None
+
+    def _dio_aligned(self, backing_fd: int) -> bool:
+        size = self.size_limit or os.fstat(backing_fd).st_size - self.offset
+        return self.offset % _DIO_ALIGN == 0 and size % _DIO_ALIGN == 0
+
+    def _configure(self, loop_fd: int, backing_fd: int, flags: int) -> bool:
+        """
+        LOOP_CONFIGURE，旧内核（< 5.8）回退到 LOOP_SET_FD + LOOP_SET_STATUS64
+
+        :return: 是否启用了 direct I/O
+        """
+        dio = flags & LO_FLAGS_DIRECT_IO
+        attempts = [flags, flags & ~LO_FLAGS_DIRECT_IO] if dio else [flags]
+        for attempt in attempts:
+            info = _loop_info(str(self.image.image_path), attempt, self.offset, self.size_limit)
+            try:
+                fcntl.ioctl(loop_fd, LOOP_CONFIGURE, _LOOP_CONFIG.pack(backing_fd, 0, info))
+                return bool(attempt & LO_FLAGS_DIRECT_IO)
+            except OSError as e:
+                # EINVAL: 后备文件系统不支持 direct I/O，或内核不认识 LOOP_CONFIGURE
+                if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                    raise
+
+        fcntl.ioctl(loop_fd, LOOP_SET_FD, backing_fd)
+        try:
+            info = _loop_info(str(self.image.image_path), flags & ~LO_FLAGS_DIRECT_IO, self.offset, self.size_limit)
+            fcntl.ioctl(loop_fd, LOOP_SET_STATUS64, info)
+        except OSError:
+            fcntl.ioctl(loop_fd, LOOP_CLR_FD)
+            raise
+        if dio:
+            try:
+                fcntl.ioctl(loop_fd, LOOP_SET_DIRECT_IO, 1)
+                return True
+            except OSError:
+                pass
+        return False
+
+    def _attach(self, read_only: bool) -> None:
+        backing_fd = os.open(self.image.image_path, (os.O_RDONLY if read_only else os.O_RDWR) | os.O_CLOEXEC)
+        try:
+            flags = LO_FLAGS_PARTSCAN | LO_FLAGS_AUTOCLEAR
+            if read_only:
+                flags |= LO_FLAGS_READ_ONLY
+            use_dio = self.direct_io and self._dio_aligned(backing_fd)
+            ctl = os.open(LOOP_CONTROL, os.O_RDWR | os.O_CLOEXEC)
+            try:
+                for _ in range(_ALLOC_RETRIES):
+                    index = fcntl.ioctl(ctl, LOOP_CTL_GET_FREE)
+                    device = f"/dev/loop{index}"
+                    loop_fd = os.open(device, (os.O_RDONLY if read_only else os.O_RDWR) | os.O_CLOEXEC)
+                    try:
+                        use_dio = self._configure(loop_fd, backing_fd, flags | (LO_FLAGS_DIRECT_IO if use_dio else 0))
+                    except OSError as e:
+                        os.close(loop_fd)
+                        if e.errno == errno.EBUSY:
+                            continue  # 被并发会话抢先占用，重新分配
+                        raise DeviceError(f"配置 loop 设备失败: {e}", device=device)
+                    break
+                else:
+                    raise DeviceNotFoundError("多次分配 loop 设备均被占用")
+            finally:
+                os.close(ctl)
+        finally:
+            # 内核已持有后备文件引用
+            os.close(backing_fd)
+
+        self._loop_fd = loop_fd
+        self.device_path = device
+        logger.info(f"将镜像 '{self.image.image_path.name}' 连接到 {device} "
+                    f"(loop{', direct I/O' if use_dio else ''})")
+
+    def reserve(self) -> None:
+        """LOOP_CTL_GET_FREE 让内核提前创建空闲设备节点（连接时重新分配，不占用）"""
+        ctl = os.open(LOOP_CONTROL, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(ctl, LOOP_CTL_GET_FREE)
+        finally:
+            os.close(ctl)
+
+    def _scan_partitions(self) -> None:
+        # LO_FLAGS_PARTSCAN 已让内核扫描分区表，无需 partprobe，只等待分区节点出现
+        if self.expected_partitions == 0:
+            self.partitions = []
+            return
+        self._wait_partitions(timeout=1.0)
+
+    def abandon(self) -> None:
+        # 只关闭描述符：AUTOCLEAR 使设备在最后一个挂载卸载后自动释放
+        if self._loop_fd is not None:
+            os.close(self._loop_fd)
+            self._loop_fd = None
+        super().abandon()
+
+    def _detach(self) -> None:
+        try:
+            fcntl.ioctl(self._loop_fd, LOOP_CLR_FD)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+        finally:
+            os.close(self._loop_fd)
+            self._loop_fd = None
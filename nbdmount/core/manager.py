@@ -1,130 +1,457 @@
-"""
-NBD 挂载核心管理器 - 高层业务逻辑编排
-"""
-import logging
-import os
-import shutil
-from pathlib import Path
-from typing import Dict, Optional
-from ..formats import detect_image_format, ImageFormat
-from ..core.device import NBDDevice
-from ..core.mounter import MountManager
-from ..exceptions.errors import PermissionError
-from ..utils.command import run_command
-
-
-logger = logging.getLogger(__name__)
-
-
-class NBDMountTool:
-    """
-    NBD 挂载工具主类
-    
-    设计亮点:
-    - 分层架构：格式检测 -> 设备连接 -> 分区挂载
-    - 资源自动管理
-    - 可扩展的挂载策略
-    """
-    
-    def __init__(
-        self, 
-        image_path: str, 
-        image_format: Optional[str] = None,
-        read_only: bool = True
-    ):
-        self.image_path = Path(image_path).resolve()
-        self.read_only = read_only
-        
-        # 1. 检测镜像格式
-        self.image: ImageFormat = detect_image_format(str(self.image_path), image_format)
-        logger.info(f"✓ 镜像格式识别: {self.image.FORMAT_NAME} ({self.image_path.name})")
-        
-        # 2. 创建设备管理器
-        self.device = NBDDevice(self.image)
-        self.mounter = MountManager()
-    
-    def mount_image(
-        self, 
-        mount_dir: Optional[str] = None,
-        mount_options: Optional[list] = None
-    ) -> Dict[str, str]:
-        """
-        完整挂载流程：连接设备 -> 识别分区 -> 挂载分区
-        
-        :param mount_dir: 挂载基目录（默认 /mnt/nbd-<镜像名>）
-        :param mount_options: 挂载选项列表
-        :return: {分区: 挂载点} 映射
-        """
-        # 确定挂载目录
-        if not mount_dir:
-            safe_name = self.image_path.stem.replace(" ", "_").lower()
-            mount_dir = f"/mnt/nbd-{safe_name}"
-        
-        base_dir = Path(mount_dir)
-        
-        # 执行完整挂载流程
-        with self.device.connect(read_only=self.read_only):
-            if not self.device.partitions:
-                logger.warning("⚠ 未检测到分区，尝试直接挂载整个设备...")
-                # 直接挂载整个设备（无分区表场景）
-                with self.mounter:
-                    mp = self.mounter.mount_partition(
-                        self.device.device_path,
-                        base_dir / "whole_disk",
-                        mount_options or ["ro", "noload"]
-                    )
-                    return {self.device.device_path: str(mp.mount_path)}
-            
-            # 挂载所有分区
-            with self.mounter:
-                mounts = self.mounter.mount_all_partitions(
-                    self.device.partitions,
-                    base_dir,
-                    mount_options or ["ro", "noload"]
-                )
-                # 返回简化映射（供外部使用）
-                return {part: str(mp.mount_path) for part, mp in mounts.items()}
-    
-    def list_partitions(self) -> list:
-        """列出镜像中的分区"""
-        with self.device.connect(read_only=True):
-            return self.device.partitions
-    
-    def get_image_info(self) -> dict:
-        """获取镜像详细信息"""
-        size_gb = self.image_path.stat().st_size / (1024 ** 3)
-        return {
-            "path": str(self.image_path),
-            "format": self.image.FORMAT_NAME,
-            "size_gb": round(size_gb, 2),
-            "size_bytes": self.image_path.stat().st_size,
-            "read_only": self.read_only
-        }
-    
-    @staticmethod
-    def check_prerequisites() -> None:
-        """检查运行前提条件"""
-        # 检查 root 权限
-        if os.geteuid() != 0:
-            raise PermissionError("需要 root 权限运行此工具")
-        
-        # 检查必要命令
-        required_cmds = ["qemu-nbd", "qemu-img", "partprobe", "mount", "umount", "mountpoint"]
-        missing = [cmd for cmd in required_cmds if not shutil.which(cmd)]
-        
-        if missing:
-            raise RuntimeError(
-                f"缺少必要命令: {', '.join(missing)}\n"
-                "请安装: sudo apt install qemu-utils util-linux"
-            )
-        
-        # 检查 nbd 模块
-        if not Path("/sys/module/nbd").exists():
-            logger.warning(
-                "NBD 内核模块未加载，尝试自动加载...\n"
-                "如失败请手动执行: sudo modprobe nbd max_part=16"
-            )
-            try:
-                run_command(["modprobe", "nbd", "max_part=16"], timeout=5)
-            except Exception as e:
+"""
+NBD 挂载核心管理器 - 高层业务逻辑编排
+"""
+import logging
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Generator, List, Optional, Tuple
+from ..formats import detect_image_format, ImageFormat
+from ..core.device import create_device
+from ..core.mounter import MountManager, MountPoint
+from ..core.journal import SessionJournal
+from ..core.export import NBDExportImage
+from ..core.cgroup import SessionBudget
+from ..core.prefetch import PrefetchStore
+from ..core.watchdog import DEFAULT_IO_TIMEOUT
+from ..core.volumes import VolumeStack, probe_block_type
+from ..core.streaming import MountStream, MountTarget
+from ..core.shared import SharedSession
+from ..core.partition import PartitionImage, resolve_partition
+from ..core.startup import StartupPlanner, check_backing_chain, mount_profile, read_layout
+from ..exceptions.errors import PermissionError
+from ..utils.command import run_command
+
+
+logger = logging.getLogger(__name__)
+
+# 用户态识别后不建挂载目录、不挂载的分区内容
+UNMOUNTED_TYPES = {"swap"}
+
+
+class NBDMountTool:
+    """
+    NBD 挂载工具主类
+    
+    设计亮点:
+    - 分层架构：格式检测 -> 设备连接 -> 分区挂载
+    - 资源自动管理
+    - 可扩展的挂载策略
+    - 流水线启动：格式验证、backing 链检查、设备预选与分区表解析并行进行
+    - 同一镜像的并发只读会话共用设备与挂载，引用计数归零才拆除
+    - 单分区模式：只导出选定分区的字节区间，作为整盘设备连接并直接挂载
+    """
+    
+    def __init__(
+        self, 
+        image_path: Optional[str] = None, 
+        image_format: Optional[str] = None,
+        read_only: bool = True,
+        journal: Optional[SessionJournal] = None,
+        export: Optional[str] = None,
+        prefetch: bool = False,
+        backend: str = "auto",
+        luks_key_file: Optional[str] = None,
+        pipelined: bool = False,
+        shared: bool = True,
+        partition: Optional[str] = None,
+        watchdog: bool = False,
+        io_timeout: int = DEFAULT_IO_TIMEOUT,
+        budget: Optional[SessionBudget] = None
+    ):
+        """
+        :param image_path: 镜像文件路径
+        :param image_format: 格式提示，为空时自动检测
+        :param read_only: 是否只读
+        :param journal: 会话日志，默认 /run/nbdmount
+        :param export: 共享导出名称或 nbd:// URI，指定后连接导出而不是打开镜像文件
+        :param prefetch: 记录块访问轮廓，并在下次连接时预读
+        :param backend: 设备后端（auto / ioctl / netlink / loop）
+        :param luks_key_file: 打开镜像内 LUKS 容器的密钥文件
+        :param pipelined: 构造时只按魔数识别格式，完整验证推迟到启动计划中与其它准备并行执行
+        :param shared: 只读会话与其他进程（或本进程其他实例）对同一镜像的只读会话共用设备与挂载
+        :param partition: 只连接并挂载此分区（分区号、GPT 分区名、卷标或类型 GUID）
+        :param watchdog: 监视连接健康，服务进程失效时尽快发现并在后端支持时重连
+        :param io_timeout: 启用监视时的内核请求超时（秒）
+        :param budget: 服务进程的资源预算（cgroup v2 优先级、I/O 上限与权重、内存软上限）
+        """
+        self.image_format = image_format
+        self.pipelined = pipelined
+        self._validated = True
+        if export:
+            # 0. 连接共享导出（导出总是只读）
+            self.image: ImageFormat = NBDExportImage(export)
+            self.image_path = self.image.image_path
+            self.read_only = True
+            logger.info(f"✓ 使用共享导出: {self.image.uri}")
+        else:
+            if not image_path:
+                raise ValueError("必须指定镜像路径或共享导出")
+            self.image_path = Path(image_path).resolve()
+            self.read_only = read_only
+            
+            # 1. 检测镜像格式（流水线模式下先按魔数选出候选）
+            self.image = detect_image_format(str(self.image_path), image_format, validate=not pipelined)
+            self._validated = not pipelined
+            if self._validated:
+                logger.info(f"✓ 镜像格式识别: {self.image.FORMAT_NAME} ({self.image_path.name})")
+            
+            if partition:
+                # 用户态定位分区，设备只看到该分区的字节区间
+                entry, fstype = resolve_partition(self.image, partition)
+                self.image = PartitionImage(self.image, entry, fstype)
+        
+        # 2. 创建设备管理器（共用一份会话日志）
+        self.backend = backend
+        self.journal = journal or SessionJournal()
+        self.budget = budget
+        self.device = create_device(
+            self.image,
+            backend,
+            journal=self.journal,
+            prefetch=PrefetchStore() if prefetch else None,
+            budget=budget
+        )
+        self._watchdog_options = {"io_timeout": io_timeout} if watchdog else None
+        self._configure_device()
+        self.mounter = MountManager(journal=self.journal)
+        self.luks_key_file = luks_key_file
+        self.shared = shared
+        self.startup: Optional[StartupPlanner] = None
+        self._volumes: Optional[VolumeStack] = None
+        # 分区号（整盘为 None）-> 用户态识别的文件系统类型
+        self._fs_types: Dict[Optional[int], Optional[str]] = {}
+        self._profiles: Dict[Optional[int], List[str]] = {}
+    
+    def _configure_device(self) -> None:
+        """把监视与资源预算设置应用到（可能重建的）设备"""
+        if self._watchdog_options:
+            self.device.enable_watchdog(**self._watchdog_options)
+        if self.budget:
+            self.device.set_budget(self.budget)
+    
+    def validate_image(self) -> ImageFormat:
+        """
+        完整验证镜像格式（流水线模式下构造时未验证），结果与候选不同时替换设备
+        
+        :raises ImageFormatError: 验证失败
+        """
+        if self._validated:
+            return self.image
+        image = detect_image_format(str(self.image_path), self.image_format)
+        logger.info(f"✓ 镜像格式识别: {image.FORMAT_NAME} ({self.image_path.name})")
+        if isinstance(self.image, PartitionImage):
+            same = type(image) is type(self.image.base)
+            image = PartitionImage(image, self.image.entry, self.image.fstype)
+        else:
+            same = type(image) is type(self.image)
+        if not same:
+            # 候选格式验证未通过、后续候选通过：后端可能随格式改变，重建设备
+            self.device.release()
+            self.device = create_device(image, self.backend, journal=self.journal, prefetch=self.device.prefetch,
+                                        budget=self.budget)
+            self._configure_device()
+        else:
+            self.device.image = image
+        self.image = image
+        self._validated = True
+        return image
+    
+    def _resolve_mount_dir(self, mount_dir: Optional[str]) -> Path:
+        """确定挂载基目录（默认 /mnt/nbd-<镜像名>），返回绝对路径"""
+        if not mount_dir:
+            safe_name = self.image_path.stem.replace(" ", "_").lower()
+            mount_dir = f"/mnt/nbd-{safe_name}"
+        # 日志、共享登记与 /proc/self/mountinfo 的比对都使用绝对路径
+        return Path(mount_dir).resolve()
+    
+    @property
+    def _whole_disk_name(self) -> str:
+        """整个设备的挂载目录名：单分区模式沿用分区目录名，与整盘挂载时的路径一致"""
+        if isinstance(self.image, PartitionImage):
+            return f"part{self.image.entry.number}"
+        return "whole_disk"
+    
+    @staticmethod
+    def _create_mount_dirs(base_dir: Path, layout: Optional[list], whole_name: str = "whole_disk") -> List[Path]:
+        """按用户态解析的分区表预建挂载目录，返回新建的目录（回滚时删除）"""
+        if layout is None:
+            return []
+        wanted = [base_dir]
+        for entry, fstype in layout:
+            if fstype in UNMOUNTED_TYPES:
+                continue
+            wanted.append(base_dir / (f"part{entry.number}" if entry else whole_name))
+        created = []
+        for path in wanted:
+            if not path.exists():
+                path.mkdir(parents=True, exist_ok=True)
+                created.append(path)
+        return created
+    
+    @staticmethod
+    def _remove_dirs(paths: List[Path]) -> None:
+        for path in reversed(paths or []):
+            try:
+                path.rmdir()
+            except OSError:
+                pass
+    
+    def _plan_profiles(self, layout: Optional[list]) -> Dict[Optional[int], List[str]]:
+        """在分区节点出现之前，按文件系统类型准备各分区的挂载选项"""
+        self._fs_types = {(entry.number if entry else None): fstype for entry, fstype in layout or []}
+        self._profiles = {
+            number: mount_profile(fstype, self.read_only)
+            for number, fstype in self._fs_types.items() if fstype
+        }
+        return self._profiles
+    
+    def _read_layout(self) -> Optional[list]:
+        """用户态布局；单分区模式下设备内容即所选分区的文件系统"""
+        if isinstance(self.image, NBDExportImage):
+            return None
+        if isinstance(self.image, PartitionImage):
+            return [(None, self.image.fstype)]
+        return read_layout(self.image)
+    
+    def _attach_device(self, layout: Optional[list]) -> None:
+        """验证通过后连接设备；已知布局时只等待预期数量的分区节点"""
+        if layout is not None:
+            entry, fstype = layout[0]
+            if entry is not None:
+                self.device.expected_partitions = len(layout)
+            elif fstype or isinstance(self.image, PartitionImage):
+                # 整盘即文件系统（或单分区视图），确定没有分区表；两者都认不出时交给内核判断
+                self.device.expected_partitions = 0
+        self.device.open(read_only=self.read_only)
+    
+    def _plan_startup(self, base_dir: Path) -> StartupPlanner:
+        """
+        构建启动计划::
+        
+            validate ─────────────┐
+            backing ──────────────┤
+            reserve ──────────────┼─> attach
+            layout ─┬─────────────┘
+                    ├─> mkdirs
+                    └─> profiles
+        """
+        plan = StartupPlanner(max_workers=4 if self.pipelined else 1)
+        plan.add("validate", self.validate_image)
+        plan.add("backing", lambda: check_backing_chain(self.image))
+        plan.add("reserve", lambda: self.device.reserve(), rollback=lambda: self.device.release())
+        plan.add("layout", self._read_layout)
+        plan.add("mkdirs", lambda: self._create_mount_dirs(base_dir, plan.result("layout"), self._whole_disk_name),
+                 deps=("layout",),
+                 rollback=lambda: self._remove_dirs(plan.result("mkdirs")))
+        plan.add("profiles", lambda: self._plan_profiles(plan.result("layout")), deps=("layout",))
+        plan.add("attach", lambda: self._attach_device(plan.result("layout")),
+                 deps=("validate", "backing", "reserve", "layout"), rollback=lambda: self.device.close())
+        return plan
+    
+    def _partition_number(self, source: str) -> Tuple[bool, Optional[int]]:
+        """块设备是否属于本会话设备，及其分区号（整盘为 None）"""
+        device = self.device.device_path
+        if not device or not source.startswith(device):
+            return False, None
+        if source == device:
+            return True, None
+        match = re.fullmatch(r"p(\d+)", source[len(device):])
+        return (True, int(match.group(1))) if match else (False, None)
+    
+    def mount_options_for(self, source: str) -> List[str]:
+        """
+        目标块设备的挂载选项：会话内分区使用启动计划准备的选项，其余（堆叠卷）按 blkid 探测类型选择
+        """
+        own, number = self._partition_number(source)
+        if own and number in self._profiles:
+            return list(self._profiles[number])
+        return mount_profile(probe_block_type(source), self.read_only)
+    
+    @contextmanager
+    def _prepared(self, mount_dir: Optional[str] = None) -> Generator[List[MountTarget], None, None]:
+        """
+        按启动计划连接设备并激活堆叠卷，产出待挂载目标；退出时逆序：卸载 -> 拆除堆叠卷 -> 断开设备
+        
+        :yield: [(块设备, 挂载目录, 所属会话设备), ...]
+        """
+        base_dir = self._resolve_mount_dir(mount_dir)
+        self.startup = self._plan_startup(base_dir)
+        self.startup.run()
+        logger.info(f"✓ 启动准备完成 ({self.startup.elapsed:.3f}s)")
+        try:
+            volumes = self._volumes = VolumeStack(
+                self.device.device_path,
+                read_only=self.read_only,
+                luks_key_file=self.luks_key_file,
+                journal=self.journal
+            )
+            with volumes, self.mounter:
+                # 识别 LVM/LUKS/RAID 容器，只把普通文件系统留给分区挂载
+                plain = volumes.activate(self.device.partitions or [self.device.device_path])
+                
+                targets: List[MountTarget] = []
+                if isinstance(self.image, PartitionImage):
+                    # 单分区模式：设备即所选分区
+                    if plain and self._fs_types.get(None) not in UNMOUNTED_TYPES:
+                        targets.append((self.device.device_path, base_dir / self._whole_disk_name, None))
+                elif not self.device.partitions:
+                    if plain:
+                        # 直接挂载整个设备（无分区表场景）
+                        logger.warning("⚠ 未检测到分区，尝试直接挂载整个设备...")
+                        targets.append((self.device.device_path, base_dir / "whole_disk", None))
+                else:
+                    for part in plain:
+                        if self._fs_types.get(self._partition_number(part)[1]) in UNMOUNTED_TYPES:
+                            logger.info(f"跳过交换分区 {part}")
+                            continue
+                        targets.append((part, self.mounter.partition_mount_path(part, base_dir), None))
+                targets.extend(
+                    (dev, base_dir / name, self.device.device_path) for name, dev in volumes.volumes.items()
+                )
+                yield targets
+        finally:
+            self.device.close()
+            self._volumes = None
+    
+    def _hand_off(self) -> None:
+        """
+        交出当前会话：保留挂载、堆叠卷与设备连接，退出会话上下文时不再拆除
+        
+        共享会话的创建者先于其他持有者释放时使用，之后由最后一个持有者按会话日志拆除
+        """
+        self.mounter.mount_points.clear()
+        if self._volumes:
+            self._volumes.abandon()
+        self.device.abandon()
+    
+    @property
+    def shareable(self) -> bool:
+        """会话是否参与共享（只读、镜像文件数据源）"""
+        return self.shared and self.read_only and not isinstance(self.image, NBDExportImage)
+    
+    @contextmanager
+    def session(
+        self,
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None
+    ) -> Generator[Dict[str, MountPoint], None, None]:
+        """
+        持有挂载的会话：上下文内设备保持连接、分区保持挂载，退出时统一清理
+        
+        只读会话默认共享：同一镜像已有共享会话时直接复用其挂载点（挂载目录不同时绑定挂载），
+        最后一个持有者退出时才卸载并断开
+        
+        :param mount_dir: 挂载基目录（默认 /mnt/nbd-<镜像名>）
+        :param mount_options: 挂载选项列表，为空时按各分区的文件系统类型选择
+        :yield: {分区: MountPoint} 映射
+        """
+        if self.shareable:
+            with SharedSession(self, mount_dir, mount_options) as mounts:
+                yield mounts
+        else:
+            with self._private_session(mount_dir, mount_options) as mounts:
+                yield mounts
+    
+    @contextmanager
+    def _private_session(
+        self,
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None
+    ) -> Generator[Dict[str, MountPoint], None, None]:
+        """本实例独占设备的会话"""
+        with self._prepared(mount_dir) as targets:
+            mounts = {}
+            for source, path, owner in targets:
+                options = mount_options or self.mount_options_for(source)
+                try:
+                    mounts[source] = self.mounter.mount_partition(source, path, options, owner)
+                except Exception as e:
+                    logger.error(f"✗ 挂载 {source} 失败: {e}")
+            yield mounts
+    
+    def iter_mounts(
+        self,
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None,
+        workers: int = 4,
+        max_ahead: int = 2
+    ) -> MountStream:
+        """
+        流式挂载：后台并发挂载，每完成一个就产出一个 MountPoint
+        
+        同时支持 for 与 async for；会话在迭代器关闭（close/with 退出）前保持
+        
+        :param workers: 并发挂载线程数
+        :param max_ahead: 已挂载但尚未被取走的最大数量（背压）
+        :return: MountStream
+        """
+        return MountStream(self, mount_dir, mount_options, workers=workers, max_ahead=max_ahead)
+    
+    def mount_image(
+        self, 
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None
+    ) -> Dict[str, str]:
+        """
+        完整挂载流程：连接设备 -> 识别分区 -> 挂载分区
+        
+        :param mount_dir: 挂载基目录（默认 /mnt/nbd-<镜像名>）
+        :param mount_options: 挂载选项列表
+        :return: {分区: 挂载点} 映射
+        """
+        with self.session(mount_dir, mount_options) as mounts:
+            # 返回简化映射（供外部使用）
+            return {part: str(mp.mount_path) for part, mp in mounts.items()}
+    
+    def list_partitions(self) -> list:
+        """列出镜像中的分区"""
+        self.validate_image()
+        with self.device.connect(read_only=True):
+            return self.device.partitions
+    
+    def get_image_info(self) -> dict:
+        """获取镜像详细信息"""
+        self.validate_image()
+        if isinstance(self.image, NBDExportImage):
+            size_bytes = self.image.entry.get("size") or 0
+        else:
+            size_bytes = self.image_path.stat().st_size
+        size_gb = size_bytes / (1024 ** 3)
+        return {
+            "path": str(self.image_path),
+            "format": self.image.FORMAT_NAME,
+            "size_gb": round(size_gb, 2),
+            "size_bytes": size_bytes,
+            "read_only": self.read_only
+        }
+    
+    @staticmethod
+    def check_prerequisites() -> None:
+        """检查运行前提条件"""
+        # 检查 root 权限
+        if os.geteuid() != 0:
+            raise PermissionError("需要 root 权限运行此工具")
+        
+        # 检查必要命令
+        required_cmds = ["qemu-nbd", "qemu-img", "partprobe", "mount", "umount", "mountpoint"]
+        missing = [cmd for cmd in required_cmds if not shutil.which(cmd)]
+        
+        if missing:
+            raise RuntimeError(
+                f"缺少必要命令: {', '.join(missing)}\n"
+                "请安装: sudo apt install qemu-utils util-linux"
+            )
+        
+        # 检查 nbd 模块
+        if not Path("/sys/module/nbd").exists():
+            logger.warning(
+                "NBD 内核模块未加载，尝试自动加载...\n"
+                "如失败请手动执行: sudo modprobe nbd max_part=16"
+            )
+            try:
+                run_command(["modprobe", "nbd", "max_part=16"], timeout=5)
+            except Exception as e:
                 logger.warning(f"自动加载 nbd 模块失败: {e}")
\ No newline at end of file
@@ -0,0 +1,376 @@
+"""
+Netlink NBD 后端 - 由内核按需分配设备，不受 nbds_max 与静态设备节点数量限制
+
+连接流程: 用户态完成 NBD 握手（fixed newstyle + NBD_OPT_GO）得到已进入传输阶段的套接字，
+再通过 generic netlink 的 NBD_CMD_CONNECT（不带 NBD_ATTR_INDEX，即 index = -1）
+把套接字交给内核，内核选用空闲设备或新建一个并在应答中返回编号。
+超时与死连接等待时间通过 netlink 属性设置。数据源为共享导出时直接连接导出，
+否则为本次会话启动一个私有的 qemu-nbd（Unix 套接字、只读、允许多连接）
+"""
+import logging
+import os
+import re
+import secrets
+import signal
+import socket
+import struct
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from ..formats import ImageFormat
+from ..utils.command import run_command
+from ..utils.netlink import GenericNetlink, nla_nested, nla_u32, nla_u64, parse_attrs
+from ..exceptions.errors import DeviceError
+from .device import NBDDevice
+from .export import DEFAULT_NBD_PORT, NBDExportImage
+from .journal import DEFAULT_RUN_DIR, SessionJournal, is_owner_alive
+from .prefetch import PrefetchStore
+
+
+logger = logging.getLogger(__name__)
+
+# include/uapi/linux/nbd-netlink.h
+NBD_GENL_FAMILY = "nbd"
+NBD_GENL_VERSION = 1
+NBD_CMD_CONNECT = 1
+NBD_CMD_DISCONNECT = 2
+NBD_CMD_RECONFIGURE = 3
+NBD_ATTR_INDEX = 1
+NBD_ATTR_SIZE_BYTES = 2
+NBD_ATTR_BLOCK_SIZE_BYTES = 3
+NBD_ATTR_TIMEOUT = 4
+NBD_ATTR_SERVER_FLAGS = 5
+NBD_ATTR_CLIENT_FLAGS = 6
+NBD_ATTR_SOCKETS = 7
+NBD_ATTR_DEAD_CONN_TIMEOUT = 8
+NBD_SOCK_ITEM = 1
+NBD_SOCK_FD = 1
+NBD_CFLAG_DESTROY_ON_DISCONNECT = 1 << 0
+
+# NBD 协议（握手阶段）
+NBD_MAGIC = 0x4E42444D41474943             # "NBDMAGIC"
+NBD_OPTS_MAGIC = 0x49484156454F5054        # "IHAVEOPT"
+NBD_REP_MAGIC = 0x0003E889045565A9
+NBD_FLAG_FIXED_NEWSTYLE = 1 << 0
+NBD_FLAG_NO_ZEROES = 1 << 1
+NBD_OPT_GO = 7
+NBD_REP_ACK = 1
+NBD_REP_INFO = 3
+NBD_REP_FLAG_ERROR = 1 << 31
+NBD_INFO_EXPORT = 0
+
+# 传输标志
+NBD_FLAG_HAS_FLAGS = 1 << 0
+NBD_FLAG_READ_ONLY = 1 << 1
+NBD_FLAG_CAN_MULTI_CONN = 1 << 8
+
+_DEVICE_RE = re.compile(r"nbd(\d+)$")
+
+# 连接端点: (地址族, 地址, 导出名)
+Endpoint = Tuple[int, object, str]
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise DeviceError("NBD 握手时服务端关闭了连接")
+        buf += chunk
+    return bytes(buf)
+
+
+def nbd_handshake(sock: socket.socket, export_name: str = "") -> Tuple[int, int]:
+    """
+    在已连接的套接字上完成 NBD fixed newstyle 握手（NBD_OPT_GO）
+
+    :param sock: 已连接到 NBD 服务端的套接字
+    :param export_name: 导出名
+    :return: (导出大小, 传输标志)
+    :raises DeviceError: 服务端不支持或拒绝该导出
+    """
+    magic, opts_magic, server_flags = struct.unpack(">QQH", _recv_exact(sock, 18))
+    if magic != NBD_MAGIC or opts_magic != NBD_OPTS_MAGIC:
+        raise DeviceError("NBD 服务端不支持 newstyle 协商")
+    if not server_flags & NBD_FLAG_FIXED_NEWSTYLE:
+        raise DeviceError("NBD 服务端不支持 fixed newstyle 协商")
+    sock.sendall(struct.pack(">I", server_flags & (NBD_FLAG_FIXED_NEWSTYLE | NBD_FLAG_NO_ZEROES)))
+
+    name = export_name.encode()
+    data = struct.pack(">I", len(name)) + name + struct.pack(">H", 0)
+    sock.sendall(struct.pack(">QII", NBD_OPTS_MAGIC, NBD_OPT_GO, len(data)) + data)
+
+    size = flags = None
+    while True:
+        rmagic, _, rtype, length = struct.unpack(">QIII", _recv_exact(sock, 20))
+        if rmagic != NBD_REP_MAGIC:
+            raise DeviceError("NBD 选项应答魔数无效")
+        payload = _recv_exact(sock, length) if length else b""
+        if rtype & NBD_REP_FLAG_ERROR:
+            message = payload.decode("utf-8", "replace") or f"错误码 0x{rtype:x}"
+            raise DeviceError(f"NBD 服务端拒绝导出 '{export_name}': {message}")
+        if rtype == NBD_REP_INFO and len(payload) >= 12:
+            info, = struct.unpack_from(">H", payload)
+            if info == NBD_INFO_EXPORT:
+                size, flags = struct.unpack_from(">QH", payload, 2)
+        elif rtype == NBD_REP_ACK:
+            break
+    if size is None:
+        raise DeviceError("NBD 服务端未返回导出信息")
+    return size, flags
+
+
+def parse_nbd_uri(uri: str) -> Endpoint:
+    """解析 nbd://host:port/name 与 nbd+unix:///name?socket=PATH"""
+    parsed = urlparse(uri)
+    name = parsed.path.lstrip("/")
+    if parsed.scheme == "nbd+unix":
+        sock_path = parse_qs(parsed.query).get("socket", [None])[0]
+        if not sock_path:
+            raise DeviceError(f"NBD URI 缺少 socket 参数: {uri}")
+        return socket.AF_UNIX, sock_path, name
+    if parsed.scheme in ("nbd", "nbd+tcp"):
+        family = socket.AF_INET6 if ":" in (parsed.hostname or "") else socket.AF_INET
+        return family, (parsed.hostname, parsed.port or DEFAULT_NBD_PORT), name
+    raise DeviceError(f"netlink 后端不支持的 NBD URI: {uri}")
+
+
+def netlink_available(sock_factory: Optional[Callable[[], socket.socket]] = None) -> bool:
+    """内核是否提供 nbd generic netlink 接口（nbd 模块已加载且内核 >= 4.12）"""
+    try:
+        GenericNetlink(NBD_GENL_FAMILY, sock_factory).close()
+        return True
+    except OSError:
+        return False
+
+
+def device_index(device: str) -> int:
+    match = _DEVICE_RE.search(device)
+    if not match:
+        raise DeviceError("不是 NBD 设备路径", device=device)
+    return int(match.group(1))
+
+
+def netlink_disconnect(device: str, sock_factory: Optional[Callable[[], socket.socket]] = None) -> None:
+    """通过 NBD_CMD_DISCONNECT 断开设备"""
+    with GenericNetlink(NBD_GENL_FAMILY, sock_factory) as genl:
+        genl.request(NBD_CMD_DISCONNECT, [nla_u32(NBD_ATTR_INDEX, device_index(device))], NBD_GENL_VERSION)
+
+
+def stop_server(pid: int, timeout: float = 5.0) -> None:
+    """结束私有 qemu-nbd（先确认 PID 未被其他程序复用）"""
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            if f.read().strip() != "qemu-nbd":
+                return
+        os.kill(pid, signal.SIGTERM)
+    except (OSError, ProcessLookupError):
+        return
+    deadline = time.monotonic() + timeout
+    while is_owner_alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if is_owner_alive(pid):
+        os.kill(pid, signal.SIGKILL)
+
+
+class NetlinkNBDDevice(NBDDevice):
+    """
+    Netlink NBD 设备
+
+    设计亮点:
+    - 设备编号由内核分配，高并发时不再受静态设备数量限制
+    - 服务端声明 multi-conn 时建立多条连接，内核按队列分摊 I/O
+    - 断开时销毁按需创建的设备，不留空设备节点
+    - 服务进程失效后以 NBD_CMD_RECONFIGURE 换入新连接，挂载不受影响
+    """
+    BACKEND = "netlink"
+    CAN_RECONNECT = True
+
+    def __init__(
+        self,
+        image: ImageFormat,
+        journal: Optional[SessionJournal] = None,
+        prefetch: Optional[PrefetchStore] = None,
+        connections: int = 4,
+        timeout: int = 30,
+        dead_conn_timeout: int = 60,
+        run_dir: Optional[str] = None,
+        sock_factory: Optional[Callable[[], socket.socket]] = None
+    ):
+        """
+        :param connections: 服务端支持 multi-conn 时的连接数
+        :param timeout: 单个请求的超时秒数（NBD_ATTR_TIMEOUT）
+        :param dead_conn_timeout: 连接断开后等待重连的秒数（NBD_ATTR_DEAD_CONN_TIMEOUT）
+        :param run_dir: 私有 qemu-nbd 套接字目录（默认 /run/nbdmount/netlink）
+        :param sock_factory: netlink 套接字工厂
+        """
+        super().__init__(image, journal=journal, prefetch=prefetch)
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.dead_conn_timeout = dead_conn_timeout
+        self.run_dir = Path(run_dir or DEFAULT_RUN_DIR) / "netlink"
+        self.sock_factory = sock_factory
+        self.endpoint: Optional[Endpoint] = None
+        self._socket_path: Optional[Path] = None
+        self._read_only = False
+
+    def _start_server(self, read_only: bool) -> Endpoint:
+        """为本次会话启动私有 qemu-nbd，返回其 Unix 套接字端点"""
+        self.run_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        stem = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._socket_path = self.run_dir / f"{stem}.sock"
+        pid_file = self.run_dir / f"{stem}.pid"
+        cmd = [
+            "qemu-nbd",
+            "--persistent",
+            f"--shared={self.connections}",
+            "--fork",
+            "--pid-file", str(pid_file),
+            "--socket", str(self._socket_path),
+        ]
+        if read_only:
+            cmd.append("--read-only")
+        cmd.extend(self.image.qemu_source_args())
+        run_command(cmd, timeout=30)
+        try:
+            self.server_pid = int(pid_file.read_text().strip())
+        finally:
+            pid_file.unlink(missing_ok=True)
+        return socket.AF_UNIX, str(self._socket_path), ""
+
+    def _open_socket(self) -> Tuple[socket.socket, int, int]:
+        family, address, name = self.endpoint
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(address)
+            size, flags = nbd_handshake(sock, name)
+            sock.settimeout(None)
+        except Exception:
+            sock.close()
+            raise
+        return sock, size, flags
+
+    def _open_sockets(self) -> Tuple[List[socket.socket], int, int]:
+        """建立连接并完成握手：(套接字列表, 导出大小, 传输标志)"""
+        first, size, flags = self._open_socket()
+        socks = [first]
+        try:
+            # 共享导出的连接名额由所有使用者共享，只占用一条
+            count = self.connections if self._socket_path and flags & NBD_FLAG_CAN_MULTI_CONN else 1
+            for _ in range(count - 1):
+                sock, other_size, _ = self._open_socket()
+                socks.append(sock)
+                if other_size != size:
+                    raise DeviceError("多条连接返回的导出大小不一致")
+        except Exception:
+            for sock in socks:
+                sock.close()
+            raise
+        return socks, size, flags
+
+    def reserve(self) -> None:
+        """设备编号由内核在 NBD_CMD_CONNECT 时分配，无需预选"""
+
+    def _attach(self, read_only: bool) -> None:
+        self._read_only = read_only
+        if isinstance(self.image, NBDExportImage):
+            self.endpoint = parse_nbd_uri(self.image.uri)
+        else:
+            self.endpoint = self._start_server(read_only)
+
+        try:
+            socks, size, flags = self._open_sockets()
+            if read_only:
+                flags |= NBD_FLAG_READ_ONLY
+            try:
+                with GenericNetlink(NBD_GENL_FAMILY, self.sock_factory) as genl:
+                    reply = genl.request(NBD_CMD_CONNECT, [
+                        nla_u64(NBD_ATTR_SIZE_BYTES, size),
+                        nla_u64(NBD_ATTR_BLOCK_SIZE_BYTES, 512),
+                        nla_u64(NBD_ATTR_TIMEOUT, self.timeout),
+                        nla_u64(NBD_ATTR_DEAD_CONN_TIMEOUT, self.dead_conn_timeout),
+                        nla_u64(NBD_ATTR_SERVER_FLAGS, flags | NBD_FLAG_HAS_FLAGS),
+                        nla_u64(NBD_ATTR_CLIENT_FLAGS, NBD_CFLAG_DESTROY_ON_DISCONNECT),
+                        nla_nested(NBD_ATTR_SOCKETS, *(
+                            nla_nested(NBD_SOCK_ITEM, nla_u32(NBD_SOCK_FD, sock.fileno()))
+                            for sock in socks
+                        )),
+                    ], NBD_GENL_VERSION)
+            finally:
+                # 内核已持有套接字引用，本进程的描述符可以关闭
+                for sock in socks:
+                    sock.close()
+            index = parse_attrs(reply[0]).get(NBD_ATTR_INDEX) if reply else None
+            if index is None:
+                raise DeviceError("NBD_CMD_CONNECT 应答缺少设备编号")
+        except Exception:
+            self._stop_server()
+            raise
+
+        self.device_path = f"/dev/nbd{struct.unpack_from('=I', index)[0]}"
+        logger.info(f"将镜像 '{self.image.image_path.name}' 连接到 {self.device_path} "
+                    f"(netlink, {len(socks)} 条连接)")
+        # 按需创建的设备节点由 devtmpfs/udev 异步生成
+        for _ in range(20):
+            if os.path.exists(self.device_path):
+                break
+            time.sleep(0.1)
+
+    def _reconfigure(self, attrs: list) -> None:
+        with GenericNetlink(NBD_GENL_FAMILY, self.sock_factory) as genl:
+            genl.request(NBD_CMD_RECONFIGURE, [
+                nla_u32(NBD_ATTR_INDEX, device_index(self.device_path)), *attrs
+            ], NBD_GENL_VERSION)
+
+    def set_timeouts(self, io_timeout: int, dead_conn_timeout: int) -> None:
+        """通过 NBD_CMD_RECONFIGURE 调整请求超时与死连接等待时间"""
+        self._reconfigure([
+            nla_u64(NBD_ATTR_TIMEOUT, io_timeout),
+            nla_u64(NBD_ATTR_DEAD_CONN_TIMEOUT, dead_conn_timeout),
+        ])
+        self.timeout = io_timeout
+        self.dead_conn_timeout = dead_conn_timeout
+
+    def reconnect(self) -> None:
+        """
+        重建连接：私有 qemu-nbd 已失效时先重启，再把新套接字交给内核替换失效连接
+
+        内核在死连接等待期内把失效连接上的请求重新排队到新连接
+        """
+        if not isinstance(self.image, NBDExportImage):
+            self._stop_server()
+            self.endpoint = self._start_server(self._read_only)
+            self._place_server()
+            if self.journal:
+                self.journal.record_server(self.device_path, self.server_pid)
+        socks, _, _ = self._open_sockets()
+        try:
+            self._reconfigure([nla_nested(NBD_ATTR_SOCKETS, *(
+                nla_nested(NBD_SOCK_ITEM, nla_u32(NBD_SOCK_FD, sock.fileno()))
+                for sock in socks
+            ))])
+        finally:
+            for sock in socks:
+                sock.close()
+
+    def _stop_server(self) -> None:
+        if self._socket_path:
+            if self.server_pid:
+                stop_server(self.server_pid)
+                self.server_pid = None
+            self._socket_path.unlink(missing_ok=True)
+            self._socket_path = None
+
+    def abandon(self) -> None:
+        # 私有 qemu-nbd 继续服务，由拆除者按会话日志中的 server 停止
+        self._socket_path = None
+        self.endpoint = None
+        super().abandon()
+
+    def _detach(self) -> None:
+        try:
+            netlink_disconnect(self.device_path, self.sock_factory)
+        finally:
+            self._stop_server()
@@ -0,0 +1,213 @@
+"""
+单分区模式 - 只导出镜像中一个分区的字节区间（或在用户态直接读取其上的文件系统）
+
+按分区号、GPT 分区名、文件系统卷标或类型 GUID 在用户态分区表中定位分区，
+以 qemu 的 raw offset/size 过滤层（或 loop 设备偏移）只把该区间作为整盘设备连接：
+不触发分区扫描、不等待其他分区节点，也不读取其他分区
+"""
+import logging
+import re
+import uuid
+from typing import Callable, ClassVar, Dict, List, Optional, Tuple
+from ..blockio.extfs import ExtFilesystem
+from ..blockio.partition_table import PartitionEntry, read_partition_table
+from ..blockio.reader import BlockReader, open_image_reader
+from ..exceptions.errors import ImageError
+from ..formats import ImageFormat
+from .startup import probe_filesystem, probe_label
+
+
+logger = logging.getLogger(__name__)
+
+_MBR_TYPE_RE = re.compile(r"^0x[0-9a-f]{1,2}$", re.IGNORECASE)
+
+
+def _describe(entry: PartitionEntry, fstype: Optional[str], label: str) -> str:
+    parts = [f"#{entry.number}", entry.type_id]
+    if entry.name:
+        parts.append(f"name={entry.name!r}")
+    if label:
+        parts.append(f"label={label!r}")
+    parts.append(fstype or "?")
+    return " ".join(parts)
+
+
+def _select(spec: str, entries: List[PartitionEntry],
+            label_of: Callable[[PartitionEntry], str]) -> List[PartitionEntry]:
+    """
+    按规格依次尝试：分区号 -> GUID（类型或分区唯一 GUID）-> MBR 类型 -> GPT 分区名 -> 卷标
+
+    前四种只看分区表；只有落到卷标匹配时才通过 label_of 读取各分区的超级块
+    """
+    if spec.isdigit():
+        return [e for e in entries if e.number == int(spec)]
+    try:
+        guid = str(uuid.UUID(spec))
+    except ValueError:
+        guid = None
+    if guid:
+        return [e for e in entries if guid in (e.type_id.lower(), e.uuid.lower())]
+    if _MBR_TYPE_RE.match(spec):
+        wanted = f"0x{int(spec, 16):02x}"
+        return [e for e in entries if e.type_id == wanted]
+    by_name = [e for e in entries if e.name and e.name == spec]
+    return by_name or [e for e in entries if label_of(e) == spec]
+
+
+def resolve_partition(image: ImageFormat, spec: str) -> Tuple[PartitionEntry, Optional[str]]:
+    """
+    在镜像分区表中定位分区
+
+    :param spec: 分区号、GUID（分区类型或分区唯一 GUID）、MBR 类型（如 0x83）、GPT 分区名或文件系统卷标
+    :return: (分区表项, 文件系统类型)
+    :raises ImageError: 格式不支持用户态读取、没有分区表、未找到或匹配多个分区
+    """
+    try:
+        reader = open_image_reader(image.image_path)
+    except ImageError as e:
+        raise ImageError(f"单分区模式需要在用户态读取分区表: {e}")
+    try:
+        return locate_partition(reader, spec)
+    finally:
+        reader.close()
+
+
+def _read_entries(reader: BlockReader) -> List[PartitionEntry]:
+    entries = read_partition_table(reader)
+    if not entries:
+        raise ImageError(f"镜像没有分区表，无法选择分区: {reader.path}")
+    return entries
+
+
+def _probe(reader: BlockReader, entry: PartitionEntry) -> Tuple[PartitionEntry, Optional[str], str]:
+    """(分区表项, 文件系统类型, 卷标)"""
+    fstype = probe_filesystem(reader, entry.start)
+    return entry, fstype, probe_label(reader, entry.start, fstype)
+
+
+def _read_table(reader: BlockReader) -> List[Tuple[PartitionEntry, Optional[str], str]]:
+    """分区表及各分区的文件系统类型与卷标"""
+    return [_probe(reader, entry) for entry in _read_entries(reader)]
+
+
+def locate_partition(reader: BlockReader, spec: str) -> Tuple[PartitionEntry, Optional[str]]:
+    """
+    在已打开的读取器上定位分区（规格同 resolve_partition）
+
+    :raises ImageError: 没有分区表、未找到或匹配多个分区
+    """
+    entries = _read_entries(reader)
+    probed: Dict[int, Tuple[PartitionEntry, Optional[str], str]] = {}
+
+    def row(entry: PartitionEntry) -> Tuple[PartitionEntry, Optional[str], str]:
+        # 按需探测：按分区号等选定时只读取选中分区的超级块
+        if entry.number not in probed:
+            probed[entry.number] = _probe(reader, entry)
+        return probed[entry.number]
+
+    matches = _select(spec.strip(), entries, lambda entry: row(entry)[2])
+    if len(matches) != 1:
+        listing = "\n".join(f"  {_describe(*row(entry))}" for entry in (matches or entries))
+        reason = "匹配多个分区" if matches else "未找到分区"
+        raise ImageError(f"{reason} '{spec}':\n{listing}")
+    entry, fstype, label = row(matches[0])
+    logger.info(f"✓ 选定分区 {_describe(entry, fstype, label)} "
+                f"(偏移 {entry.start}, {entry.size / (1 << 20):.1f} MB)")
+    return entry, fstype
+
+
+def open_filesystem(image_path: str, partition: Optional[str] = None) -> ExtFilesystem:
+    """
+    在用户态打开镜像中的 ext2/3/4 文件系统（不需要 root 与 NBD 设备）
+
+    :param partition: 分区规格（同 resolve_partition）；为空时使用整盘文件系统，
+                      整盘不是文件系统时使用唯一的 ext 分区
+    :raises ImageError: 格式不支持用户态读取、找不到或无法确定 ext 文件系统
+    """
+    reader = open_image_reader(image_path)
+    try:
+        if partition:
+            offset = locate_partition(reader, partition)[0].start
+        elif (probe_filesystem(reader) or "").startswith("ext"):
+            offset = 0
+        else:
+            table = _read_table(reader)
+            candidates = [row for row in table if (row[1] or "").startswith("ext")]
+            if len(candidates) != 1:
+                listing = "\n".join(f"  {_describe(*row)}" for row in table)
+                reason = "多个 ext 分区" if candidates else "没有 ext 分区"
+                raise ImageError(f"镜像中有{reason}，使用 --partition 选择:\n{listing}")
+            offset = candidates[0][0].start
+        return ExtFilesystem(reader, offset)
+    except BaseException:
+        reader.close()
+        raise
+
+
+def _qemu_opt(value: str) -> str:
+    """qemu 选项值转义：逗号写作两个逗号"""
+    return value.replace(",", ",,")
+
+
+class PartitionImage(ImageFormat):
+    """
+    镜像中单个分区的视图
+
+    qemu-nbd 以 raw 过滤层（offset/size）叠在原格式驱动之上导出该区间；
+    RAW 布局镜像可由 loop 设备按偏移直接映射
+    """
+    FORMAT_NAME: ClassVar[str] = "partition"
+    PRIORITY: ClassVar[int] = 1000  # 不参与自动检测
+
+    def __init__(self, base: ImageFormat, entry: PartitionEntry, fstype: Optional[str] = None):
+        """
+        :param base: 整盘镜像
+        :param entry: 分区表项
+        :param fstype: 用户态识别的文件系统类型
+        """
+        self.base = base
+        self.entry = entry
+        self.fstype = fstype
+        self.image_path = base.image_path
+        self.RAW_LAYOUT = base.RAW_LAYOUT
+        # (偏移, 长度)：loop 后端与预读轮廓按此区分整盘与分区
+        self.extent = (entry.start, entry.size)
+
+    def _validate_path(self) -> None:
+        # 整盘镜像已验证
+        pass
+
+    def get_qemu_format_flag(self) -> str:
+        return "raw"
+
+    def qemu_source_args(self) -> List[str]:
+        offset, size = self.extent
+        fmt = self.base.get_qemu_format_flag()
+        filename = _qemu_opt(str(self.image_path))
+        if fmt == "raw":
+            # raw 上的 raw 无需嵌套：offset/size 直接作用于文件
+            opts = f"driver=raw,offset={offset},size={size},file.driver=file,file.filename={filename}"
+        else:
+            opts = (f"driver=raw,offset={offset},size={size},file.driver={fmt},"
+                    f"file.file.driver=file,file.file.filename={filename}")
+        return ["--image-opts", opts]
+
+    def validate(self) -> bool:
+        return self.base.validate()
+
+    def get_backing_file(self) -> Optional[str]:
+        get_backing = getattr(self.base, "get_backing_file", None)
+        return get_backing() if get_backing else None
+
+    @classmethod
+    def detect(cls, image_path: str) -> bool:
+        return False
+
+    def on_attach(self) -> None:
+        self.base.on_attach()
+
+    def on_detach(self) -> None:
+        self.base.on_detach()
+
+    def __repr__(self) -> str:
+        return f"PartitionImage(base={self.base!r}, partition={self.entry.number})"
@@ -0,0 +1,453 @@
+"""
+学习型预读 - 记录会话期间的块访问模式，下次连接时作为 readahead 回放
+
+记录方式: 以整盘及各分区各自的读扇区计数为门控，只对有新读取的设备采样；设备内按 1GB 窗口
+用 cachestat 取缓存页数，只对数值变化的窗口做页缓存驻留采样（mincore），按首次出现顺序
+累积为区段列表。块设备页缓存在最后一个打开者关闭时被丢弃，因此记录器在会话期间一直持有
+设备描述符。
+
+记录范围: 只能看到经块设备页缓存的读取，即文件系统元数据（超级块、块组描述符、inode 表、
+目录块、日志）。通过已挂载文件系统读取的文件内容缓存在各文件自己的页缓存中，不计入轮廓；
+/etc、/var/log 等目录的查找会被预读，其中文件的内容不会。
+
+回放方式: 下次连接同一镜像（或共享同一 backing 镜像的兄弟镜像）时，后台线程按记录顺序对
+各分区设备执行 posix_fadvise(WILLNEED)，与挂载并行把元数据提前拉进缓存
+
+轮廓老化: 驻留采样分不清回放读入的页与真实访问的页，因此回放过的区段不参与本次记录，
+而是带着年龄原样沿用；连续 _MAX_AGE 次会话只被回放、没有重新记录到的区段被丢弃，
+下一次会话不再预读它，若仍被访问就会重新记录。轮廓不会只增不减，代价是仍在使用的区段
+每 _MAX_AGE + 1 次会话有一次没有预读
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from ..formats import ImageFormat
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "/var/cache/nbdmount/prefetch"
+PAGE_SIZE = mmap.PAGESIZE
+
+# 采样窗口：cachestat 门控与已见页位图的粒度，单个窗口的驻留向量为 256KB
+_SCAN_WINDOW = 1 << 30
+# 回放时单次 fadvise 的最大长度
+_MAX_ADVISE = 8 << 20
+
+_PROFILE_MAGIC = b"NBDPF\x00\x02\x00"
+_PROFILE_MAGIC_V1 = b"NBDPF\x00\x01\x00"
+# 回放过的区段最多沿用的会话数
+_MAX_AGE = 4
+
+# 区段: (起始页, 页数)
+Extent = Tuple[int, int]
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+_libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+_MAP_FAILED = ctypes.c_void_p(-1).value
+
+# cachestat(2)，Linux 6.5+，各架构统一编号
+_NR_CACHESTAT = 451
+
+
+class _CachestatRange(ctypes.Structure):
+    _fields_ = [("off", ctypes.c_uint64), ("len", ctypes.c_uint64)]
+
+
+class _Cachestat(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_uint64) for name in
+                ("nr_cache", "nr_dirty", "nr_writeback", "nr_evicted", "nr_recently_evicted")]
+
+
+# mincore 只保证最低位有意义
+_LOW_BIT = bytes(i & 1 for i in range(256))
+_RUN_RE = re.compile(rb"[^\x00]+")
+
+
+def page_residency(fd: int, offset: int, length: int) -> bytes:
+    """
+    返回设备区间内每一页是否驻留页缓存（每页一个字节，0/1）
+
+    :param fd: 已打开的块设备描述符
+    :param offset: 起始偏移（页对齐）
+    :param length: 区间长度（字节）
+    """
+    addr = _libc.mmap(None, length, mmap.PROT_READ, mmap.MAP_SHARED, fd, offset)
+    if addr in (None, _MAP_FAILED):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    try:
+        vec = ctypes.create_string_buffer((length + PAGE_SIZE - 1) // PAGE_SIZE)
+        if _libc.mincore(addr, length, vec) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return vec.raw.translate(_LOW_BIT)
+    finally:
+        _libc.munmap(addr, length)
+
+
+def cache_signature(fd: int, offset: int, length: int) -> Optional[Tuple[int, int]]:
+    """
+    区间的 (缓存页数, 累计逐出页数)，两者都不变说明区间内驻留页集合没有变化
+
+    cachestat 只遍历已缓存的页，整盘一轮的开销与设备大小基本无关；
+    内核不支持时返回 None，调用方退回逐窗口 mincore
+    """
+    stat = _Cachestat()
+    if _libc.syscall(_NR_CACHESTAT, fd, ctypes.byref(_CachestatRange(offset, length)),
+                     ctypes.byref(stat), 0) != 0:
+        return None
+    return stat.nr_cache, stat.nr_evicted
+
+
+def bitmap_runs(bitmap: bytes) -> List[Extent]:
+    """把 0/1 字节图转换为连续区段"""
+    return [(m.start(), m.end() - m.start()) for m in _RUN_RE.finditer(bitmap)]
+
+
+def _read_sectors(device_path: str) -> int:
+    """/sys/class/block/<dev>/stat 的第 3 列：累计读扇区数（整盘计数包含各分区）"""
+    try:
+        with open(f"/sys/class/block/{os.path.basename(device_path)}/stat") as f:
+            return int(f.read().split()[2])
+    except (OSError, ValueError, IndexError):
+        return -1
+
+
+class PrefetchProfile:
+    """
+    单个镜像的访问轮廓
+
+    targets: {目标名: [区段, ...]}，目标名 "" 表示整盘，"p1" 等表示分区
+    ages: {目标名: [年龄, ...]}，与区段一一对应，为上次被实际记录到之后经过的会话数
+    """
+
+    def __init__(self, targets: Optional[Dict[str, List[Extent]]] = None, page_size: int = PAGE_SIZE,
+                 ages: Optional[Dict[str, List[int]]] = None):
+        self.targets: Dict[str, List[Extent]] = targets or {}
+        self.page_size = page_size
+        self.ages: Dict[str, List[int]] = ages or {}
+
+    def age_of(self, name: str) -> List[int]:
+        """目标各区段的年龄（未记录年龄时为 0）"""
+        return self.ages.get(name) or [0] * len(self.targets.get(name, []))
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(n for extents in self.targets.values() for _, n in extents) * self.page_size
+
+    def to_bytes(self) -> bytes:
+        parts = [_PROFILE_MAGIC, struct.pack("<II", self.page_size, len(self.targets))]
+        for name, extents in self.targets.items():
+            encoded = name.encode()
+            flat = array("Q", (v for ext, age in zip(extents, self.age_of(name)) for v in (*ext, age)))
+            if flat.itemsize != 8:
+                raise ValueError("平台不支持 64 位数组")
+            if sys.byteorder == "big":
+                flat.byteswap()
+            parts.append(struct.pack("<HI", len(encoded), len(extents)) + encoded + flat.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PrefetchProfile":
+        if data.startswith(_PROFILE_MAGIC):
+            fields = 3
+        elif data.startswith(_PROFILE_MAGIC_V1):
+            fields = 2  # 旧格式没有年龄
+        else:
+            raise ValueError("预读轮廓文件格式无效")
+        pos = len(_PROFILE_MAGIC)
+        page_size, count = struct.unpack_from("<II", data, pos)
+        pos += 8
+        targets: Dict[str, List[Extent]] = {}
+        ages: Dict[str, List[int]] = {}
+        for _ in range(count):
+            name_len, n = struct.unpack_from("<HI", data, pos)
+            pos += 6
+            name = data[pos:pos + name_len].decode()
+            pos += name_len
+            flat = array("Q")
+            flat.frombytes(data[pos:pos + n * 8 * fields])
+            if sys.byteorder == "big":
+                flat.byteswap()
+            pos += n * 8 * fields
+            targets[name] = list(zip(flat[0::fields], flat[1::fields]))
+            ages[name] = list(flat[2::3]) if fields == 3 else [0] * n
+        return cls(targets, page_size, ages)
+
+    def __repr__(self) -> str:
+        extents = sum(len(e) for e in self.targets.values())
+        return f"PrefetchProfile(targets={len(self.targets)}, extents={extents}, bytes={self.total_bytes})"
+
+
+class PrefetchStore:
+    """
+    预读轮廓存储
+
+    每个镜像按身份（真实路径 + 大小）保存一份轮廓；QCOW2 等有 backing 镜像的格式
+    同时写入一份 backing 镜像的轮廓，供共享同一基础镜像的兄弟镜像使用
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+
+    @staticmethod
+    def _key(path: Path, extent: str = "") -> str:
+        st = path.stat()
+        return hashlib.sha1(f"{path.resolve()}:{st.st_size}{extent}".encode()).hexdigest()
+
+    def _keys(self, image: ImageFormat) -> List[str]:
+        """镜像自身与其 backing 镜像的键（按优先顺序）"""
+        keys = []
+        # 单分区视图的设备偏移与整盘不同，轮廓分开保存
+        extent = getattr(image, "extent", None)
+        suffix = f":{extent[0]}+{extent[1]}" if extent else ""
+        try:
+            keys.append(self._key(image.image_path, suffix))
+        except OSError:
+            pass
+        get_backing = getattr(image, "get_backing_file", None)
+        backing = get_backing() if get_backing else None
+        if backing:
+            try:
+                keys.append(self._key(Path(backing), suffix))
+            except OSError:
+                pass
+        return keys
+
+    def load(self, image: ImageFormat) -> Optional[PrefetchProfile]:
+        """读取镜像轮廓，没有时回退到 backing 镜像轮廓"""
+        for key in self._keys(image):
+            path = self.cache_dir / f"{key}.prof"
+            try:
+                return PrefetchProfile.from_bytes(path.read_bytes())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"读取预读轮廓 {path} 失败: {e}")
+        return None
+
+    def save(self, image: ImageFormat, profile: PrefetchProfile) -> None:
+        """写入镜像及其 backing 镜像的轮廓（区段全部老化时写入空轮廓，覆盖旧轮廓）"""
+        data = profile.to_bytes()
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for key in self._keys(image):
+                tmp = self.cache_dir / f"{key}.tmp"
+                tmp.write_bytes(data)
+                os.replace(tmp, self.cache_dir / f"{key}.prof")
+            logger.debug(f"已保存预读轮廓: {profile}")
+        except OSError as e:
+            logger.warning(f"保存预读轮廓失败: {e}")
+
+
+def _target_paths(device_path: str, partitions: List[str]) -> Dict[str, str]:
+    """{目标名: 设备路径}，目标名是相对整盘设备的后缀"""
+    targets = {"": device_path}
+    for part in partitions:
+        if part.startswith(device_path):
+            targets[part[len(device_path):]] = part
+    return targets
+
+
+class AccessRecorder(threading.Thread):
+    """
+    访问模式记录器（后台线程）
+
+    设计亮点:
+    - 各设备按自身读扇区计数门控，只读一个分区时其余分区与整盘不采样
+    - 设备内按窗口比较 cachestat，只对变化的窗口做 mincore，开销与设备大小无关
+    - 已见页位图按窗口稀疏保存，内存只与实际读到的窗口数成正比
+    - 回放轮廓中的页预先标记为已见，预读带入缓存的页不会被当作访问记录
+    """
+
+    def __init__(self, device_path: str, partitions: List[str], interval: float = 0.5,
+                 replayed: Optional[PrefetchProfile] = None):
+        """
+        :param replayed: 本次会话回放的轮廓；其区段不参与记录，按年龄沿用到新轮廓
+        """
+        super().__init__(name=f"prefetch-recorder-{os.path.basename(device_path)}", daemon=True)
+        self.device_path = device_path
+        self.interval = interval
+        self._paths = _target_paths(device_path, partitions)
+        self._fds: Dict[str, Tuple[int, int]] = {}              # 目标名 -> (fd, 大小)
+        self._seen: Dict[Tuple[str, int], bytes] = {}           # (目标名, 窗口) -> 已见页字节图
+        self._signatures: Dict[Tuple[str, int], Tuple[int, int]] = {}
+        self._extents: Dict[str, List[Extent]] = {}
+        self._stop_event = threading.Event()
+        self._last_sectors: Dict[str, int] = {}
+        for name, path in self._paths.items():
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+                self._fds[name] = (fd, os.lseek(fd, 0, os.SEEK_END))
+            except OSError as e:
+                logger.debug(f"预读记录器无法打开 {path}: {e}")
+        # 页大小不同的轮廓（来自其他机器）无法按页对应，整体作废
+        self._replayed = replayed if replayed and replayed.page_size == PAGE_SIZE else None
+        if self._replayed:
+            self._mark_replayed()
+
+    def _mark_replayed(self) -> None:
+        """把回放区段写入已见页位图"""
+        per_window = _SCAN_WINDOW // PAGE_SIZE
+        bitmaps: Dict[Tuple[str, int], bytearray] = {}
+        for name, extents in self._replayed.targets.items():
+            if name not in self._fds:
+                continue
+            for start, count in extents:
+                end = start + count
+                while start < end:
+                    index, offset = divmod(start, per_window)
+                    n = min(end - start, per_window - offset)
+                    bitmap = bitmaps.setdefault((name, index), bytearray(per_window))
+                    bitmap[offset:offset + n] = b"\x01" * n
+                    start += n
+        # 位图长度与窗口驻留向量一致（末尾窗口可能不满）
+        for (name, index), bitmap in bitmaps.items():
+            size = self._fds[name][1]
+            pages = (min(_SCAN_WINDOW, size - index * _SCAN_WINDOW) + PAGE_SIZE - 1) // PAGE_SIZE
+            if pages > 0:
+                self._seen[(name, index)] = bytes(bitmap[:pages])
+    def _changed_targets(self) -> List[str]:
+        """读扇区计数有变化（或无法读取）的目标"""
+        sectors = {name: _read_sectors(path) for name, path in self._paths.items()}
+        if "" in sectors and sectors[""] >= 0 and all(v >= 0 for v in sectors.values()):
+            # 整盘计数包含分区读取，只留直接读整盘设备的部分
+            sectors[""] -= sum(v for k, v in sectors.items() if k)
+        changed = [name for name in self._fds
+                   if sectors.get(name, -1) < 0 or sectors[name] != self._last_sectors.get(name)]
+        self._last_sectors = sectors
+        return changed
+
+    def _sample_window(self, name: str, fd: int, index: int, length: int) -> None:
+        key = (name, index)
+        signature = cache_signature(fd, index * _SCAN_WINDOW, length)
+        if signature is not None:
+            if signature == self._signatures.get(key, (0, 0)):
+                return
+            self._signatures[key] = signature
+        resident = page_residency(fd, index * _SCAN_WINDOW, length)
+        seen = self._seen.get(key)
+        if seen is None:
+            if resident.count(0) == len(resident):
+                return
+            fresh = resident
+        else:
+            if resident == seen:
+                return
+            current = int.from_bytes(resident, "little")
+            previous = int.from_bytes(seen, "little")
+            if not current & ~previous:
+                return
+            fresh = (current & ~previous).to_bytes(len(resident), "little")
+            resident = (current | previous).to_bytes(len(resident), "little")
+        self._seen[key] = resident
+        base = index * (_SCAN_WINDOW // PAGE_SIZE)
+        self._extents.setdefault(name, []).extend(
+            (base + start, count) for start, count in bitmap_runs(fresh))
+
+    def _sample(self) -> None:
+        for name in self._changed_targets():
+            fd, size = self._fds[name]
+            for index, offset in enumerate(range(0, size, _SCAN_WINDOW)):
+                try:
+                    self._sample_window(name, fd, index, min(_SCAN_WINDOW, size - offset))
+                except OSError as e:
+                    logger.debug(f"采样 {name or 'disk'} 窗口 {index} 失败: {e}")
+                    break
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> PrefetchProfile:
+        """停止记录，做最后一次采样并返回轮廓"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self._sample()
+        for fd, _ in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+        return self._merge()
+
+    def _merge(self) -> PrefetchProfile:
+        """回放区段（年龄 + 1，超龄丢弃）在前，本次新记录的区段（年龄 0）在后"""
+        targets: Dict[str, List[Extent]] = {}
+        ages: Dict[str, List[int]] = {}
+        if self._replayed:
+            for name, extents in self._replayed.targets.items():
+                for extent, age in zip(extents, self._replayed.age_of(name)):
+                    if age + 1 < _MAX_AGE:
+                        targets.setdefault(name, []).append(extent)
+                        ages.setdefault(name, []).append(age + 1)
+        for name, extents in self._extents.items():
+            targets.setdefault(name, []).extend(extents)
+            ages.setdefault(name, []).extend([0] * len(extents))
+        return PrefetchProfile({k: v for k, v in targets.items() if v}, PAGE_SIZE,
+                               {k: ages[k] for k, v in targets.items() if v})
+
+
+class Prefetcher(threading.Thread):
+    """
+    轮廓回放（后台线程）
+
+    按记录顺序对各目标设备发出 WILLNEED；描述符保持打开直到会话结束，
+    否则最后一次关闭会让内核丢弃刚读入的块设备页缓存
+    """
+
+    def __init__(self, device_path: str, partitions: List[str], profile: PrefetchProfile):
+        super().__init__(name=f"prefetch-{os.path.basename(device_path)}", daemon=True)
+        self.targets = _target_paths(device_path, partitions)
+        self.profile = profile
+        self.prefetched_bytes = 0
+        self._fds: List[int] = []
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        page = self.profile.page_size
+        for name, extents in self.profile.targets.items():
+            path = self.targets.get(name)
+            if not path:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            except OSError as e:
+                logger.debug(f"预读无法打开 {path}: {e}")
+                continue
+            self._fds.append(fd)
+            for start, count in extents:
+                offset, length = start * page, count * page
+                while length and not self._stop_event.is_set():
+                    chunk = min(length, _MAX_ADVISE)
+                    try:
+                        os.posix_fadvise(fd, offset, chunk, os.POSIX_FADV_WILLNEED)
+                    except OSError:
+                        break
+                    self.prefetched_bytes += chunk
+                    offset += chunk
+                    length -= chunk
+                if self._stop_event.is_set():
+                    return
+        logger.debug(f"预读完成: {self.prefetched_bytes / (1 << 20):.1f} MB")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        for fd in self._fds:
+            os.close(fd)
+        self._fds.clear()
@@ -0,0 +1,299 @@
+"""
+共享只读会话 - 同一镜像的并发使用者共用一个设备与一组挂载
+
+以镜像身份（st_dev, st_ino）加挂载模式为键，在 /run/nbdmount/shared 下登记会话：
+首个使用者连接设备并挂载，后续的只读使用者直接复用已有挂载点（挂载目录不同时绑定挂载）
+并增加引用计数；最后一个持有者释放时才卸载、拆除堆叠卷并断开设备。
+持有者异常退出后在下次访问登记表时剔除，其绑定挂载随之惰性卸载
+"""
+import logging
+import os
+import secrets
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+from ..utils.command import run_command
+from ..utils.statefile import locked_state, read_state
+from .journal import (
+    DEFAULT_RUN_DIR, SessionRecord, is_owner_alive, process_start_time,
+    read_mounted_targets, teardown_session
+)
+from .mounter import MountManager, MountPoint
+
+
+logger = logging.getLogger(__name__)
+
+
+def image_identity(image_path: Path, read_only: bool = True, extent: Optional[tuple] = None) -> str:
+    """
+    镜像身份键：同一文件的不同路径（符号链接、硬链接、绑定挂载）得到相同的键
+
+    :param extent: 单分区视图的 (偏移, 长度)，与整盘会话区分
+    """
+    st = os.stat(image_path)
+    key = f"{st.st_dev:x}-{st.st_ino:x}-{'ro' if read_only else 'rw'}"
+    return f"{key}-{extent[0]:x}+{extent[1]:x}" if extent else key
+
+
+class SharedRegistry:
+    """
+    共享会话登记表
+
+    每个会话一个 JSON 文件，记录设备、挂载点与持有者列表；
+    所有修改都在文件锁内完成，已退出的持有者在加锁读取时剔除
+    """
+
+    def __init__(self, run_dir: Optional[str] = None):
+        self.root = Path(run_dir or DEFAULT_RUN_DIR) / "shared"
+
+    def writable(self) -> bool:
+        """登记目录是否可写（非 root 或 /run 只读时不共享）"""
+        try:
+            self.root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        except OSError:
+            return False
+        return os.access(self.root, os.W_OK)
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    @staticmethod
+    def prune(state: dict) -> List[dict]:
+        """剔除已退出的持有者，返回被剔除的条目"""
+        live, dead = [], []
+        for holder in state.get("holders", []):
+            (live if is_owner_alive(holder["pid"], holder.get("start")) else dead).append(holder)
+        if state:
+            state["holders"] = live
+        return dead
+
+    def list_sessions(self) -> List[dict]:
+        """列出登记的会话快照（持有者已按存活状态过滤）"""
+        if not self.root.is_dir():
+            return []
+        sessions = []
+        for path in sorted(self.root.glob("*.json")):
+            state = read_state(path)
+            if state:
+                self.prune(state)
+                sessions.append(state)
+        return sessions
+
+    def held_devices(self) -> Set[str]:
+        """仍有存活持有者的会话设备（cleanup 不得拆除）"""
+        return {s["device"] for s in self.list_sessions() if s.get("holders") and s.get("device")}
+
+    def purge(self) -> int:
+        """删除已没有存活持有者的登记（其设备由 cleanup 按会话日志拆除）"""
+        removed = 0
+        for path in sorted(self.root.glob("*.json")) if self.root.is_dir() else []:
+            with locked_state(path) as state:
+                self.prune(state)
+                if state and not state["holders"]:
+                    state.clear()
+                    removed += 1
+        return removed
+
+
+class SharedSession:
+    """
+    共享会话的一个持有者
+
+    设计亮点:
+    - 登记表文件锁覆盖整个首次启动，并发的第二个使用者等待首个使用者挂载完成后直接复用，
+      不会各自连接设备、重复扫描分区
+    - 持有者以随机标识登记，同一进程内的多个使用者也各占一个引用
+    - 创建者先于其他持有者退出时交出设备而不拆除，最后一个持有者按会话日志拆除
+    - 登记表不可写（非 root）时退化为私有会话
+    """
+
+    def __init__(
+        self,
+        tool,
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None,
+        registry: Optional[SharedRegistry] = None,
+        session: Optional[Callable] = None
+    ):
+        """
+        :param tool: NBDMountTool 实例
+        :param mount_dir: 本持有者的挂载基目录（默认 /mnt/nbd-<镜像名>）
+        :param mount_options: 显式挂载选项；与已有会话不同时不复用
+        :param registry: 共享会话登记表（默认 <会话日志目录>/shared）
+        :param session: 自行建立设备与挂载的会话工厂 (挂载目录, 挂载选项) -> 上下文，
+                        默认 tool._private_session；流式挂载以此边挂载边产出
+        """
+        self.tool = tool
+        self.mount_dir = mount_dir
+        self.options = mount_options
+        self.registry = registry or SharedRegistry(str(tool.journal.run_dir))
+        self._session = session or tool._private_session
+        self.key = image_identity(tool.image_path, tool.read_only, getattr(tool.image, "extent", None))
+        self.holder_id = secrets.token_hex(6)
+        self.mounts: Dict[str, MountPoint] = {}
+        self._binder = MountManager(journal=tool.journal)
+        self._stack = ExitStack()
+        self._owner = False       # 本持有者创建了设备与挂载
+        self._private = False     # 退化为私有会话
+        self._joined = False
+
+    # ---------- 获取 ----------
+
+    def acquire(self) -> Dict[str, MountPoint]:
+        """加入已有会话，或创建并登记新会话"""
+        base_dir = self.tool._resolve_mount_dir(self.mount_dir)
+        if not self.registry.writable():
+            # 非 root 或 /run 不可写：登记表不可用，按原流程独占设备
+            logger.warning(f"共享会话登记表 {self.registry.root} 不可写，改用私有会话")
+            self._private = True
+        else:
+            with locked_state(self.registry.path(self.key)) as state:
+                self._unmount_binds(self.registry.prune(state))
+                usable = bool(state) and self._usable(state)
+                if state and not usable and not state["holders"]:
+                    # 持有者都已退出且挂载已失效：拆除残留后重新创建
+                    self._reclaim(state)
+                    state.clear()
+                if not state:
+                    self._create(state, base_dir)
+                elif not usable:
+                    # 仍有人持有但挂载已不完整（被外部卸载）：不干扰对方，自己另开私有会话
+                    logger.warning(f"共享会话 {state.get('device')} 挂载不完整，改用私有会话")
+                    self._private = True
+                elif state.get("options") != self.options:
+                    logger.info("挂载选项与已有共享会话不同，改用私有会话")
+                    self._private = True
+                else:
+                    self._join(state, base_dir)
+        if self._private:
+            self.mounts = self._stack.enter_context(self._session(self.mount_dir, self.options))
+        return self.mounts
+
+    def _usable(self, state: dict) -> bool:
+        """登记的挂载点是否仍全部处于挂载状态"""
+        paths = list(state.get("mounts", {}).values())
+        return bool(paths) and read_mounted_targets(paths) == set(paths)
+
+    def _holder(self, base_dir: Path, binds: List[str]) -> dict:
+        pid = os.getpid()
+        return {"id": self.holder_id, "pid": pid, "start": process_start_time(pid),
+                "mount_dir": str(base_dir), "binds": binds, "since": time.time()}
+
+    def _create(self, state: dict, base_dir: Path) -> None:
+        mounts = self._stack.enter_context(self._session(self.mount_dir, self.options))
+        self._owner = True
+        self.mounts = mounts
+        if not mounts:
+            # 没有可共享的挂载，不登记
+            return
+        device = self.tool.device
+        pid = os.getpid()
+        state.update(
+            key=self.key,
+            image=str(self.tool.image_path),
+            format=self.tool.image.FORMAT_NAME,
+            backend=device.BACKEND,
+            device=device.device_path,
+            server=device.server_pid,
+            budget=self._budget_state(device),
+            mount_dir=str(base_dir),
+            mounts={source: str(mp.mount_path) for source, mp in mounts.items()},
+            options=self.options,
+            owner=pid,
+            owner_start=process_start_time(pid),
+            created=time.time(),
+            holders=[self._holder(base_dir, [])],
+        )
+        self._joined = True
+        logger.info(f"✓ 已登记共享会话 {device.device_path} ({self.key})")
+
+    @staticmethod
+    def _budget_state(device) -> Optional[dict]:
+        """资源预算及其是否生效（没有服务进程或 cgroup 不可用时未生效），供 sessions 显示"""
+        if not device.budget:
+            return None
+        return {"priority": device.budget.priority, "applied": device.cgroup is not None}
+
+    def _join(self, state: dict, base_dir: Path) -> None:
+        """复用已有挂载；挂载目录不同时把各挂载点绑定挂载到本持有者的目录"""
+        shared_dir = Path(state["mount_dir"])
+        binds: List[str] = []
+        mounts: Dict[str, MountPoint] = {}
+        try:
+            for source, path in state["mounts"].items():
+                path = Path(path)
+                if base_dir != shared_dir:
+                    target = base_dir / path.relative_to(shared_dir)
+                    self._binder.mount_partition(str(path), target, ["bind"], state["device"])
+                    binds.append(str(target.resolve()))
+                    path = target
+                mp = MountPoint(source, path)
+                mp.is_mounted = True
+                mounts[source] = mp
+        except Exception:
+            self._binder.umount_all()
+            raise
+        state["holders"].append(self._holder(base_dir, binds))
+        self.mounts = mounts
+        self._joined = True
+        logger.info(f"✓ 复用共享会话 {state['device']}（{len(state['holders'])} 个持有者）"
+                    + (f"，绑定挂载到 {base_dir}" if binds else ""))
+
+    # ---------- 释放 ----------
+
+    def release(self) -> None:
+        """释放本持有者；最后一个持有者拆除整个会话"""
+        if not self._joined:
+            self._stack.close()
+            return
+        self._joined = False
+        with locked_state(self.registry.path(self.key)) as state:
+            self._binder.umount_all()
+            state["holders"] = [h for h in state.get("holders", []) if h["id"] != self.holder_id]
+            self._unmount_binds(self.registry.prune(state))
+            if state["holders"]:
+                if self._owner:
+                    # 交出设备与挂载，不断开
+                    self.tool._hand_off()
+                    self._stack.close()
+                logger.info(f"共享会话 {state['device']} 仍有 {len(state['holders'])} 个持有者，保留设备")
+            else:
+                if self._owner:
+                    self._stack.close()
+                else:
+                    self._reclaim(state)
+                state.clear()
+
+    def _unmount_binds(self, holders: List[dict]) -> None:
+        """惰性卸载已退出持有者遗留的绑定挂载"""
+        binds = [path for holder in holders for path in holder.get("binds", [])]
+        for path in reversed(sorted(read_mounted_targets(binds))):
+            try:
+                run_command(["umount", "-l", path], timeout=10)
+                self.tool.journal.record_umount(path)
+            except Exception as e:
+                logger.warning(f"卸载遗留绑定挂载 {path} 失败: {e}")
+
+    def _reclaim(self, state: dict) -> None:
+        """按会话日志拆除不是本进程建立的设备（创建者已交出或已退出）"""
+        device = state.get("device")
+        record = self.tool.journal.replay().get(device)
+        if record is None:
+            # 会话日志不可用时按登记表拆除（堆叠卷无记录，只能卸载与断开）
+            record = SessionRecord(device, state.get("image", ""), None, state.get("owner", 0),
+                                   backend=state.get("backend", "ioctl"), server=state.get("server"))
+            record.mounts = list(state.get("mounts", {}).values())
+        logger.info(f"最后一个持有者拆除共享会话 {device}")
+        teardown_session(record, self.tool.journal)
+
+    def __enter__(self) -> Dict[str, MountPoint]:
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
+    def __repr__(self) -> str:
+        role = "private" if self._private else ("owner" if self._owner else "holder")
+        return f"SharedSession(key='{self.key}', role={role}, mounts={len(self.mounts)})"
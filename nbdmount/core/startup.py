@@ -0,0 +1,328 @@
+"""
+启动编排 - 按依赖关系并行执行启动步骤，任一步失败时逆序回滚已完成的步骤
+
+挂载前的各项准备大多是互不相关的等待：qemu-img 验证格式、检查 backing 链、选定设备节点、
+用户态解析分区表、创建挂载目录、按文件系统类型准备挂载选项。只有连接设备必须等验证通过。
+本模块提供通用的依赖图执行器，以及启动流程中用到的用户态探测函数
+"""
+import logging
+import os
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from ..blockio.partition_table import PartitionEntry, read_partition_table
+from ..blockio.reader import BlockReader, open_image_reader
+from ..exceptions.errors import ImageError, ImageNotFoundError
+from ..formats import ImageFormat, probe_image_formats, FALLBACK_FORMAT
+
+
+logger = logging.getLogger(__name__)
+
+# backing 链最大深度（防止成环）
+_MAX_BACKING_DEPTH = 16
+
+# ext 超级块（位于 1024 字节处）中的魔数与特性字段
+_EXT_SUPERBLOCK = 1024
+_EXT_FEATURE_COMPAT_HAS_JOURNAL = 0x4
+_EXT4_FEATURE_INCOMPAT = 0x40 | 0x80 | 0x200  # extents | 64bit | flex_bg
+
+# 文件系统超级块魔数: (类型, 偏移, 魔数)
+_FS_MAGIC: Tuple[Tuple[str, int, bytes], ...] = (
+    ("ext", _EXT_SUPERBLOCK + 56, b"\x53\xef"),
+    ("xfs", 0, b"XFSB"),
+    ("btrfs", 0x10040, b"_BHRfS_M"),
+    ("ntfs", 3, b"NTFS    "),
+    ("vfat", 82, b"FAT32   "),
+    ("vfat", 54, b"FAT1"),
+    ("iso9660", 0x8001, b"CD001"),
+    ("swap", 4086, b"SWAPSPACE2"),
+    ("LVM2_member", 512 + 24, b"LVM2 001"),
+    ("crypto_LUKS", 0, b"LUKS\xba\xbe"),
+)
+_FS_PROBE_SIZE = 0x10048
+
+# 文件系统卷标: 类型 -> (偏移, 长度)；FAT 卷标位置随 FAT 类型不同，单独处理
+_FS_LABEL: Dict[str, Tuple[int, int]] = {
+    "ext2": (_EXT_SUPERBLOCK + 0x78, 16),
+    "ext3": (_EXT_SUPERBLOCK + 0x78, 16),
+    "ext4": (_EXT_SUPERBLOCK + 0x78, 16),
+    "xfs": (108, 12),
+    "btrfs": (0x10000 + 0x12B, 256),
+    "iso9660": (0x8028, 32),
+    "swap": (1024 + 0x1C, 16),
+}
+
+# 只读挂载选项：跳过日志重放，避免对镜像产生写入
+READ_ONLY_PROFILES: Dict[str, List[str]] = {
+    "ext3": ["ro", "noload"],
+    "ext4": ["ro", "noload"],
+    "xfs": ["ro", "norecovery"],
+}
+DEFAULT_READ_ONLY_OPTIONS = ["ro"]
+
+# 不能直接挂载的内容（交换分区、堆叠卷容器）
+UNMOUNTABLE = {"swap", "LVM2_member", "crypto_LUKS", "linux_raid_member"}
+
+
+def probe_filesystem(reader: BlockReader, offset: int = 0) -> Optional[str]:
+    """
+    在镜像偏移处识别文件系统类型（只读取超级块区域）
+
+    :return: 类型名（与 blkid TYPE 一致），无法识别时为 None
+    """
+    data = reader.read(offset, _FS_PROBE_SIZE)
+    for fstype, off, magic in _FS_MAGIC:
+        if data[off:off + len(magic)] == magic:
+            return _ext_variant(data) if fstype == "ext" else fstype
+    return None
+
+
+def probe_label(reader: BlockReader, offset: int = 0, fstype: Optional[str] = None) -> str:
+    """
+    读取文件系统卷标（NTFS 卷标位于 $Volume 记录中，不支持）
+
+    :param fstype: 已识别的类型，为空时先识别
+    :return: 卷标，没有或无法读取时为空字符串
+    """
+    fstype = fstype or probe_filesystem(reader, offset)
+    if fstype == "vfat":
+        boot = reader.read(offset, 90)
+        # FAT32 扩展 BPB 的文件系统类型串位于 82，卷标位于 71；FAT12/16 分别位于 54 和 43
+        field = (71, 11) if boot[82:87] == b"FAT32" else (43, 11)
+    else:
+        field = _FS_LABEL.get(fstype)
+    if not field:
+        return ""
+    raw = reader.read(offset + field[0], field[1])
+    label = raw.split(b"\x00", 1)[0].decode("utf-8", "replace").strip()
+    return "" if fstype == "vfat" and label == "NO NAME" else label
+
+
+def _ext_variant(data: bytes) -> str:
+    """按特性位区分 ext2/ext3/ext4"""
+    compat, incompat = struct.unpack_from("<II", data, _EXT_SUPERBLOCK + 0x5C)
+    if incompat & _EXT4_FEATURE_INCOMPAT:
+        return "ext4"
+    return "ext3" if compat & _EXT_FEATURE_COMPAT_HAS_JOURNAL else "ext2"
+
+
+def mount_profile(fstype: Optional[str], read_only: bool = True) -> List[str]:
+    """按文件系统类型选择挂载选项"""
+    if not read_only:
+        return ["rw"]
+    return list(READ_ONLY_PROFILES.get(fstype, DEFAULT_READ_ONLY_OPTIONS))
+
+
+def read_layout(image: ImageFormat) -> Optional[List[Tuple[Optional[PartitionEntry], Optional[str]]]]:
+    """
+    用户态读取镜像布局：分区表与各分区的文件系统类型
+
+    :return: [(分区, 文件系统类型), ...]，无分区表时为 [(None, 整盘类型)]；
+             格式不支持用户态读取时返回 None
+    """
+    # 布局只用于提前准备，解析失败（格式不支持、头部损坏）时退回到连接后由内核识别
+    try:
+        reader = open_image_reader(image.image_path)
+    except Exception as e:
+        logger.debug(f"跳过用户态布局解析: {e}")
+        return None
+    try:
+        entries = read_partition_table(reader)
+        if not entries:
+            return [(None, probe_filesystem(reader))]
+        return [(entry, probe_filesystem(reader, entry.start)) for entry in entries]
+    except Exception as e:
+        logger.debug(f"用户态布局解析失败: {e}")
+        return None
+    finally:
+        reader.close()
+
+
+def check_backing_chain(image: ImageFormat) -> List[str]:
+    """
+    检查 backing 链上的每个镜像都存在且可读（只读头部）
+
+    :return: backing 镜像路径列表（由近及远）
+    :raises ImageNotFoundError: backing 镜像缺失或不可读
+    :raises ImageError: backing 链成环或过深
+    """
+    chain: List[str] = []
+    current = image
+    while True:
+        get_backing = getattr(current, "get_backing_file", None)
+        backing = get_backing() if get_backing else None
+        if not backing:
+            return chain
+        if backing in chain or len(chain) >= _MAX_BACKING_DEPTH:
+            raise ImageError(f"backing 链成环或超过 {_MAX_BACKING_DEPTH} 层: {image.image_path}")
+        if not os.access(backing, os.R_OK):
+            raise ImageNotFoundError(f"backing 镜像不存在或不可读: {backing}")
+        chain.append(backing)
+        candidates = probe_image_formats(backing)
+        current = (candidates[0] if candidates else FALLBACK_FORMAT)(backing)
+
+
+class PlanStep:
+    """启动计划中的单个步骤"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        deps: Tuple[str, ...],
+        rollback: Optional[Callable[[], None]]
+    ):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.rollback = rollback
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        if self.finished is not None:
+            return "done"
+        return "running" if self.started is not None else "skipped"
+
+    def __repr__(self) -> str:
+        return f"PlanStep(name='{self.name}', deps={list(self.deps)}, status={self.status})"
+
+
+class StartupPlanner:
+    """
+    依赖感知的启动计划
+
+    设计亮点:
+    - 步骤按添加顺序声明依赖（只能依赖已添加的步骤），天然无环
+    - 依赖全部完成即提交到线程池，互不相关的等待相互重叠
+    - 任一步失败：不再提交新步骤、取消排队中的步骤，等运行中的步骤结束后逆序回滚
+    - 记录每步起止时间，max_workers=1 时退化为按添加顺序串行执行（用于对比）
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """
+        :param max_workers: 并行线程数，1 表示串行
+        """
+        self.max_workers = max(1, max_workers)
+        self.steps: "OrderedDict[str, PlanStep]" = OrderedDict()
+        self.elapsed = 0.0
+        self._completed: List[str] = []
+        self._t0 = 0.0
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        deps: Iterable[str] = (),
+        rollback: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        添加步骤
+
+        :param func: 步骤函数（无参数，可通过 result() 读取依赖步骤的结果）
+        :param deps: 依赖的步骤名
+        :param rollback: 步骤完成后、后续步骤失败时调用的回滚函数
+        """
+        deps = tuple(deps)
+        if name in self.steps:
+            raise ValueError(f"重复的启动步骤: {name}")
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"步骤 {name} 依赖未声明的步骤: {dep}")
+        self.steps[name] = PlanStep(name, func, deps, rollback)
+
+    def result(self, name: str) -> Any:
+        """已完成步骤的结果"""
+        return self.steps[name].result
+
+    def _execute(self, step: PlanStep) -> None:
+        step.started = time.perf_counter() - self._t0
+        try:
+            step.result = step.func()
+        finally:
+            step.finished = time.perf_counter() - self._t0
+
+    def _ready(self, step: PlanStep) -> bool:
+        return all(dep in self._completed for dep in step.deps)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        执行计划
+
+        :return: {步骤名: 结果}
+        :raises: 第一个失败步骤的异常（已完成的步骤此时已回滚）
+        """
+        self._t0 = time.perf_counter()
+        pending = list(self.steps.values())
+        running: Dict[Future, PlanStep] = {}
+        error: Optional[BaseException] = None
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix="startup") as pool:
+            while pending or running:
+                if error is None:
+                    for step in [s for s in pending if self._ready(s)]:
+                        pending.remove(step)
+                        running[pool.submit(self._execute, step)] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    step = running.pop(fut)
+                    if fut.cancelled():
+                        continue
+                    exc = fut.exception()
+                    if exc is None:
+                        self._completed.append(step.name)
+                        continue
+                    step.error = exc
+                    if error is None:
+                        error = exc
+                        logger.error(f"✗ 启动步骤 {step.name} 失败: {exc}")
+                        for queued in running:
+                            queued.cancel()
+        self.elapsed = time.perf_counter() - self._t0
+        if error is not None:
+            self.rollback()
+            raise error
+        logger.debug(self.format_report())
+        return {name: step.result for name, step in self.steps.items()}
+
+    def rollback(self) -> None:
+        """逆序回滚已完成的步骤（回滚失败只记录，不中断）"""
+        while self._completed:
+            step = self.steps[self._completed.pop()]
+            if step.rollback is None:
+                continue
+            try:
+                step.rollback()
+                logger.debug(f"已回滚启动步骤: {step.name}")
+            except Exception as e:
+                logger.error(f"✗ 回滚启动步骤 {step.name} 失败: {e}")
+
+    def report(self) -> List[dict]:
+        """各步骤的起止时间（相对计划开始，秒）"""
+        return [
+            {"step": s.name, "deps": list(s.deps), "status": s.status,
+             "start": s.started, "end": s.finished}
+            for s in self.steps.values()
+        ]
+
+    def format_report(self) -> str:
+        """文本形式的启动耗时报告"""
+        lines = [f"启动计划 {self.elapsed:.3f}s (并行度 {self.max_workers}):"]
+        for s in self.steps.values():
+            if s.started is None:
+                lines.append(f"  {s.name:<10} {s.status}")
+            else:
+                lines.append(f"  {s.name:<10} {s.started:7.3f}s -> {s.finished:7.3f}s  "
+                             f"({s.finished - s.started:.3f}s, {s.status})")
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return f"StartupPlanner(steps={list(self.steps)}, workers={self.max_workers})"
@@ -0,0 +1,208 @@
+"""
+流式挂载 - 每个分区挂载完成即交给调用方，挂载延迟与分析工作重叠
+
+后台会话线程持有设备连接与堆叠卷，线程池并发挂载各目标；已挂载但尚未被取走的数量
+受信号量限制（背压），消费者较慢时不会提前挂满所有分区。迭代结束后会话仍然保持，
+直到调用方关闭迭代器才卸载并断开
+
+只读共享会话与 session() 一致经 SharedSession：同一镜像已有共享会话时产出其登记的挂载点，
+否则流式挂载并登记为新的共享会话。创建共享会话期间持有登记表锁，此时不做背压，
+以免消费者阻塞其他使用者
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Generator, Optional, Tuple
+from .mounter import MountPoint
+from .shared import SharedSession
+
+
+logger = logging.getLogger(__name__)
+
+# 挂载目标: (块设备, 挂载目录, 所属会话设备)
+MountTarget = Tuple[str, Path, Optional[str]]
+
+_DONE = object()
+
+
+class MountStream:
+    """
+    流式挂载迭代器
+
+    设计亮点:
+    - 同一对象既是同步迭代器也是异步迭代器
+    - 信号量背压：挂载线程先取许可再挂载，消费者取走结果后归还
+    - 关闭时唤醒等待许可的挂载线程，逆序清理由会话上下文统一完成
+    - 只读会话经 SharedSession 共享，不会在共享会话的挂载目录上重复挂载
+    """
+
+    def __init__(
+        self,
+        tool,
+        mount_dir: Optional[str] = None,
+        mount_options: Optional[list] = None,
+        workers: int = 4,
+        max_ahead: int = 2
+    ):
+        """
+        :param tool: NBDMountTool 实例
+        :param mount_dir: 挂载基目录
+        :param mount_options: 挂载选项列表，为空时按各分区的文件系统类型选择
+        :param workers: 并发挂载线程数
+        :param max_ahead: 已挂载但尚未被取走的最大数量
+        """
+        self.tool = tool
+        self.mount_dir = mount_dir
+        self.options = mount_options
+        self.workers = max(1, workers)
+        self._permits = threading.Semaphore(max(1, max_ahead))
+        self._results: "queue.Queue" = queue.Queue()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._finished = False
+        self._owned = False     # 本迭代器自己挂载（未加入已有共享会话）
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mount-stream", daemon=True)
+            self._thread.start()
+
+    def _permit(self) -> bool:
+        """等待许可；关闭时放弃"""
+        while not self._permits.acquire(timeout=0.1):
+            if self._closed.is_set():
+                return False
+        if self._closed.is_set():
+            self._permits.release()
+            return False
+        return True
+
+    def _mount_one(self, target: MountTarget, throttle: bool) -> Optional[MountPoint]:
+        source, path, owner = target
+        if throttle and not self._permit():
+            return None
+        try:
+            options = self.options or self.tool.mount_options_for(source)
+            mp = self.tool.mounter.mount_partition(source, path, options, owner)
+        except Exception as e:
+            logger.error(f"✗ 挂载 {source} 失败: {e}")
+            if throttle:
+                self._permits.release()
+            return None
+        self._results.put((mp, throttle))
+        return mp
+
+    @contextmanager
+    def _streamed(
+        self,
+        mount_dir: Optional[str],
+        mount_options: Optional[list],
+        throttle: bool = True
+    ) -> Generator[Dict[str, MountPoint], None, None]:
+        """本实例独占设备、并发挂载的会话，每个挂载点完成即送入结果队列"""
+        self._owned = True
+        with self.tool._prepared(mount_dir) as targets:
+            mounts = {}
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="mount") as pool:
+                for fut in [pool.submit(self._mount_one, t, throttle) for t in targets]:
+                    mp = fut.result()
+                    if mp:
+                        mounts[mp.partition] = mp
+            yield mounts
+
+    def _shared_session(self, mount_dir: Optional[str], mount_options: Optional[list]):
+        # 创建共享会话时由 SharedSession 持有登记表锁，不做背压
+        return self._streamed(mount_dir, mount_options, throttle=False)
+
+    def _run(self) -> None:
+        """会话线程：准备目标 -> 并发挂载 -> 等待关闭 -> 清理"""
+        try:
+            if self.tool.shareable:
+                session = SharedSession(self.tool, self.mount_dir, self.options, session=self._shared_session)
+            else:
+                session = self._streamed(self.mount_dir, self.options)
+            with session as mounts:
+                if not self._owned:
+                    # 加入了已有共享会话：挂载点已就绪，逐个产出
+                    for mp in mounts.values():
+                        if not self._permit():
+                            break
+                        self._results.put((mp, True))
+                self._results.put(_DONE)
+                self._closed.wait()
+        except BaseException as e:
+            self._results.put(e)
+            self._results.put(_DONE)
+
+    def _get(self):
+        """取下一个挂载点，结束时返回 _DONE（StopIteration 不能穿过 executor future）"""
+        if self._finished:
+            return _DONE
+        self._start()
+        item = self._results.get()
+        if item is _DONE:
+            self._finished = True
+            return _DONE
+        if isinstance(item, BaseException):
+            self._finished = True
+            raise item
+        mp, held = item
+        if held:
+            self._permits.release()
+        return mp
+
+    def close(self) -> None:
+        """结束会话：卸载所有挂载点、拆除堆叠卷并断开设备"""
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._finished = True
+
+    # ---------- 同步接口 ----------
+
+    def __iter__(self) -> "MountStream":
+        return self
+
+    def __next__(self) -> MountPoint:
+        item = self._get()
+        if item is _DONE:
+            raise StopIteration
+        return item
+
+    def __enter__(self) -> "MountStream":
+        self._start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    # ---------- 异步接口 ----------
+
+    def __aiter__(self) -> "MountStream":
+        return self
+
+    async def __anext__(self) -> MountPoint:
+        item = await asyncio.get_running_loop().run_in_executor(None, self._get)
+        if item is _DONE:
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self) -> "MountStream":
+        self._start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+        return False
+
+    def __repr__(self) -> str:
+        state = "closed" if self._closed.is_set() else ("running" if self._thread else "idle")
+        return f"MountStream(image='{self.tool.image_path.name}', state={state})"
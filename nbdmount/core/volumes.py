@@ -0,0 +1,295 @@
+"""
+堆叠卷激活 - 识别并只读激活镜像内的 LVM、LUKS 与 md-RAID，范围限定在本会话的 NBD 设备
+
+LVM 命令只接受本会话设备的精确路径（devices/filter + global_filter，不读 devices 文件、
+不问 udev），因此不会扫描宿主机上成千上万的多路径设备；同时使用临时 system ID 并以
+--readonly 方式读取元数据，不加锁、不写回。逻辑卷不经 vgchange 激活，而是按元数据中的
+段表用 dmsetup 建立只读 linear/striped 映射，映射名带会话前缀，与宿主机同名 VG 互不冲突。
+LUKS 用 cryptsetup --readonly 打开，md 成员按阵列 UUID 分组后 mdadm --readonly 组装。
+容器内可以继续嵌套（如 LUKS 上的 LVM），逐轮处理直到没有新的块设备出现
+"""
+import json
+import logging
+import os
+import re
+import shutil
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from ..utils.command import run_command
+from ..exceptions.errors import DeviceError
+from .journal import SessionJournal
+
+
+logger = logging.getLogger(__name__)
+
+LVM_MEMBER = "LVM2_member"
+LUKS_MEMBER = "crypto_LUKS"
+MD_MEMBER = "linux_raid_member"
+
+# 嵌套层数上限（分区 -> LUKS -> LVM -> LUKS ...）
+_MAX_ROUNDS = 4
+
+
+def probe_block_type(device: str) -> Optional[str]:
+    """低级探测块设备内容类型（blkid -p，不使用缓存）"""
+    result = run_command(["blkid", "-p", "-o", "export", device], timeout=10, check=False)
+    for line in result.stdout.splitlines():
+        if line.startswith("TYPE="):
+            return line[5:]
+    return None
+
+
+def _dm_escape(name: str) -> str:
+    """与 LVM 相同的 device-mapper 命名方式：名称中的 '-' 写作 '--'"""
+    return name.replace("-", "--")
+
+
+class VolumeStack:
+    """
+    单个会话的堆叠卷
+
+    设计亮点:
+    - LVM 过滤器只包含本会话设备，扫描耗时与宿主机设备数量无关
+    - 所有映射只读建立，映射名带会话前缀
+    - 激活顺序入栈，退出时逆序拆除；每一层写入会话日志，异常退出后可由 cleanup 拆除
+    """
+
+    def __init__(
+        self,
+        device_path: str,
+        read_only: bool = True,
+        luks_key_file: Optional[str] = None,
+        journal: Optional[SessionJournal] = None
+    ):
+        """
+        :param device_path: 会话的 NBD 设备（如 /dev/nbd0）
+        :param read_only: 只读激活
+        :param luks_key_file: LUKS 密钥文件，未指定时跳过 LUKS 容器
+        :param journal: 会话日志
+        """
+        self.device_path = device_path
+        self.read_only = read_only
+        self.luks_key_file = luks_key_file
+        self.journal = journal
+        self.prefix = f"nbdmount-{os.path.basename(device_path)}"
+        self.volumes: "OrderedDict[str, str]" = OrderedDict()  # 挂载目录名 -> 块设备
+        self._stack: List[Tuple[str, str]] = []                # (类型, 名称)，按激活顺序
+
+    # ---------- LVM ----------
+
+    def _lvm_config(self, devices: List[str]) -> str:
+        accept = ", ".join(f'"a|^{re.escape(dev)}$|"' for dev in devices)
+        filters = f'[{accept}, "r|.*|"]'
+        return (
+            f"devices {{ filter={filters} global_filter={filters} use_devicesfile=0 "
+            f"obtain_device_list_from_udev=0 }} "
+            f'global {{ system_id_source="lvmlocal" }} local {{ system_id="{self.prefix}" }}'
+        )
+
+    def _lvm_report(self, command: str, fields: str, devices: List[str], segments: bool = False) -> List[dict]:
+        cmd = [command, "--readonly", "--foreign", "--config", self._lvm_config(devices),
+               "--reportformat", "json", "--units", "s", "--nosuffix", "-o", fields]
+        if segments:
+            cmd.append("--segments")
+        result = run_command(cmd, timeout=60)
+        report = json.loads(result.stdout).get("report", [{}])
+        key = "seg" if segments else command[:-1]
+        return report[0].get(key, []) if report else []
+
+    def _activate_lvm(self, pvs: List[str]) -> List[str]:
+        """按段表为 PV 上的逻辑卷建立只读 dm 映射，返回新的块设备"""
+        if not shutil.which("lvs"):
+            logger.warning(f"未安装 lvm2，跳过 LVM 物理卷: {pvs}")
+            return []
+        pe_start = {
+            row["pv_name"]: int(row["pe_start"])
+            for row in self._lvm_report("pvs", "pv_name,pe_start", pvs)
+        }
+        segments: "OrderedDict[Tuple[str, str], List[dict]]" = OrderedDict()
+        for row in self._lvm_report(
+            "lvs", "vg_name,lv_name,segtype,seg_start_pe,seg_size_pe,seg_pe_ranges,vg_extent_size,stripe_size",
+            pvs, segments=True
+        ):
+            segments.setdefault((row["vg_name"], row["lv_name"]), []).append(row)
+
+        created = []
+        for (vg, lv), segs in segments.items():
+            table = self._lv_table(segs, pe_start)
+            if table is None:
+                logger.warning(f"逻辑卷 {vg}/{lv} 的段类型 {segs[0]['segtype']} 不支持只读映射，跳过")
+                continue
+            name = f"{self.prefix}-{_dm_escape(vg)}-{_dm_escape(lv)}"
+            cmd = ["dmsetup", "create", name]
+            if self.read_only:
+                cmd.append("--readonly")
+            run_command(cmd, input_data=table, timeout=30)
+            self._push("dm", name)
+            dev = f"/dev/mapper/{name}"
+            self.volumes[f"lvm-{vg}-{lv}"] = dev
+            created.append(dev)
+            logger.info(f"✓ 已映射逻辑卷 {vg}/{lv} -> {dev}")
+        return created
+
+    @staticmethod
+    def _lv_table(segs: List[dict], pe_start: Dict[str, int]) -> Optional[str]:
+        """把 lvs 段报告转换为 dmsetup 表（仅 linear/striped）"""
+        lines = []
+        for seg in segs:
+            extent = int(seg["vg_extent_size"])
+            start, size = int(seg["seg_start_pe"]) * extent, int(seg["seg_size_pe"]) * extent
+            targets = []
+            for rng in seg["seg_pe_ranges"].split():
+                pv, _, pes = rng.rpartition(":")
+                if pv not in pe_start:
+                    return None  # PV 不在本会话中（VG 不完整）
+                targets.append(f"{pv} {pe_start[pv] + int(pes.split('-')[0]) * extent}")
+            if seg["segtype"] == "linear" and len(targets) == 1:
+                lines.append(f"{start} {size} linear {targets[0]}")
+            elif seg["segtype"] == "striped":
+                chunk = int(seg.get("stripe_size") or 0)
+                if len(targets) == 1:
+                    lines.append(f"{start} {size} linear {targets[0]}")
+                elif chunk:
+                    lines.append(f"{start} {size} striped {len(targets)} {chunk} {' '.join(targets)}")
+                else:
+                    return None
+            else:
+                return None
+        return "\n".join(lines) + "\n"
+
+    # ---------- LUKS ----------
+
+    def _open_luks(self, device: str) -> Optional[str]:
+        if not self.luks_key_file:
+            logger.warning(f"{device} 是 LUKS 容器，未指定 --luks-key-file，跳过")
+            return None
+        if not shutil.which("cryptsetup"):
+            logger.warning(f"未安装 cryptsetup，跳过 LUKS 容器: {device}")
+            return None
+        name = f"{self.prefix}-luks-{os.path.basename(device)}"
+        cmd = ["cryptsetup", "open", "--type", "luks", "--key-file", self.luks_key_file]
+        if self.read_only:
+            cmd.append("--readonly")
+        run_command(cmd + [device, name], timeout=60)
+        self._push("luks", name)
+        dev = f"/dev/mapper/{name}"
+        self.volumes[f"luks-{os.path.basename(device)}"] = dev
+        logger.info(f"✓ 已打开 LUKS 容器 {device} -> {dev}")
+        return dev
+
+    # ---------- md-RAID ----------
+
+    def _assemble_md(self, members: List[str]) -> List[str]:
+        if not shutil.which("mdadm"):
+            logger.warning(f"未安装 mdadm，跳过 RAID 成员: {members}")
+            return []
+        arrays: "OrderedDict[str, List[str]]" = OrderedDict()
+        for dev in members:
+            result = run_command(["mdadm", "--examine", "--export", dev], timeout=10, check=False)
+            fields = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+            arrays.setdefault(fields.get("MD_UUID", dev), []).append(dev)
+
+        created = []
+        first = sum(1 for kind, _ in self._stack if kind == "md")
+        for i, (uuid, devs) in enumerate(arrays.items(), first):
+            name = f"{self.prefix}-md{i}"
+            dev = f"/dev/md/{name}"
+            cmd = ["mdadm", "--assemble", dev, "--run", "--homehost=<ignore>"]
+            if self.read_only:
+                cmd.append("--readonly")
+            try:
+                run_command(cmd + devs, timeout=60)
+            except Exception as e:
+                logger.warning(f"组装 RAID {uuid} 失败: {e}")
+                continue
+            self._push("md", dev)
+            self.volumes[f"md{i}"] = dev
+            created.append(dev)
+            logger.info(f"✓ 已组装 RAID {uuid} ({len(devs)} 个成员) -> {dev}")
+        return created
+
+    # ---------- 编排 ----------
+
+    def _push(self, kind: str, name: str) -> None:
+        self._stack.append((kind, name))
+        if self.journal:
+            self.journal.record_volume(self.device_path, kind, name)
+
+    def _consume(self, device: str) -> None:
+        """容器内的卷本身又是容器时，不再作为挂载目标"""
+        for label, dev in list(self.volumes.items()):
+            if dev == device:
+                del self.volumes[label]
+
+    def activate(self, devices: List[str]) -> List[str]:
+        """
+        识别并激活堆叠卷
+
+        :param devices: 会话的分区设备（无分区表时为整盘设备）
+        :return: 其中可直接挂载的设备；容器内的卷记录在 self.volumes
+        """
+        plain: List[str] = []
+        pending = list(devices)
+        for _ in range(_MAX_ROUNDS):
+            if not pending:
+                break
+            pvs, md_members, fresh = [], [], []
+            for dev in pending:
+                kind = probe_block_type(dev)
+                if kind in (LVM_MEMBER, MD_MEMBER, LUKS_MEMBER):
+                    self._consume(dev)
+                if kind == LVM_MEMBER:
+                    pvs.append(dev)
+                elif kind == MD_MEMBER:
+                    md_members.append(dev)
+                elif kind == LUKS_MEMBER:
+                    opened = self._open_luks(dev)
+                    if opened:
+                        fresh.append(opened)
+                elif dev in devices:
+                    plain.append(dev)
+            if md_members:
+                fresh.extend(self._assemble_md(md_members))
+            if pvs:
+                fresh.extend(self._activate_lvm(pvs))
+            pending = fresh
+        return plain
+
+    @staticmethod
+    def deactivate(kind: str, name: str) -> None:
+        """拆除单层映射"""
+        if kind == "dm":
+            run_command(["dmsetup", "remove", name], timeout=30)
+        elif kind == "luks":
+            run_command(["cryptsetup", "close", name], timeout=30)
+        elif kind == "md":
+            run_command(["mdadm", "--stop", name], timeout=30)
+        else:
+            raise DeviceError(f"未知的卷类型: {kind}", device=name)
+
+    def close(self) -> None:
+        """逆序拆除所有已激活的卷"""
+        while self._stack:
+            kind, name = self._stack.pop()
+            try:
+                self.deactivate(kind, name)
+                if self.journal:
+                    self.journal.record_volume_removed(self.device_path, name)
+            except Exception as e:
+                logger.error(f"✗ 拆除 {name} 失败: {e}")
+        self.volumes.clear()
+
+    def abandon(self) -> None:
+        """放弃管理已激活的卷（保持映射，由会话日志继续追踪）"""
+        self._stack.clear()
+        self.volumes.clear()
+
+    def __enter__(self) -> "VolumeStack":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __repr__(self) -> str:
+        return f"VolumeStack(device='{self.device_path}', volumes={list(self.volumes)})"
@@ -0,0 +1,286 @@
+"""
+连接健康监视 - 服务进程失效或停滞时尽快发现，并在可能时透明重连
+
+内核默认的请求超时很长（ioctl 后端未设置时甚至永不超时），qemu-nbd 退出或卡住后，
+读取挂载点的进程会长时间处于 D 状态。监视线程启动时先把请求超时与死连接等待时间调短，
+之后周期性检查:
+  - /sys/block/nbdN/pid：设备是否仍处于连接状态
+  - 服务进程是否存活（ioctl 后端即 pid 文件中的进程，netlink 后端为私有 qemu-nbd）
+  - /sys/block/nbdN/inflight 与 stat：有在途 I/O 但完成计数长时间不变即视为停滞
+netlink 后端的连接由内核持有，服务进程失效后重启 qemu-nbd（--persistent），
+以 NBD_CMD_RECONFIGURE 把新连接交给内核，在途请求在死连接等待期内重新排队，挂载不受影响；
+ioctl 后端无法替换连接，只能依靠短超时让挂起的 I/O 快速失败
+"""
+import fcntl
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+from .journal import is_owner_alive
+
+
+logger = logging.getLogger(__name__)
+
+# linux/nbd.h: _IO(0xab, 9)
+NBD_SET_TIMEOUT = 0xAB09
+
+DEFAULT_IO_TIMEOUT = 5
+DEFAULT_DEAD_CONN_TIMEOUT = 15
+
+# 健康状态
+HEALTHY = "healthy"
+STALLED = "stalled"
+RECONNECTING = "reconnecting"
+DISCONNECTED = "disconnected"
+FAILED = "failed"
+
+
+def _sysfs(device: str, name: str) -> str:
+    with open(f"/sys/block/{os.path.basename(device)}/{name}") as f:
+        return f.read()
+
+
+def read_inflight(device: str) -> Tuple[int, int]:
+    """在途请求数 (读, 写)，读取失败时为 (0, 0)"""
+    try:
+        reads, writes = _sysfs(device, "inflight").split()[:2]
+        return int(reads), int(writes)
+    except (OSError, ValueError):
+        return 0, 0
+
+
+def read_completed(device: str) -> int:
+    """已完成的读写请求总数（stat 第 1、5 列）"""
+    try:
+        fields = _sysfs(device, "stat").split()
+        return int(fields[0]) + int(fields[4])
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def set_ioctl_timeout(device: str, seconds: int) -> None:
+    """
+    通过 NBD_SET_TIMEOUT 设置请求超时（ioctl 后端；连接后可随时调整）
+
+    超时后内核关闭连接并让请求以 EIO 失败，而不是无限期重置计时器
+    """
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, NBD_SET_TIMEOUT, seconds)
+    finally:
+        os.close(fd)
+
+
+class DeviceHealth:
+    """设备健康状态快照"""
+
+    def __init__(self, device: str, backend: str):
+        self.device = device
+        self.backend = backend
+        self.state = HEALTHY
+        self.since = time.time()
+        self.server_pid: Optional[int] = None
+        self.inflight = (0, 0)
+        self.reconnects = 0
+        self.stalls = 0
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "device": self.device, "backend": self.backend, "state": self.state, "since": self.since,
+            "server_pid": self.server_pid, "inflight": list(self.inflight), "reconnects": self.reconnects,
+            "stalls": self.stalls, "last_error": self.last_error, "monitor": os.getpid(),
+        }
+
+    def __repr__(self) -> str:
+        return (f"DeviceHealth(device='{self.device}', state={self.state}, reconnects={self.reconnects}, "
+                f"stalls={self.stalls}, inflight={self.inflight})")
+
+
+class Watchdog(threading.Thread):
+    """
+    NBD 连接监视线程
+
+    设计亮点:
+    - 只读 sysfs 与 /proc，空闲设备每次检查只有几次小文件读取
+    - 停滞判定基于完成计数是否前进，而不是在途数量，慢而有进展的 I/O 不会误判
+    - 状态变化写入 <运行目录>/health/nbdN.json，供 sessions 动作展示
+    - 连续重连失败达到上限后标记为 failed，不再重试
+    """
+
+    def __init__(
+        self,
+        device,
+        interval: float = 0.5,
+        io_timeout: int = DEFAULT_IO_TIMEOUT,
+        dead_conn_timeout: int = DEFAULT_DEAD_CONN_TIMEOUT,
+        stall_timeout: Optional[float] = None,
+        max_reconnects: int = 5,
+        state_dir: Optional[Path] = None
+    ):
+        """
+        :param device: 已连接的 NBDDevice
+        :param interval: 检查间隔（秒）
+        :param io_timeout: 内核请求超时（秒）
+        :param dead_conn_timeout: 连接失效后内核等待重连的时间（秒，netlink 后端）
+        :param stall_timeout: 有在途 I/O 但无完成的最长容忍时间，默认等于 io_timeout
+        :param max_reconnects: 连续重连失败的上限
+        :param state_dir: 健康状态文件目录，为空时不写文件
+        """
+        super().__init__(name=f"watchdog-{os.path.basename(device.device_path)}", daemon=True)
+        self.device = device
+        self.device_path = device.device_path
+        self.interval = interval
+        self.io_timeout = io_timeout
+        self.dead_conn_timeout = dead_conn_timeout
+        self.stall_timeout = stall_timeout if stall_timeout is not None else float(io_timeout)
+        self.max_reconnects = max_reconnects
+        self.state_file = state_dir / f"{os.path.basename(self.device_path)}.json" if state_dir else None
+        self.health = DeviceHealth(self.device_path, device.BACKEND)
+        self._stop_event = threading.Event()
+        self._completed = read_completed(self.device_path)
+        self._progress_at = time.monotonic()
+        self._failures = 0
+
+    # ---------- 状态 ----------
+
+    def _set_state(self, state: str, error: Optional[str] = None) -> None:
+        if error:
+            self.health.last_error = error
+        if state == self.health.state and not error:
+            return
+        self.health.state = state
+        self.health.since = time.time()
+        self._write_state()
+
+    def _write_state(self) -> None:
+        if not self.state_file:
+            return
+        try:
+            self.state_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            tmp = self.state_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.health.to_dict(), ensure_ascii=False))
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            logger.debug(f"写入健康状态失败: {e}")
+            self.state_file = None
+
+    # ---------- 检查 ----------
+
+    def _server_alive(self) -> bool:
+        pid = self.device.server_pid
+        self.health.server_pid = pid
+        return pid is None or is_owner_alive(pid)
+
+    def _stalled(self) -> bool:
+        """有在途请求且完成计数超过 stall_timeout 没有前进"""
+        now = time.monotonic()
+        completed = read_completed(self.device_path)
+        self.health.inflight = read_inflight(self.device_path)
+        if completed != self._completed or not any(self.health.inflight):
+            self._completed = completed
+            self._progress_at = now
+            return False
+        if now - self._progress_at < self.stall_timeout:
+            return False
+        # 每个 stall_timeout 周期只报告一次
+        self._progress_at = now
+        return True
+
+    def check(self) -> str:
+        """执行一次检查，返回当前状态"""
+        if self.health.state in (FAILED, DISCONNECTED):
+            return self.health.state
+        if self.device.sys_pid() is None and self.health.state != RECONNECTING:
+            # pid 文件消失：内核已断开设备（ioctl 服务进程退出，或死连接等待超时）
+            self._set_state(DISCONNECTED, "内核已断开设备")
+            logger.error(f"✗ {self.device_path} 已断开，挂载点上的 I/O 将返回错误")
+            return self.health.state
+
+        if self.health.state == RECONNECTING:
+            # 上次重连失败，继续重试
+            self._recover(self.health.last_error or "重连失败")
+        elif not self._server_alive():
+            self._recover(f"服务进程 {self.health.server_pid} 已退出")
+        elif self._stalled():
+            self.health.stalls += 1
+            logger.warning(f"⚠ {self.device_path} I/O 停滞 {self.stall_timeout:.0f}s "
+                           f"(在途 {sum(self.health.inflight)})")
+            self._set_state(STALLED, "I/O 停滞")
+            if self.device.CAN_RECONNECT:
+                # 结束卡住的服务进程，让内核把连接标记为失效，随后重建
+                self._kill_server()
+                self._recover("I/O 停滞")
+        elif self.health.state != HEALTHY:
+            logger.info(f"✓ {self.device_path} 已恢复")
+            self._failures = 0
+            self._set_state(HEALTHY)
+        return self.health.state
+
+    def _kill_server(self) -> None:
+        pid = self.device.server_pid
+        if pid and is_owner_alive(pid):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _recover(self, reason: str) -> None:
+        if not self.device.CAN_RECONNECT:
+            self._set_state(FAILED, reason)
+            logger.error(f"✗ {self.device_path}: {reason}，{self.device.BACKEND} 后端无法重连，"
+                         f"挂起的 I/O 将在 {self.io_timeout}s 内失败")
+            return
+        self._set_state(RECONNECTING, reason)
+        logger.warning(f"⚠ {self.device_path}: {reason}，重建连接...")
+        try:
+            self.device.reconnect()
+        except Exception as e:
+            self._failures += 1
+            self.health.last_error = f"重连失败: {e}"
+            logger.error(f"✗ {self.device_path} 第 {self._failures} 次重连失败: {e}")
+            if self._failures >= self.max_reconnects:
+                self._set_state(FAILED)
+            else:
+                self._write_state()
+            return
+        self._failures = 0
+        self.health.reconnects += 1
+        self.health.server_pid = self.device.server_pid
+        self._progress_at = time.monotonic()
+        logger.info(f"✓ {self.device_path} 已重连（第 {self.health.reconnects} 次）")
+        self._set_state(HEALTHY)
+
+    # ---------- 生命周期 ----------
+
+    def start(self) -> None:
+        """缩短内核超时并开始监视"""
+        try:
+            self.device.set_timeouts(self.io_timeout, self.dead_conn_timeout)
+        except Exception as e:
+            logger.warning(f"设置 {self.device_path} 超时失败: {e}")
+        self.health.server_pid = self.device.server_pid
+        self._write_state()
+        super().start()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                if self.check() in (FAILED, DISCONNECTED):
+                    break
+            except Exception as e:
+                logger.debug(f"健康检查出错: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        if self.state_file:
+            self.state_file.unlink(missing_ok=True)
+
+    def __repr__(self) -> str:
+        return f"Watchdog(device='{self.device_path}', health={self.health})"
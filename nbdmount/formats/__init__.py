@@ -1,55 +1,182 @@
-"""
-镜像格式工厂 - 体现开闭原则（对扩展开放，对修改关闭）
-"""
-from typing import List, Type, Optional
-from .base import ImageFormat
-from .qcow2 import QCOW2Image
-from .raw import RAWImage
-from ..exceptions.errors import ImageFormatError
-
-
-# 注册支持的格式（按优先级排序）
-SUPPORTED_FORMATS: List[Type[ImageFormat]] = [
-    QCOW2Image,
-    RAWImage,
-    # 可在此添加更多格式：VMDKImage, VDIImage 等
-]
-
-
-def detect_image_format(image_path: str, format_hint: Optional[str] = None) -> ImageFormat:
-    """
-    自动检测或根据提示创建镜像格式对象
-    
-    :param image_path: 镜像文件路径
-    :param format_hint: 可选的格式提示（如 "qcow2"）
-    :return: ImageFormat 实例
-    :raises ImageFormatError: 无法识别格式时
-    """
-    # 1. 如果有格式提示，优先使用
-    if format_hint:
-        format_hint = format_hint.lower()
-        for fmt_cls in SUPPORTED_FORMATS:
-            if format_hint in fmt_cls.FORMAT_NAME.lower():
-                try:
-                    img = fmt_cls(image_path)
-                    if img.validate():
-                        return img
-                except Exception:
-                    continue
-        raise ImageFormatError(f"指定的格式 '{format_hint}' 不受支持或验证失败")
-
-    # 2. 按优先级自动检测
-    for fmt_cls in sorted(SUPPORTED_FORMATS, key=lambda x: x.PRIORITY):
-        try:
-            if fmt_cls.detect(image_path):
-                img = fmt_cls(image_path)
-                if img.validate():
-                    return img
-        except Exception as e:
-            logger.debug(f"{fmt_cls.__name__} 检测失败: {e}")
-            continue
-
-    raise ImageFormatError(
-        f"无法识别镜像格式: {image_path}\n"
-        f"支持的格式: {', '.join(f.FORMAT_NAME for f in SUPPORTED_FORMATS)}"
-    )
\ No newline at end of file
+"""
+镜像格式工厂 - 体现开闭原则（对扩展开放，对修改关闭）
+
+格式检测只读取一次镜像头部（VHD 固定盘额外读取一次尾部），
+然后通过预先构建的魔数表分派，成本与已注册格式数量无关
+"""
+import logging
+import os
+from typing import Dict, List, Type, Optional, Tuple
+from .base import ImageFormat
+from .probe import ImageProbe, read_probe, read_footer
+from .qcow2 import QCOW2Image
+from .vmdk import VMDKImage
+from .vdi import VDIImage
+from .vhd import VHDImage, VHDXImage
+from .luks import LUKSImage
+from .iso import ISOImage
+from .raw import RAWImage
+from ..exceptions.errors import ImageFormatError
+
+
+logger = logging.getLogger(__name__)
+
+
+# 注册支持的格式（按优先级排序）
+SUPPORTED_FORMATS: List[Type[ImageFormat]] = sorted([
+    QCOW2Image,
+    VHDXImage,
+    VMDKImage,
+    VDIImage,
+    VHDImage,
+    LUKSImage,
+    ISOImage,
+    RAWImage,
+], key=lambda x: x.PRIORITY)
+
+# 兜底格式：魔数表全部未命中时使用
+FALLBACK_FORMAT: Type[ImageFormat] = RAWImage
+
+# --format 可接受的名称（含 qemu 别名）
+FORMAT_ALIASES: Dict[str, Type[ImageFormat]] = {
+    **{fmt.FORMAT_NAME: fmt for fmt in SUPPORTED_FORMATS},
+    "vpc": VHDImage,
+    "iso9660": ISOImage,
+}
+FORMAT_NAMES: List[str] = [fmt.FORMAT_NAME for fmt in SUPPORTED_FORMATS]
+
+# 魔数表: (偏移, 长度) -> {魔数: [格式类（按优先级）]}
+# 尾部表的偏移为相对镜像末尾的负数
+MagicTable = Dict[Tuple[int, int], Dict[bytes, List[Type[ImageFormat]]]]
+
+
+def _build_magic_tables() -> Tuple[MagicTable, MagicTable, int, int]:
+    """由各格式声明的 MAGIC / FOOTER_MAGIC 预先构建分派表"""
+    header_table: MagicTable = {}
+    footer_table: MagicTable = {}
+    header_size = footer_size = 0
+    for fmt_cls in SUPPORTED_FORMATS:
+        for offset, magic in fmt_cls.MAGIC:
+            header_table.setdefault((offset, len(magic)), {}).setdefault(magic, []).append(fmt_cls)
+            header_size = max(header_size, offset + len(magic))
+        for offset, magic in fmt_cls.FOOTER_MAGIC:
+            rel = offset - fmt_cls.FOOTER_SIZE
+            footer_table.setdefault((rel, len(magic)), {}).setdefault(magic, []).append(fmt_cls)
+            footer_size = max(footer_size, fmt_cls.FOOTER_SIZE)
+    return header_table, footer_table, header_size, footer_size
+
+
+_HEADER_TABLE, _FOOTER_TABLE, _HEADER_SIZE, _FOOTER_SIZE = _build_magic_tables()
+
+
+def _lookup(table: MagicTable, data: bytes, from_end: bool = False) -> List[Type[ImageFormat]]:
+    """在魔数表中查找命中的格式"""
+    hits: List[Type[ImageFormat]] = []
+    base = len(data) if from_end else 0
+    for (offset, length), magics in table.items():
+        start = base + offset
+        if start < 0 or start + length > len(data):
+            continue
+        hits.extend(magics.get(data[start:start + length], ()))
+    return hits
+
+
+def _match_probe(probe: ImageProbe, fd: Optional[int] = None) -> List[Type[ImageFormat]]:
+    """在探测数据上匹配候选格式，头部未命中时按需补读尾部"""
+    candidates = _lookup(_HEADER_TABLE, probe.header)
+    if not candidates and _FOOTER_TABLE:
+        if not probe.footer and fd is not None:
+            read_footer(probe, _FOOTER_SIZE, fd)
+        candidates = _lookup(_FOOTER_TABLE, probe.footer, from_end=True)
+    unique = sorted(set(candidates), key=lambda x: x.PRIORITY)
+    return [fmt_cls for fmt_cls in unique if fmt_cls.match(probe)]
+
+
+def probe_image_formats(image_path: str) -> List[Type[ImageFormat]]:
+    """
+    读取镜像头部并返回命中的格式（按优先级排序）
+
+    :param image_path: 镜像文件路径
+    :return: 候选格式类列表，空列表表示只能按 RAW 处理
+    """
+    fd = os.open(image_path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        probe = read_probe(image_path, header_size=_HEADER_SIZE, fd=fd)
+        return _match_probe(probe, fd)
+    finally:
+        os.close(fd)
+
+
+def detect_image_format(
+    image_path: str,
+    format_hint: Optional[str] = None,
+    validate: bool = True
+) -> ImageFormat:
+    """
+    自动检测或根据提示创建镜像格式对象
+
+    :param image_path: 镜像文件路径
+    :param format_hint: 可选的格式提示（如 "qcow2"）
+    :param validate: 为 False 时只按魔数选出首个候选，不调用 validate()（供启动流程先行使用）
+    :return: ImageFormat 实例
+    :raises ImageFormatError: 无法识别格式时
+    """
+    if not validate:
+        return _guess_image_format(image_path, format_hint)
+
+    # 1. 如果有格式提示，优先使用
+    if format_hint:
+        fmt_cls = FORMAT_ALIASES.get(format_hint.lower())
+        if fmt_cls:
+            try:
+                img = fmt_cls(image_path)
+                if img.validate():
+                    return img
+            except Exception as e:
+                logger.debug(f"{fmt_cls.__name__} 验证失败: {e}")
+        raise ImageFormatError(f"指定的格式 '{format_hint}' 不受支持或验证失败")
+
+    # 2. 单次读取头部，通过魔数表分派
+    try:
+        candidates = probe_image_formats(image_path)
+    except OSError as e:
+        raise ImageFormatError(f"读取镜像头部失败: {e}")
+
+    for fmt_cls in candidates:
+        try:
+            img = fmt_cls(image_path)
+            if img.validate():
+                return img
+            logger.debug(f"{fmt_cls.__name__} 魔数命中但验证未通过")
+        except Exception as e:
+            logger.debug(f"{fmt_cls.__name__} 检测失败: {e}")
+
+    # 魔数命中却全部验证失败：不降级为 RAW，以免把损坏的容器格式当作裸盘导出
+    if candidates:
+        raise ImageFormatError(
+            f"镜像疑似 {'/'.join(f.FORMAT_NAME for f in candidates)} 格式但验证失败: {image_path}"
+        )
+
+    # 3. RAW 兜底
+    img = FALLBACK_FORMAT(image_path)
+    if img.validate():
+        return img
+
+    raise ImageFormatError(
+        f"无法识别镜像格式: {image_path}\n"
+        f"支持的格式: {', '.join(FORMAT_NAMES)}"
+    )
+
+
+def _guess_image_format(image_path: str, format_hint: Optional[str] = None) -> ImageFormat:
+    """只读头部选出最可能的格式，不做完整验证"""
+    if format_hint:
+        fmt_cls = FORMAT_ALIASES.get(format_hint.lower())
+        if not fmt_cls:
+            raise ImageFormatError(f"指定的格式 '{format_hint}' 不受支持或验证失败")
+        return fmt_cls(image_path)
+    try:
+        candidates = probe_image_formats(image_path)
+    except OSError as e:
+        raise ImageFormatError(f"读取镜像头部失败: {e}")
+    return (candidates[0] if candidates else FALLBACK_FORMAT)(image_path)
@@ -1,51 +1,86 @@
-"""
-镜像格式抽象层 - 体现多态设计
-"""
-from abc import ABC, abstractmethod
-from pathlib import Path
-from typing import ClassVar
-
-
-class ImageFormat(ABC):
-    """
-    抽象镜像格式接口
-    
-    设计亮点:
-    - 通过类属性标识格式名称
-    - 统一验证接口
-    - 工厂方法支持自动检测
-    """
-    FORMAT_NAME: ClassVar[str] = "unknown"
-    PRIORITY: ClassVar[int] = 100  # 优先级，数值越小优先级越高
-
-    def __init__(self, image_path: str):
-        self.image_path = Path(image_path).resolve()
-        self._validate_path()
-
-    def _validate_path(self) -> None:
-        """验证镜像路径有效性"""
-        if not self.image_path.exists():
-            raise FileNotFoundError(f"镜像文件不存在: {self.image_path}")
-        if not self.image_path.is_file():
-            raise ValueError(f"路径不是常规文件: {self.image_path}")
-        if not os.access(self.image_path, os.R_OK):
-            raise PermissionError(f"无权读取镜像文件: {self.image_path}")
-
-    @abstractmethod
-    def get_qemu_format_flag(self) -> str:
-        """返回 qemu-nbd 对应的 -f 参数值"""
-        pass
-
-    @abstractmethod
-    def validate(self) -> bool:
-        """验证镜像格式有效性"""
-        pass
-
-    @classmethod
-    @abstractmethod
-    def detect(cls, image_path: str) -> bool:
-        """检测文件是否为此格式"""
-        pass
-
-    def __repr__(self) -> str:
-        return f"{self.__class__.__name__}(path='{self.image_path}', format='{self.FORMAT_NAME}')"
\ No newline at end of file
+"""
+镜像格式抽象层 - 体现多态设计
+"""
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import ClassVar, List, Tuple
+
+from .probe import ImageProbe, read_probe
+
+
+class ImageFormat(ABC):
+    """
+    抽象镜像格式接口
+
+    设计亮点:
+    - 通过类属性标识格式名称
+    - 通过魔数表声明检测规则，由工厂统一分派
+    - 统一验证接口
+    - 工厂方法支持自动检测
+    """
+    FORMAT_NAME: ClassVar[str] = "unknown"
+    PRIORITY: ClassVar[int] = 100  # 优先级，数值越小优先级越高
+    # 头部魔数表: ((偏移, 魔数), ...)，任一命中即视为候选
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ()
+    # 尾部魔数表（相对镜像末尾 FOOTER_SIZE 字节的偏移），仅头部未命中时才读取
+    FOOTER_MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ()
+    FOOTER_SIZE: ClassVar[int] = 512
+    # 文件字节布局即客户机视角（可由内核 loop 设备直接提供，无需 qemu-nbd 解码）
+    RAW_LAYOUT: ClassVar[bool] = False
+
+    def __init__(self, image_path: str):
+        self.image_path = Path(image_path).resolve()
+        self._validate_path()
+
+    def _validate_path(self) -> None:
+        """验证镜像路径有效性"""
+        if not self.image_path.exists():
+            raise FileNotFoundError(f"镜像文件不存在: {self.image_path}")
+        if not self.image_path.is_file():
+            raise ValueError(f"路径不是常规文件: {self.image_path}")
+        if not os.access(self.image_path, os.R_OK):
+            raise PermissionError(f"无权读取镜像文件: {self.image_path}")
+
+    @abstractmethod
+    def get_qemu_format_flag(self) -> str:
+        """返回 qemu-nbd 对应的 -f 参数值"""
+        pass
+
+    @abstractmethod
+    def validate(self) -> bool:
+        """验证镜像格式有效性"""
+        pass
+
+    def qemu_source_args(self) -> List[str]:
+        """返回 qemu-nbd 打开数据源所需的参数（格式 + 文件名）"""
+        return ["--format", self.get_qemu_format_flag(), str(self.image_path)]
+
+    def on_attach(self) -> None:
+        """设备连接前的钩子（如登记共享导出的引用）"""
+
+    def on_detach(self) -> None:
+        """设备断开后的钩子"""
+
+    @classmethod
+    def match(cls, probe: ImageProbe) -> bool:
+        """
+        在已读取的探测数据上做精确匹配
+
+        魔数表命中后调用，子类可覆盖以检查版本号等附加字段
+        """
+        return True
+
+    @classmethod
+    def detect(cls, image_path: str) -> bool:
+        """检测文件是否为此格式"""
+        try:
+            probe = read_probe(image_path, footer_size=cls.FOOTER_SIZE if cls.FOOTER_MAGIC else 0)
+        except OSError:
+            return False
+        hit = any(probe.header_startswith(off, magic) for off, magic in cls.MAGIC) or \
+            any(probe.footer_startswith(off, magic) for off, magic in cls.FOOTER_MAGIC)
+        return hit and cls.match(probe)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(path='{self.image_path}', format='{self.FORMAT_NAME}')"
@@ -0,0 +1,20 @@
+"""
+ISO9660 光盘镜像实现
+"""
+from typing import ClassVar, Tuple
+from .base import ImageFormat
+
+
+class ISOImage(ImageFormat):
+    """ISO9660 光盘镜像（含 isohybrid），以 raw 方式导出"""
+    FORMAT_NAME: ClassVar[str] = "iso"
+    PRIORITY: ClassVar[int] = 40
+    RAW_LAYOUT: ClassVar[bool] = True
+    # 系统区 16 个 2048 字节扇区之后的主卷描述符标识
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0x8001, b"CD001"),)
+
+    def get_qemu_format_flag(self) -> str:
+        return "raw"
+
+    def validate(self) -> bool:
+        return self.image_path.stat().st_size >= 0x8800
@@ -0,0 +1,25 @@
+"""
+LUKS 加密容器镜像实现
+"""
+from typing import ClassVar, Tuple
+from .base import ImageFormat
+
+
+class LUKSImage(ImageFormat):
+    """
+    LUKS1/LUKS2 加密整盘镜像
+
+    以 raw 方式导出密文，由主机侧 cryptsetup 解锁，
+    避免把口令交给 qemu-nbd 的 secret 对象
+    """
+    FORMAT_NAME: ClassVar[str] = "luks"
+    PRIORITY: ClassVar[int] = 30
+    RAW_LAYOUT: ClassVar[bool] = True
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0, b"LUKS\xba\xbe"),)
+
+    def get_qemu_format_flag(self) -> str:
+        return "raw"
+
+    def validate(self) -> bool:
+        # LUKS1 头部 592 字节，LUKS2 至少 16KB，取较小者做下限
+        return self.image_path.stat().st_size >= 592
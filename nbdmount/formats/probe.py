@@ -0,0 +1,70 @@
+"""
+镜像探测数据 - 一次读取，多格式共享
+"""
+import os
+from typing import Optional
+
+
+# 默认头部读取长度，覆盖 ISO9660 主卷描述符（0x8001 处的 "CD001"）
+DEFAULT_HEADER_SIZE = 0x8001 + 5
+
+
+class ImageProbe:
+    """
+    镜像头部/尾部快照
+
+    所有格式的魔数匹配都在同一份字节上完成，避免每种格式各自打开文件
+    """
+
+    def __init__(self, path: str, size: int, header: bytes, footer: bytes = b""):
+        self.path = path
+        self.size = size
+        self.header = header
+        self.footer = footer
+
+    def header_startswith(self, offset: int, magic: bytes) -> bool:
+        """头部指定偏移处是否为给定魔数"""
+        return self.header[offset:offset + len(magic)] == magic
+
+    def footer_startswith(self, offset: int, magic: bytes) -> bool:
+        """尾部指定偏移处是否为给定魔数"""
+        return self.footer[offset:offset + len(magic)] == magic
+
+    def __repr__(self) -> str:
+        return f"ImageProbe(path='{self.path}', size={self.size}, header={len(self.header)}B, footer={len(self.footer)}B)"
+
+
+def read_probe(
+    image_path: str,
+    header_size: int = DEFAULT_HEADER_SIZE,
+    footer_size: int = 0,
+    fd: Optional[int] = None
+) -> ImageProbe:
+    """
+    读取镜像头部（及可选的尾部）
+
+    :param image_path: 镜像文件路径
+    :param header_size: 头部读取字节数
+    :param footer_size: 尾部读取字节数，0 表示不读
+    :param fd: 已打开的文件描述符（由调用方负责关闭）
+    :return: ImageProbe 实例
+    """
+    own_fd = fd is None
+    if own_fd:
+        fd = os.open(image_path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        size = os.fstat(fd).st_size
+        header = os.pread(fd, header_size, 0)
+        footer = b""
+        if footer_size and size >= footer_size:
+            footer = os.pread(fd, footer_size, size - footer_size)
+        return ImageProbe(str(image_path), size, header, footer)
+    finally:
+        if own_fd:
+            os.close(fd)
+
+
+def read_footer(probe: ImageProbe, footer_size: int, fd: int) -> None:
+    """为已有探测结果补读尾部（仅在头部未命中时调用）"""
+    if probe.size >= footer_size:
+        probe.footer = os.pread(fd, footer_size, probe.size - footer_size)
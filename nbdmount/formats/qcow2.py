@@ -1,38 +1,58 @@
-"""
-QCOW2 镜像格式实现
-"""
-import re
-from typing import ClassVar
-from .base import ImageFormat
-from ..utils.command import run_command
-
-
-class QCOW2Image(ImageFormat):
-    """QCOW2 镜像格式"""
-    FORMAT_NAME: ClassVar[str] = "qcow2"
-    PRIORITY: ClassVar[int] = 10  # 高优先级
-
-    def get_qemu_format_flag(self) -> str:
-        return "qcow2"
-
-    def validate(self) -> bool:
-        try:
-            result = run_command(
-                ["qemu-img", "info", str(self.image_path)],
-                capture_output=True,
-                timeout=10
-            )
-            return bool(re.search(r"file format:\s*qcow2", result.stdout, re.IGNORECASE))
-        except Exception as e:
-            logger.warning(f"QCOW2 验证失败: {e}")
-            return False
-
-    @classmethod
-    def detect(cls, image_path: str) -> bool:
-        try:
-            # 快速检测：检查文件魔数
-            with open(image_path, 'rb') as f:
-                magic = f.read(4)
-                return magic == b'QFI\xfb'  # QCOW2 魔数
-        except Exception:
-            return False
\ No newline at end of file
+"""
+QCOW2 镜像格式实现
+"""
+import logging
+import re
+import struct
+from typing import ClassVar, Optional, Tuple
+from .base import ImageFormat
+from .probe import ImageProbe
+from ..utils.command import run_command
+
+
+logger = logging.getLogger(__name__)
+
+
+class QCOW2Image(ImageFormat):
+    """QCOW2 镜像格式"""
+    FORMAT_NAME: ClassVar[str] = "qcow2"
+    PRIORITY: ClassVar[int] = 10  # 高优先级
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0, b"QFI\xfb"),)
+
+    def get_qemu_format_flag(self) -> str:
+        return "qcow2"
+
+    def validate(self) -> bool:
+        try:
+            result = run_command(
+                ["qemu-img", "info", str(self.image_path)],
+                capture_output=True,
+                timeout=10
+            )
+            return bool(re.search(r"file format:\s*qcow2", result.stdout, re.IGNORECASE))
+        except Exception as e:
+            logger.warning(f"QCOW2 验证失败: {e}")
+            return False
+
+    def get_backing_file(self) -> Optional[str]:
+        """读取头部记录的 backing 文件（相对路径按镜像所在目录解析）"""
+        with open(self.image_path, "rb") as f:
+            header = f.read(20)
+            if len(header) < 20:
+                return None
+            offset, size = struct.unpack_from(">QI", header, 8)
+            if not offset or not size:
+                return None
+            f.seek(offset)
+            name = f.read(size).decode("utf-8", "replace")
+        if "://" in name or name.startswith("json:"):
+            return None  # 网络或 json 描述的 backing，无本地路径
+        return str((self.image_path.parent / name).resolve())
+
+    @classmethod
+    def match(cls, probe: ImageProbe) -> bool:
+        # 版本号紧随魔数（大端 u32），仅支持 v2/v3
+        if len(probe.header) < 8:
+            return False
+        version, = struct.unpack_from(">I", probe.header, 4)
+        return version in (2, 3)
@@ -0,0 +1,20 @@
+"""
+VirtualBox VDI 镜像格式实现
+"""
+from typing import ClassVar, Tuple
+from .base import ImageFormat
+
+
+class VDIImage(ImageFormat):
+    """VirtualBox VDI 镜像格式"""
+    FORMAT_NAME: ClassVar[str] = "vdi"
+    PRIORITY: ClassVar[int] = 16
+    # 文本前缀因版本而异，以 0x40 处的小端签名 0xbeda107f 为准
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0x40, b"\x7f\x10\xda\xbe"),)
+
+    def get_qemu_format_flag(self) -> str:
+        return "vdi"
+
+    def validate(self) -> bool:
+        # 头部固定 512 字节以上
+        return self.image_path.stat().st_size >= 512
@@ -0,0 +1,40 @@
+"""
+VHD / VHDX 镜像格式实现
+"""
+from typing import ClassVar, Tuple
+from .base import ImageFormat
+
+
+class VHDImage(ImageFormat):
+    """
+    Microsoft VHD（qemu 中称 vpc）
+
+    动态/差分盘在头部保存一份 footer 副本，固定盘只在末尾有 footer，
+    因此同时声明头部与尾部魔数
+    """
+    FORMAT_NAME: ClassVar[str] = "vhd"
+    PRIORITY: ClassVar[int] = 18
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0, b"conectix"),)
+    # 老版本 Virtual PC 生成的 footer 只有 511 字节
+    FOOTER_MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0, b"conectix"), (1, b"conectix"))
+    FOOTER_SIZE: ClassVar[int] = 512
+
+    def get_qemu_format_flag(self) -> str:
+        return "vpc"
+
+    def validate(self) -> bool:
+        return self.image_path.stat().st_size >= 512
+
+
+class VHDXImage(ImageFormat):
+    """Microsoft VHDX 镜像格式"""
+    FORMAT_NAME: ClassVar[str] = "vhdx"
+    PRIORITY: ClassVar[int] = 12
+    MAGIC: ClassVar[Tuple[Tuple[int, bytes], ...]] = ((0, b"vhdxfile"),)
+
+    def get_qemu_format_flag(self) -> str:
+        return "vhdx"
+
+    def validate(self) -> bool:
+        # 文件标识 64KB + 两份头部 + 区域表，至少 1MB
+        return self.image_path.stat().st_size >= 1024 * 1024
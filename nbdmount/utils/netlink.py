@@ -0,0 +1,166 @@
+"""
+Generic Netlink 最小客户端 - 解析协议族、收发带属性的请求
+
+只实现 nbdmount 用到的部分：按名称解析协议族 ID、发送请求并等待 ACK、
+构造/解析（可嵌套的）属性。套接字可由调用方注入，便于在无内核支持的环境下替换
+"""
+import errno
+import os
+import socket
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+NETLINK_GENERIC = 16
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLMSG_ERROR = 0x02
+NLMSG_DONE = 0x03
+NLA_F_NESTED = 1 << 15
+_NLA_TYPE_MASK = ~(NLA_F_NESTED | (1 << 14))
+
+_NLMSGHDR = struct.Struct("=IHHII")   # len, type, flags, seq, pid
+_GENLMSGHDR = struct.Struct("=BBH")   # cmd, version, reserved
+_NLATTR = struct.Struct("=HH")        # len, type
+
+# 属性: (类型, 已编码的负载)
+Attr = Tuple[int, bytes]
+
+
+def _align(n: int) -> int:
+    return (n + 3) & ~3
+
+
+def nla(attr_type: int, payload: bytes) -> bytes:
+    """编码单个属性（含 4 字节对齐填充）"""
+    length = _NLATTR.size + len(payload)
+    return _NLATTR.pack(length, attr_type) + payload + bytes(_align(length) - length)
+
+
+def nla_u32(attr_type: int, value: int) -> bytes:
+    return nla(attr_type, struct.pack("=I", value))
+
+
+def nla_u64(attr_type: int, value: int) -> bytes:
+    return nla(attr_type, struct.pack("=Q", value))
+
+
+def nla_string(attr_type: int, value: str) -> bytes:
+    return nla(attr_type, value.encode() + b"\x00")
+
+
+def nla_nested(attr_type: int, *children: bytes) -> bytes:
+    return nla(attr_type | NLA_F_NESTED, b"".join(children))
+
+
+def parse_attrs(data: bytes) -> Dict[int, bytes]:
+    """解析属性序列为 {类型: 负载}（去掉 NESTED 等标志位）"""
+    attrs: Dict[int, bytes] = {}
+    pos = 0
+    while pos + _NLATTR.size <= len(data):
+        length, attr_type = _NLATTR.unpack_from(data, pos)
+        if length < _NLATTR.size:
+            break
+        attrs[attr_type & _NLA_TYPE_MASK] = data[pos + _NLATTR.size:pos + length]
+        pos += _align(length)
+    return attrs
+
+
+class NetlinkError(OSError):
+    """内核返回的 netlink 错误（errno 为正值）"""
+
+
+class GenericNetlink:
+    """
+    Generic Netlink 连接
+
+    设计亮点:
+    - 套接字工厂可注入，协议逻辑与内核解耦
+    - 每个请求带递增序列号，只接收匹配的应答
+    """
+
+    def __init__(self, family: str, sock_factory: Optional[Callable[[], socket.socket]] = None):
+        """
+        :param family: 协议族名称（如 "nbd"）
+        :param sock_factory: 返回已绑定 netlink 套接字的工厂，默认创建 NETLINK_GENERIC 套接字
+        :raises NetlinkError: 协议族不存在（如内核模块未加载）
+        """
+        self.sock = (sock_factory or self._default_socket)()
+        self._seq = 0
+        try:
+            reply = self._request(GENL_ID_CTRL, CTRL_CMD_GETFAMILY, [nla_string(CTRL_ATTR_FAMILY_NAME, family)],
+                                  version=1)
+        except Exception:
+            self.close()
+            raise
+        family_id = parse_attrs(reply[0]).get(CTRL_ATTR_FAMILY_ID) if reply else None
+        if not family_id:
+            self.close()
+            raise NetlinkError(errno.ENOENT, f"未找到 generic netlink 协议族: {family}")
+        self.family = family
+        self.family_id, = struct.unpack_from("=H", family_id)
+
+    @staticmethod
+    def _default_socket() -> socket.socket:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        sock.bind((0, 0))
+        return sock
+
+    def _request(self, msg_type: int, cmd: int, attrs: List[bytes], version: int = 1) -> List[bytes]:
+        """发送请求并读取到 ACK 为止，返回各应答消息的属性区"""
+        self._seq += 1
+        seq = self._seq
+        body = _GENLMSGHDR.pack(cmd, version, 0) + b"".join(attrs)
+        self.sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type,
+                                      NLM_F_REQUEST | NLM_F_ACK, seq, 0) + body)
+        replies: List[bytes] = []
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                raise NetlinkError(errno.EIO, "netlink 套接字意外关闭")
+            pos = 0
+            while pos + _NLMSGHDR.size <= len(data):
+                length, rtype, _, rseq, _ = _NLMSGHDR.unpack_from(data, pos)
+                if length < _NLMSGHDR.size:
+                    raise NetlinkError(errno.EPROTO, "netlink 应答长度无效")
+                payload = data[pos + _NLMSGHDR.size:pos + length]
+                pos += _align(length)
+                if rseq != seq:
+                    continue
+                if rtype == NLMSG_ERROR:
+                    err, = struct.unpack_from("=i", payload)
+                    if err:
+                        raise NetlinkError(-err, os.strerror(-err))
+                    return replies
+                if rtype == NLMSG_DONE:
+                    return replies
+                replies.append(payload[_GENLMSGHDR.size:])
+
+    def request(self, cmd: int, attrs: List[bytes], version: int = 1) -> List[bytes]:
+        """
+        向本协议族发送命令
+
+        :return: 应答消息的属性区列表（仅 ACK 时为空）
+        :raises NetlinkError: 内核返回错误
+        """
+        return self._request(self.family_id, cmd, attrs, version)
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self) -> "GenericNetlink":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __repr__(self) -> str:
+        return f"GenericNetlink(family='{getattr(self, 'family', None)}', id={getattr(self, 'family_id', None)})"
@@ -0,0 +1,68 @@
+"""
+跨进程共享的 JSON 状态文件
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+
+def _open_locked(path: Path) -> int:
+    """打开并加锁；若等待期间文件被持锁者删除则重新打开"""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+@contextmanager
+def locked_state(path: Union[str, Path]) -> Iterator[dict]:
+    """
+    以排它锁打开 JSON 状态文件，退出时写回
+
+    :param path: 状态文件路径（不存在时创建为空对象）
+    :yield: 可直接修改的状态字典；清空后文件被删除
+    """
+    path = Path(path)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    fd = _open_locked(path)
+    try:
+        raw = b""
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            raw += chunk
+        try:
+            state = json.loads(raw) if raw.strip() else {}
+        except ValueError:
+            state = {}
+
+        yield state
+
+        if state:
+            data = json.dumps(state, ensure_ascii=False, indent=1).encode()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, data)
+        else:
+            # 持锁删除，后续打开者会重新创建
+            path.unlink(missing_ok=True)
+    finally:
+        os.close(fd)
+
+
+def read_state(path: Union[str, Path]) -> dict:
+    """无锁读取状态文件快照（用于展示）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,169 @@
+"""
+会话资源预算测试 - 以普通目录伪造 cgroupfs
+"""
+import logging
+import os
+import time
+
+import pytest
+
+from nbdmount.core import cgroup, loop_device, netlink_device
+from nbdmount.core.cgroup import CgroupManager, SessionBudget, SessionCgroup
+from nbdmount.core.device import create_device
+from nbdmount.formats.raw import RAWImage
+
+
+DEVICE = "8:0"
+
+
+@pytest.fixture
+def fake_root(tmp_path, monkeypatch):
+    """伪 cgroup2 根：提供 io/cpu/memory 控制器；镜像所在设备固定为 8:0，调度器未知"""
+    (tmp_path / "cgroup.controllers").write_text("io cpu memory\n")
+    (tmp_path / "cgroup.subtree_control").write_text("")
+    monkeypatch.setattr(cgroup, "backing_device", lambda path: DEVICE)
+    monkeypatch.setattr(cgroup, "_queue_attr", lambda device, name: None)
+    return tmp_path
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_budget_validation():
+    with pytest.raises(ValueError):
+        SessionBudget("realtime")
+    with pytest.raises(ValueError):
+        SessionBudget(io_weight=0)
+    with pytest.raises(ValueError):
+        SessionBudget(cpu_weight=10001)
+
+
+def test_io_max_line():
+    assert SessionBudget().io_max(DEVICE) is None
+    assert SessionBudget(read_bps=100 << 20, write_iops=50).io_max(DEVICE) == \
+        "8:0 rbps=104857600 wbps=max riops=max wiops=50"
+
+
+def test_available_requires_cgroup2(tmp_path):
+    assert not CgroupManager(root=tmp_path).available()
+    (tmp_path / "cgroup.controllers").write_text("io\n")
+    assert CgroupManager(root=tmp_path).available()
+
+
+def test_place_creates_leaf_and_writes_budget(fake_root):
+    manager = CgroupManager(root=fake_root)
+    budget = SessionBudget("bulk", read_bps=200 << 20, io_weight=300, cpu_weight=80, memory_high=512 << 20)
+    group = manager.place("nbd0-4242", 4242, budget, "/images/disk.qcow2")
+
+    assert group.path == fake_root / "nbdmount" / "bulk" / "nbd0-4242"
+    assert group.priority == "bulk"
+    assert group.pids() == [4242]
+    assert (group.path / "io.max").read_text() == "8:0 rbps=209715200 wbps=max riops=max wiops=max"
+    assert (group.path / "io.weight").read_text() == "default 300"
+    assert (group.path / "cpu.weight").read_text() == "80"
+    assert (group.path / "memory.high").read_text() == str(512 << 20)
+
+    # 根节点向下放开控制器（伪目录中子节点没有内核生成的 cgroup.controllers），优先级节点带各自的权重
+    assert (fake_root / "cgroup.subtree_control").read_text() == "+io\n+cpu\n+memory\n"
+    bulk = fake_root / "nbdmount" / "bulk"
+    assert (bulk / "io.weight").read_text() == "default 50"
+    assert (bulk / "cpu.weight").read_text() == "50"
+
+
+def test_interactive_node_gets_latency_target(fake_root):
+    manager = CgroupManager(root=fake_root)
+    manager.place("nbd1-1", 1, SessionBudget("bulk", read_bps=1 << 20), "/images/a.qcow2")
+    interactive = fake_root / "nbdmount" / "interactive"
+    assert (interactive / "io.latency").read_text() == f"8:0 target={cgroup.LATENCY_TARGET_US[False]}"
+    assert (interactive / "io.weight").read_text() == "default 500"
+
+
+def test_latency_target_for_rotational_device(fake_root, monkeypatch):
+    monkeypatch.setattr(cgroup, "_queue_attr", lambda device, name: "1" if name == "rotational" else None)
+    CgroupManager(root=fake_root).create("s", SessionBudget(), DEVICE)
+    assert (fake_root / "nbdmount" / "interactive" / "io.latency").read_text() == \
+        f"8:0 target={cgroup.LATENCY_TARGET_US[True]}"
+
+
+@pytest.mark.parametrize("scheduler, cost_qos, warned", [
+    ("none [mq-deadline] kyber bfq", "", True),
+    ("mq-deadline kyber [bfq]", "", False),
+    ("[none] mq-deadline", "8:0 enable=1 ctrl=auto rpct=95.00 rlat=5000", False),
+    ("[none] mq-deadline", "8:16 enable=1 ctrl=auto", True),
+])
+def test_warns_when_io_weight_is_ineffective(fake_root, monkeypatch, caplog, scheduler, cost_qos, warned):
+    monkeypatch.setattr(cgroup, "_queue_attr", lambda device, name: scheduler if name == "scheduler" else "0")
+    (fake_root / "io.cost.qos").write_text(cost_qos)
+    with caplog.at_level(logging.WARNING, logger=cgroup.__name__):
+        manager = CgroupManager(root=fake_root)
+        manager.create("a", SessionBudget("bulk"), DEVICE)
+        manager.create("b", SessionBudget("bulk"), DEVICE)
+    messages = [r.getMessage() for r in caplog.records if "io.weight" in r.getMessage()]
+    assert len(messages) == (1 if warned else 0)
+
+
+def test_unavailable_root_skips_budget(tmp_path):
+    assert CgroupManager(root=tmp_path).place("x", 1, SessionBudget(), "/images/a.qcow2") is None
+    assert not (tmp_path / "nbdmount").exists()
+
+
+def test_io_stat_parsing(fake_root):
+    group = CgroupManager(root=fake_root).create("s", SessionBudget(), DEVICE)
+    (group.path / "io.stat").write_text(
+        "8:0 rbytes=1048576 wbytes=4096 rios=10 wios=1 dbytes=0 dios=0\n"
+        "\n"
+        "8:16 rbytes=512 wbytes=0 rios=1 wios=0 dbytes=0 dios=0 cost.usage=12\n"
+    )
+    assert group.io_stat() == {
+        "8:0": {"rbytes": 1048576, "wbytes": 4096, "rios": 10, "wios": 1, "dbytes": 0, "dios": 0},
+        "8:16": {"rbytes": 512, "wbytes": 0, "rios": 1, "wios": 0, "dbytes": 0, "dios": 0},
+    }
+    assert group.io_totals() == {"rbytes": 1049088, "wbytes": 4096, "rios": 11, "wios": 1, "dbytes": 0, "dios": 0}
+    assert SessionCgroup(fake_root / "missing", "bulk").io_stat() == {}
+
+
+def test_sessions_and_prune(fake_root):
+    manager = CgroupManager(root=fake_root)
+    busy = manager.place("busy", 100, SessionBudget("interactive"), "/images/a.qcow2")
+    idle = manager.create("idle", SessionBudget("bulk"), DEVICE)
+    fresh = manager.create("fresh", SessionBudget("bulk"), DEVICE)
+    assert sorted(g.name for g in manager.sessions()) == ["busy", "fresh", "idle"]
+
+    _age(busy.path, 3600)
+    _age(idle.path, 3600)
+    assert manager.prune() == 1
+    assert not idle.path.exists()
+    # 仍有进程的节点与刚创建的节点保留
+    assert busy.path.exists() and fresh.path.exists()
+    assert not busy.remove()
+    assert fresh.remove() and not fresh.path.exists()
+
+
+@pytest.fixture
+def raw_image(tmp_path, monkeypatch):
+    """RAW 镜像，loop 与 nbd 后端都可用（netlink 不可用时 auto 落到 ioctl）"""
+    control = tmp_path / "loop-control"
+    control.write_text("")
+    monkeypatch.setattr(loop_device, "LOOP_CONTROL", str(control))
+    monkeypatch.setattr(netlink_device, "netlink_available", lambda *args: False)
+    path = tmp_path / "disk.raw"
+    path.write_bytes(b"\0" * 4096)
+    return RAWImage(str(path))
+
+
+def test_auto_backend_avoids_loop_when_budgeted(raw_image):
+    assert create_device(raw_image).BACKEND == "loop"
+    assert create_device(raw_image, budget=SessionBudget("bulk", read_bps=100 << 20)).BACKEND == "ioctl"
+
+
+def test_budget_without_server_process_warns(raw_image, fake_root, caplog):
+    device = create_device(raw_image, "loop")
+    device.set_budget(SessionBudget("bulk", read_bps=100 << 20), CgroupManager(root=fake_root))
+    device.device_path = "/dev/loop7"
+    with caplog.at_level(logging.WARNING, logger="nbdmount.core.device"):
+        device._place_server()
+    assert device.cgroup is None
+    assert any("资源预算未生效" in r.getMessage() for r in caplog.records)
+    assert not (fake_root / "nbdmount").exists()
@@ -0,0 +1,45 @@
+"""
+共享导出登记与启动测试 - 登记表放在临时目录，不启动 qemu-nbd
+"""
+import os
+
+import pytest
+
+from nbdmount.core import export
+from nbdmount.core.export import ExportRegistry, ExportServer
+from nbdmount.exceptions.errors import DeviceBusyError, DeviceNotFoundError
+
+
+def test_acquire_and_release(tmp_path):
+    registry = ExportRegistry(str(tmp_path))
+    registry.register("disk", {"pid": os.getpid(), "uri": "nbd+unix:///disk"})
+    assert registry.acquire("disk", pid=os.getpid())["uri"] == "nbd+unix:///disk"
+    assert registry.refcount("disk") == 1
+    registry.release("disk", pid=os.getpid())
+    assert registry.refcount("disk") == 0
+
+
+def test_acquire_dead_export_removes_entry(tmp_path):
+    registry = ExportRegistry(str(tmp_path))
+    registry.register("disk", {"pid": 2 ** 22 + 1})
+    with pytest.raises(DeviceNotFoundError):
+        registry.acquire("disk")
+    assert not (registry.root / "disk.json").exists()
+
+
+def test_start_leaves_live_export_untouched(tmp_path, monkeypatch):
+    registry = ExportRegistry(str(tmp_path))
+    registry.register("disk", {"pid": os.getpid()})
+    sock = registry.root / "disk.sock"
+    pid_file = registry.root / "disk.pid"
+    sock.write_text("")
+    pid_file.write_text(str(os.getpid()))
+
+    def no_spawn(*args, **kwargs):
+        raise AssertionError("不应启动 qemu-nbd")
+
+    monkeypatch.setattr(export, "run_command", no_spawn)
+    with pytest.raises(DeviceBusyError):
+        ExportServer(image=None, name="disk", registry=registry).start()
+    assert sock.exists() and pid_file.exists()
+    assert registry.lookup("disk")["pid"] == os.getpid()
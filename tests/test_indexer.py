@@ -0,0 +1,56 @@
+"""
+增量文件清单索引测试 - 以普通目录代替已挂载分区
+"""
+import os
+import sqlite3
+
+from nbdmount.analysis.indexer import ManifestIndexer
+from nbdmount.core.mounter import MountPoint
+
+
+BAD_NAME = b"bad\xff.bin"
+
+
+def _mounts(root):
+    mp = MountPoint("nbd0p1", root / "part1")
+    mp.is_mounted = True
+    return {"nbd0p1": mp}
+
+
+def _rows(db):
+    conn = sqlite3.connect(str(db))
+    try:
+        return {path: digest for path, digest in conn.execute("SELECT path, hash FROM files")}
+    finally:
+        conn.close()
+
+
+def test_non_utf8_names_are_stored_as_bytes(tmp_path):
+    part = tmp_path / "part1"
+    part.mkdir()
+    with open(os.path.join(os.fsencode(part), BAD_NAME), "wb") as f:
+        f.write(b"payload")
+    (part / "ok.txt").write_text("text")
+
+    first = tmp_path / "a.db"
+    stats = ManifestIndexer(str(first), hash_algo="sha256").index(_mounts(tmp_path))
+    assert (stats.entries, stats.hashed, stats.errors) == (2, 2, 0)
+    rows = _rows(first)
+    assert set(rows) == {BAD_NAME, b"ok.txt"}
+
+    # 上一清单中的非 UTF-8 路径同样能命中，哈希直接复用
+    second = tmp_path / "b.db"
+    stats = ManifestIndexer(str(second), previous=str(first), hash_algo="sha256").index(_mounts(tmp_path))
+    assert (stats.hashed, stats.reused) == (0, 2)
+    assert _rows(second) == rows
+
+
+def test_unreadable_previous_falls_back_to_hashing(tmp_path):
+    (tmp_path / "part1").mkdir()
+    (tmp_path / "part1" / "f").write_bytes(b"x")
+    broken = tmp_path / "broken.db"
+    broken.write_bytes(b"not a database")
+    output = tmp_path / "out.db"
+    stats = ManifestIndexer(str(output), previous=str(broken), hash_algo="sha256").index(_mounts(tmp_path))
+    assert (stats.hashed, stats.reused) == (1, 0)
+    assert not (tmp_path / "out.db.tmp").exists()
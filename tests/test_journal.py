@@ -0,0 +1,39 @@
+"""
+会话日志与残留会话清理测试 - 日志放在临时目录，属主为不存在的进程
+"""
+from nbdmount.core import journal as journal_mod
+from nbdmount.core.cgroup import CgroupManager
+from nbdmount.core.journal import SessionJournal, cleanup_stale_sessions
+
+
+DEAD_PID = 2 ** 22 + 1
+
+
+def _orphaned_journal(tmp_path, count):
+    journal = SessionJournal(str(tmp_path))
+    journal._owner, journal._owner_start = DEAD_PID, None
+    for i in range(count):
+        device = f"/dev/nbd{i}"
+        journal.record_attach(device, f"/images/{i}.qcow2")
+        journal.record_mount(f"{device}p1", f"/mnt/nbd-{i}/part1")
+        journal.record_mount(f"{device}p2", f"/mnt/nbd-{i}/part2")
+    return journal
+
+
+def test_cleanup_reads_mountinfo_once(tmp_path, monkeypatch):
+    journal = _orphaned_journal(tmp_path, 3)
+    calls, unmounted = [], []
+    monkeypatch.setattr(journal_mod, "read_mounted_targets",
+                        lambda targets: calls.append(set(targets)) or {"/mnt/nbd-1/part2"})
+    monkeypatch.setattr(journal_mod, "run_command", lambda cmd, **kwargs: unmounted.append(cmd[-1]))
+    monkeypatch.setattr(journal_mod, "_teardown_nbd", lambda record: True)
+    monkeypatch.setattr(CgroupManager, "prune", lambda self: 0)
+
+    orphans = cleanup_stale_sessions(SessionJournal(str(tmp_path)), max_workers=2)
+
+    assert sorted(r.device for r in orphans) == ["/dev/nbd0", "/dev/nbd1", "/dev/nbd2"]
+    assert len(calls) == 1
+    assert calls[0] == {f"/mnt/nbd-{i}/part{p}" for i in range(3) for p in (1, 2)}
+    assert unmounted == ["/mnt/nbd-1/part2"]
+    # 全部拆除后日志压缩为空
+    assert SessionJournal(str(tmp_path)).replay() == {}
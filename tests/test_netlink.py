@@ -0,0 +1,199 @@
+"""
+Generic Netlink 客户端与 netlink NBD 后端测试 - 以假 netlink 套接字代替内核
+"""
+import errno
+import socket
+import struct
+
+import pytest
+
+from nbdmount.core import netlink_device
+from nbdmount.core.export import NBDExportImage
+from nbdmount.core.netlink_device import (
+    NBD_ATTR_BLOCK_SIZE_BYTES, NBD_ATTR_CLIENT_FLAGS, NBD_ATTR_DEAD_CONN_TIMEOUT, NBD_ATTR_INDEX,
+    NBD_ATTR_SERVER_FLAGS, NBD_ATTR_SIZE_BYTES, NBD_ATTR_SOCKETS, NBD_ATTR_TIMEOUT,
+    NBD_CFLAG_DESTROY_ON_DISCONNECT, NBD_CMD_CONNECT, NBD_CMD_DISCONNECT, NBD_FLAG_HAS_FLAGS,
+    NBD_FLAG_READ_ONLY, NBD_GENL_VERSION, NBD_SOCK_FD, NBD_SOCK_ITEM, NetlinkNBDDevice, netlink_disconnect
+)
+from nbdmount.utils.netlink import (
+    CTRL_ATTR_FAMILY_ID, CTRL_ATTR_FAMILY_NAME, CTRL_CMD_GETFAMILY, GENL_ID_CTRL, NLA_F_NESTED,
+    NLM_F_ACK, NLM_F_REQUEST, NLMSG_ERROR, GenericNetlink, NetlinkError, nla, nla_u32, parse_attrs
+)
+from nbdmount.exceptions.errors import DeviceError
+
+
+NBD_FAMILY_ID = 0x1a
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_GENLMSGHDR = struct.Struct("=BBH")
+
+
+def _raw_attrs(data: bytes) -> list:
+    """按原始顺序解析属性，保留 NESTED 标志位：[(类型, 负载), ...]"""
+    attrs, pos = [], 0
+    while pos + 4 <= len(data):
+        length, attr_type = struct.unpack_from("=HH", data, pos)
+        attrs.append((attr_type, data[pos + 4:pos + length]))
+        pos += (length + 3) & ~3
+    return attrs
+
+
+class FakeNetlinkSocket:
+    """
+    假 netlink 套接字
+
+    send() 解析请求并交给 handler，handler 返回 (应答属性区列表, errno)；
+    recv() 依次返回应答消息与 NLMSG_ERROR 确认；noise 中的数据先于应答返回
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.noise = []
+        self.closed = False
+        self._pending = []
+
+    def send(self, data: bytes) -> int:
+        length, msg_type, flags, seq, _ = _NLMSGHDR.unpack_from(data)
+        assert length == len(data)
+        assert flags == NLM_F_REQUEST | NLM_F_ACK
+        cmd, version, _ = _GENLMSGHDR.unpack_from(data, _NLMSGHDR.size)
+        attrs = data[_NLMSGHDR.size + _GENLMSGHDR.size:]
+        self.requests.append((msg_type, cmd, version, attrs))
+        replies, err = self.handler(msg_type, cmd, attrs)
+        out = b""
+        for reply in replies:
+            body = _GENLMSGHDR.pack(cmd, version, 0) + reply
+            out += _NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type, 0, seq, 0) + body
+        ack = struct.pack("=i", -err) + data[:_NLMSGHDR.size]
+        out += _NLMSGHDR.pack(_NLMSGHDR.size + len(ack), NLMSG_ERROR, 0, seq, 0) + ack
+        self._pending.extend(self.noise)
+        self._pending.append(out)
+        return len(data)
+
+    def recv(self, size: int) -> bytes:
+        return self._pending.pop(0)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def fake_kernel(nbd_handler=None, family_id=NBD_FAMILY_ID):
+    """返回 (套接字工厂, 已创建的套接字列表)：控制族按名称解析 nbd，其余请求交给 nbd_handler"""
+    sockets = []
+
+    def handler(msg_type, cmd, attrs):
+        if msg_type == GENL_ID_CTRL:
+            assert cmd == CTRL_CMD_GETFAMILY
+            if parse_attrs(attrs)[CTRL_ATTR_FAMILY_NAME] != b"nbd\x00" or family_id is None:
+                return [], errno.ENOENT
+            return [nla(CTRL_ATTR_FAMILY_ID, struct.pack("=H", family_id))], 0
+        assert msg_type == NBD_FAMILY_ID
+        return nbd_handler(cmd, attrs)
+
+    def factory():
+        sock = FakeNetlinkSocket(handler)
+        sockets.append(sock)
+        return sock
+
+    return factory, sockets
+
+
+def test_resolve_family_id():
+    factory, sockets = fake_kernel()
+    with GenericNetlink("nbd", factory) as genl:
+        assert genl.family_id == NBD_FAMILY_ID
+    msg_type, cmd, version, attrs = sockets[0].requests[0]
+    assert (msg_type, cmd, version) == (GENL_ID_CTRL, CTRL_CMD_GETFAMILY, 1)
+    assert parse_attrs(attrs) == {CTRL_ATTR_FAMILY_NAME: b"nbd\x00"}
+    assert sockets[0].closed
+
+
+def test_unknown_family_raises_enoent_and_closes():
+    factory, sockets = fake_kernel(family_id=None)
+    with pytest.raises(NetlinkError) as info:
+        GenericNetlink("nbd", factory)
+    assert info.value.errno == errno.ENOENT
+    assert sockets[0].closed
+    assert not netlink_device.netlink_available(fake_kernel(family_id=None)[0])
+
+
+def test_nlmsg_error_raises_with_errno():
+    factory, _ = fake_kernel(lambda cmd, attrs: ([], errno.EBUSY))
+    with GenericNetlink("nbd", factory) as genl:
+        with pytest.raises(NetlinkError) as info:
+            genl.request(NBD_CMD_CONNECT, [], NBD_GENL_VERSION)
+    assert info.value.errno == errno.EBUSY
+
+
+def test_reply_with_stale_sequence_is_ignored():
+    factory, sockets = fake_kernel(lambda cmd, attrs: ([nla_u32(NBD_ATTR_INDEX, 5)], 0))
+    with GenericNetlink("nbd", factory) as genl:
+        body = _GENLMSGHDR.pack(NBD_CMD_CONNECT, 1, 0) + nla_u32(NBD_ATTR_INDEX, 9)
+        sockets[0].noise.append(_NLMSGHDR.pack(_NLMSGHDR.size + len(body), NBD_FAMILY_ID, 0, 999, 0) + body)
+        reply = genl.request(NBD_CMD_CONNECT, [], NBD_GENL_VERSION)
+    assert [parse_attrs(r) for r in reply] == [{NBD_ATTR_INDEX: struct.pack("=I", 5)}]
+
+
+def test_disconnect_sends_device_index():
+    factory, sockets = fake_kernel(lambda cmd, attrs: ([], 0))
+    netlink_disconnect("/dev/nbd3", factory)
+    _, cmd, version, attrs = sockets[0].requests[1]
+    assert (cmd, version) == (NBD_CMD_DISCONNECT, NBD_GENL_VERSION)
+    assert parse_attrs(attrs) == {NBD_ATTR_INDEX: struct.pack("=I", 3)}
+
+
+def test_disconnect_error_propagates():
+    factory, _ = fake_kernel(lambda cmd, attrs: ([], errno.EINVAL))
+    with pytest.raises(NetlinkError):
+        netlink_disconnect("/dev/nbd3", factory)
+
+
+def test_connect_encodes_attributes_and_parses_index(monkeypatch):
+    pairs = [socket.socketpair() for _ in range(2)]
+    fds = [ours.fileno() for ours, _ in pairs]
+    captured = {}
+
+    def nbd_handler(cmd, attrs):
+        captured["cmd"] = cmd
+        captured["attrs"] = _raw_attrs(attrs)
+        return [nla_u32(NBD_ATTR_INDEX, 7)], 0
+
+    factory, _ = fake_kernel(nbd_handler)
+    device = NetlinkNBDDevice(NBDExportImage("nbd+unix:///disk?socket=/tmp/unused.sock"),
+                              timeout=45, dead_conn_timeout=90, sock_factory=factory)
+    monkeypatch.setattr(device, "_open_sockets", lambda: ([ours for ours, _ in pairs], 1 << 30, NBD_FLAG_HAS_FLAGS))
+    monkeypatch.setattr(netlink_device.time, "sleep", lambda _: None)
+    device._attach(read_only=True)
+
+    assert device.device_path == "/dev/nbd7"
+    assert captured["cmd"] == NBD_CMD_CONNECT
+    attrs = dict(captured["attrs"])
+    # 不带 NBD_ATTR_INDEX，由内核分配设备（index = -1）
+    assert NBD_ATTR_INDEX not in attrs
+    u64 = lambda attr: struct.unpack("=Q", attrs[attr])[0]
+    assert u64(NBD_ATTR_SIZE_BYTES) == 1 << 30
+    assert u64(NBD_ATTR_BLOCK_SIZE_BYTES) == 512
+    assert u64(NBD_ATTR_TIMEOUT) == 45
+    assert u64(NBD_ATTR_DEAD_CONN_TIMEOUT) == 90
+    assert u64(NBD_ATTR_SERVER_FLAGS) == NBD_FLAG_HAS_FLAGS | NBD_FLAG_READ_ONLY
+    assert u64(NBD_ATTR_CLIENT_FLAGS) == NBD_CFLAG_DESTROY_ON_DISCONNECT
+
+    items = _raw_attrs(attrs[NBD_ATTR_SOCKETS | NLA_F_NESTED])
+    assert [t for t, _ in items] == [NBD_SOCK_ITEM | NLA_F_NESTED] * 2
+    assert [parse_attrs(p) for _, p in items] == [{NBD_SOCK_FD: struct.pack("=I", fd)} for fd in fds]
+    # 套接字已交给内核，本进程的描述符随即关闭
+    assert all(ours.fileno() == -1 for ours, _ in pairs)
+    for _, peer in pairs:
+        peer.close()
+
+
+def test_connect_reply_without_index_fails(monkeypatch):
+    factory, _ = fake_kernel(lambda cmd, attrs: ([], 0))
+    device = NetlinkNBDDevice(NBDExportImage("nbd+unix:///disk?socket=/tmp/unused.sock"), sock_factory=factory)
+    ours, peer = socket.socketpair()
+    monkeypatch.setattr(device, "_open_sockets", lambda: ([ours], 4096, NBD_FLAG_HAS_FLAGS))
+    with pytest.raises(DeviceError):
+        device._attach(read_only=True)
+    assert device.device_path is None
+    peer.close()
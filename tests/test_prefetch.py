@@ -0,0 +1,90 @@
+"""
+学习型预读测试 - 以普通文件代替块设备（页缓存驻留语义相同）
+"""
+import os
+
+import pytest
+
+from nbdmount.core import prefetch
+from nbdmount.core.prefetch import PAGE_SIZE, AccessRecorder, PrefetchProfile
+
+
+PAGES = 64
+
+
+@pytest.fixture
+def device(tmp_path):
+    """写入后清出页缓存的伪设备文件"""
+    path = tmp_path / "disk"
+    path.write_bytes(os.urandom(PAGES * PAGE_SIZE))
+    fd = os.open(path, os.O_RDONLY)
+    os.fsync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+    if any(prefetch.page_residency(fd, 0, PAGES * PAGE_SIZE)):
+        os.close(fd)
+        pytest.skip("文件系统不支持清出页缓存")
+    yield str(path), fd
+    os.close(fd)
+
+
+def _read(fd, start, count):
+    os.pread(fd, count * PAGE_SIZE, start * PAGE_SIZE)
+
+
+def test_profile_round_trip_keeps_ages():
+    profile = PrefetchProfile({"": [(0, 4), (100, 2)], "p1": [(7, 1)]}, ages={"": [0, 3], "p1": [1]})
+    loaded = PrefetchProfile.from_bytes(profile.to_bytes())
+    assert loaded.targets == profile.targets
+    assert loaded.ages == profile.ages
+    assert loaded.page_size == PAGE_SIZE
+
+
+def test_v1_profile_loads_with_zero_age():
+    v2 = PrefetchProfile({"p1": [(1, 2), (5, 1)]}).to_bytes()
+    # v1: 同样的头部，区段为 (起始页, 页数) 两元组
+    header_len = len(prefetch._PROFILE_MAGIC) + 8 + 6 + len("p1")
+    flat = v2[header_len:]
+    v1_extents = b"".join(flat[i:i + 16] for i in range(0, len(flat), 24))
+    v1 = prefetch._PROFILE_MAGIC_V1 + v2[len(prefetch._PROFILE_MAGIC):header_len] + v1_extents
+    loaded = PrefetchProfile.from_bytes(v1)
+    assert loaded.targets == {"p1": [(1, 2), (5, 1)]}
+    assert loaded.age_of("p1") == [0, 0]
+
+
+def test_records_first_access_order(device):
+    path, fd = device
+    recorder = AccessRecorder(path, [])
+    _read(fd, 10, 3)
+    recorder._sample()
+    _read(fd, 2, 1)
+    profile = recorder.stop()
+    assert profile.targets == {"": [(10, 3), (2, 1)]}
+    assert profile.age_of("") == [0, 0]
+
+
+def test_replayed_pages_are_not_recorded_and_age_out(device):
+    path, fd = device
+    replayed = PrefetchProfile({"": [(0, 8), (20, 4)]}, ages={"": [0, prefetch._MAX_AGE - 1]})
+    recorder = AccessRecorder(path, [], replayed=replayed)
+    # 回放读入的页与真实访问都表现为驻留
+    os.posix_fadvise(fd, 0, 8 * PAGE_SIZE, os.POSIX_FADV_WILLNEED)
+    _read(fd, 0, 8)
+    _read(fd, 40, 2)
+    profile = recorder.stop()
+    # 回放区段年龄加一，超龄的被丢弃；只有回放之外的访问作为新区段记录
+    assert profile.targets == {"": [(0, 8), (40, 2)]}
+    assert profile.age_of("") == [1, 0]
+
+
+def test_fully_aged_profile_is_saved_empty(device, tmp_path, monkeypatch):
+    path, _ = device
+    replayed = PrefetchProfile({"": [(0, 8)]}, ages={"": [prefetch._MAX_AGE - 1]})
+    profile = AccessRecorder(path, [], replayed=replayed).stop()
+    assert profile.targets == {}
+
+    store = prefetch.PrefetchStore(str(tmp_path / "cache"))
+    monkeypatch.setattr(store, "_keys", lambda image: ["k"])
+    store.save(None, replayed)
+    store.save(None, profile)
+    assert store.load(None).targets == {}
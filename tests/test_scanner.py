@@ -0,0 +1,27 @@
+"""
+内容扫描测试 - 以普通目录代替已挂载分区
+"""
+import json
+import os
+
+from nbdmount.analysis.scanner import ContentScanner, FilenameScanner
+
+
+def test_non_utf8_path_is_escaped_in_ndjson(tmp_path):
+    root = tmp_path / "part1"
+    root.mkdir()
+    bad = b"bad\xff.exe"
+    with open(os.path.join(os.fsencode(root), bad), "wb") as f:
+        f.write(b"MZ")
+    (root / "good.exe").write_bytes(b"MZ")
+
+    output = tmp_path / "hits.ndjson"
+    scanner = ContentScanner([FilenameScanner(["*.exe"])], workers=1)
+    with open(output, "w", encoding="utf-8") as out:
+        stats = scanner.scan_roots({"part1": str(root)}, out)
+    assert stats.findings == 2
+
+    hits = {hit["path"]: hit for hit in map(json.loads, output.read_text(encoding="utf-8").splitlines())}
+    assert set(hits) == {"bad\\xff.exe", "good.exe"}
+    assert bytes.fromhex(hits["bad\\xff.exe"]["path_hex"]) == bad
+    assert "path_hex" not in hits["good.exe"]
@@ -0,0 +1,108 @@
+"""
+流式挂载测试 - 以假 NBDMountTool 代替设备与 mount，登记表放在临时目录
+"""
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+from nbdmount.core import shared
+from nbdmount.core.journal import SessionJournal, process_start_time
+from nbdmount.core.mounter import MountPoint
+from nbdmount.core.shared import SharedRegistry, image_identity
+from nbdmount.core.streaming import MountStream
+from nbdmount.utils.statefile import locked_state, read_state
+
+
+class FakeDevice:
+    BACKEND = "ioctl"
+    device_path = "/dev/nbd9"
+    server_pid = None
+    budget = None
+    cgroup = None
+
+
+class FakeMounter:
+    def __init__(self):
+        self.mounted = []
+
+    def mount_partition(self, source, path, options=None, owner=None):
+        self.mounted.append(source)
+        mp = MountPoint(source, path)
+        mp.is_mounted = True
+        return mp
+
+
+class FakeImage:
+    FORMAT_NAME = "raw"
+
+
+class FakeTool:
+    """只实现 MountStream 与 SharedSession 用到的部分"""
+    shareable = True
+    read_only = True
+
+    def __init__(self, tmp_path):
+        self.image_path = tmp_path / "disk.raw"
+        self.image_path.write_bytes(b"\0" * 512)
+        self.image = FakeImage()
+        self.journal = SessionJournal(str(tmp_path / "run"))
+        self.device = FakeDevice()
+        self.mounter = FakeMounter()
+        self.base_dir = tmp_path / "mnt"
+        self.prepared = 0
+
+    def _resolve_mount_dir(self, mount_dir):
+        return Path(mount_dir).resolve() if mount_dir else self.base_dir
+
+    def mount_options_for(self, source):
+        return ["ro"]
+
+    @contextmanager
+    def _prepared(self, mount_dir=None):
+        self.prepared += 1
+        base = self._resolve_mount_dir(mount_dir)
+        yield [(f"/dev/nbd9p{i}", base / f"part{i}", None) for i in (1, 2)]
+
+
+@pytest.fixture(autouse=True)
+def all_mounted(monkeypatch):
+    # 假挂载点不在 /proc/self/mountinfo 中：登记的路径一律视为已挂载
+    monkeypatch.setattr(shared, "read_mounted_targets", lambda paths: set(paths))
+
+
+def _registry(tool):
+    return SharedRegistry(str(tool.journal.run_dir))
+
+
+def test_stream_joins_live_shared_session(tmp_path):
+    tool = FakeTool(tmp_path)
+    key = image_identity(tool.image_path)
+    mounts = {"/dev/nbd5p1": str(tool.base_dir / "part1")}
+    with locked_state(_registry(tool).path(key)) as state:
+        state.update(key=key, device="/dev/nbd5", mount_dir=str(tool.base_dir), mounts=mounts, options=None,
+                     holders=[{"id": "other", "pid": os.getpid(), "start": process_start_time(os.getpid()),
+                               "mount_dir": str(tool.base_dir), "binds": []}])
+
+    with MountStream(tool) as stream:
+        paths = [str(mp.mount_path) for mp in stream]
+        assert len(read_state(_registry(tool).path(key))["holders"]) == 2
+
+    # 产出共享会话的挂载点，不连接新设备、不在同一目录上重复挂载
+    assert paths == list(mounts.values())
+    assert tool.prepared == 0 and tool.mounter.mounted == []
+    assert [h["id"] for h in read_state(_registry(tool).path(key))["holders"]] == ["other"]
+
+
+def test_stream_creates_and_registers_shared_session(tmp_path):
+    tool = FakeTool(tmp_path)
+    key = image_identity(tool.image_path)
+    with MountStream(tool, max_ahead=1) as stream:
+        sources = sorted(mp.partition for mp in stream)
+        state = read_state(_registry(tool).path(key))
+        assert sorted(state["mounts"]) == sources == ["/dev/nbd9p1", "/dev/nbd9p2"]
+        assert state["device"] == "/dev/nbd9"
+    assert tool.prepared == 1
+    # 最后一个持有者退出后注销
+    assert not read_state(_registry(tool).path(key))